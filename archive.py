@@ -0,0 +1,419 @@
+import os
+import sys
+import mmap
+import json
+import zlib
+import bisect
+import struct
+import secrets
+from datetime import datetime, timedelta
+from decouple import config
+from lib import get_db_connection, seal, unseal, decrypt_row, load_data_keys, generate_data_key, encrypt_data_key
+from lib import DataKey, DataKeyring, LRUCache, AesCbcCipher, DEFAULT_CIPHER
+from storage import get_storage
+
+TABLE_NAME = config("TABLE_NAME", default="auth_log")
+ARCHIVE_DIR = config("ARCHIVE_DIR", default="archive")
+ARCHIVE_AFTER_DAYS = config("ARCHIVE_AFTER_DAYS", default=0, cast=int)
+ARCHIVE_BLOCK_ROWS = config("ARCHIVE_BLOCK_ROWS", default=1024, cast=int)
+ARCHIVE_SEGMENT_ROWS = config("ARCHIVE_SEGMENT_ROWS", default=100_000, cast=int)
+ARCHIVE_BLOCK_CACHE = 16
+ARCHIVE_COMPRESS_LEVEL = 9
+ARCHIVE_CHUNK = 5000
+# Blocks must be authenticated, so the unauthenticated legacy cipher is never used here
+ARCHIVE_CIPHER = "chacha20-poly1305" if DEFAULT_CIPHER == AesCbcCipher.name else DEFAULT_CIPHER
+
+# Id ranges whose rows were expired; partitions.sweep_tokens removes their search tokens later
+SWEEP_INSERT = get_storage().insert_ignore("token_sweeps", ("first_id", "last_id"))
+
+MAGIC = b"LCSEG1"
+HEADER = struct.Struct(">6sQ")       # magic, data key id
+TRAILER = struct.Struct(">QI6s")     # footer offset, footer length, magic
+SUFFIX = ".seg"
+
+def id_runs(ids):
+    """Collapse ascending ids into [first, last] runs of consecutive ids."""
+    runs = []
+    for id_ in ids:
+        if runs and id_ <= runs[-1][1] + 1:
+            runs[-1][1] = max(runs[-1][1], id_)
+        else:
+            runs.append([id_, id_])
+    return runs
+
+class SegmentWriter:
+    """Writes one segment: header, sealed blocks, then the footer index.
+
+    Each block is compressed and then sealed with the segment's data key. The
+    block records which segment and position it belongs to, and the reader
+    checks that against the footer, so blocks cannot be swapped or re-labelled.
+    The file only appears under its final name once it is complete and synced.
+    """
+
+    def __init__(self, directory, key_id, key, block_rows=ARCHIVE_BLOCK_ROWS):
+        self.directory = directory
+        self.key_id = key_id
+        self.key = key
+        self.block_rows = max(1, block_rows)
+        self.segment = secrets.token_hex(8)
+        self.blocks = []
+        self.rows = 0
+        self._pending = []
+        self._tmp = os.path.join(directory, f".{self.segment}.tmp")
+        self._file = open(self._tmp, "wb")
+        self._file.write(HEADER.pack(MAGIC, key_id))
+
+    def add(self, row):
+        """Add (id, timestamp, host, service, message, state); rows must come in id order."""
+        self._pending.append(row)
+        self.rows += 1
+        if len(self._pending) >= self.block_rows:
+            self._flush_block()
+
+    def _flush_block(self):
+        rows = self._pending
+        self._pending = []
+        if not rows:
+            return
+        entry = {
+            "offset": self._file.tell(),
+            "first_id": rows[0][0],
+            "last_id": rows[-1][0],
+            "min_ts": str(min(row[1] for row in rows)),
+            "max_ts": str(max(row[1] for row in rows)),
+            "rows": len(rows),
+            "runs": id_runs(row[0] for row in rows),
+            "states": {},
+        }
+        for row in rows:
+            entry["states"][row[5]] = entry["states"].get(row[5], 0) + 1
+        body = {
+            "segment": self.segment,
+            "block": len(self.blocks),
+            "rows": [(id_, str(ts), host, service, msg, state) for id_, ts, host, service, msg, state in rows],
+        }
+        raw = zlib.compress(json.dumps(body, separators=(",", ":")).encode(), ARCHIVE_COMPRESS_LEVEL)
+        sealed = seal(raw, self.key, ARCHIVE_CIPHER)
+        self._file.write(sealed)
+        entry["length"] = len(sealed)
+        self.blocks.append(entry)
+
+    def finish(self):
+        self._flush_block()
+        footer = json.dumps({"segment": self.segment, "key_id": self.key_id, "blocks": self.blocks}).encode()
+        offset = self._file.tell()
+        self._file.write(footer)
+        self._file.write(TRAILER.pack(offset, len(footer), MAGIC))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        path = os.path.join(self.directory, f"{self.blocks[0]['first_id']:012d}-{self.segment}{SUFFIX}")
+        os.rename(self._tmp, path)
+        return path
+
+    def abort(self):
+        self._file.close()
+        os.unlink(self._tmp)
+
+class Segment:
+    """A finished segment, read through mmap; only the footer is parsed up front."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.key_id = HEADER.unpack_from(self._map, 0)
+        offset, length, trailer_magic = TRAILER.unpack_from(self._map, len(self._map) - TRAILER.size)
+        if magic != MAGIC or trailer_magic != MAGIC:
+            raise ValueError(f"{path} is not a complete archive segment")
+        footer = json.loads(self._map[offset:offset + length])
+        self.segment = footer["segment"]
+        self.blocks = footer["blocks"]
+        for entry in self.blocks:
+            entry["min_ts"] = datetime.fromisoformat(entry["min_ts"])
+            entry["max_ts"] = datetime.fromisoformat(entry["max_ts"])
+        self.first_id = min(entry["first_id"] for entry in self.blocks)
+        self.last_id = max(entry["last_id"] for entry in self.blocks)
+        self.max_ts = max(entry["max_ts"] for entry in self.blocks)
+
+    def read_block(self, index, key):
+        entry = self.blocks[index]
+        sealed = self._map[entry["offset"]:entry["offset"] + entry["length"]]
+        body = json.loads(zlib.decompress(unseal(sealed, key)))
+        rows = body["rows"]
+        if (body["segment"] != self.segment or body["block"] != index or not rows
+                or rows[0][0] != entry["first_id"] or rows[-1][0] != entry["last_id"]):
+            raise ValueError(f"Block {index} of {self.path} does not match its index")
+        return [(id_, datetime.fromisoformat(ts), host, service, msg, state)
+                for id_, ts, host, service, msg, state in rows]
+
+    def close(self):
+        self._map.close()
+
+def block_matches(entry, since=None, until=None, state=None):
+    if since and entry["max_ts"] < since:
+        return False
+    if until and entry["min_ts"] >= until:
+        return False
+    if state and not entry["states"].get(state):
+        return False
+    return True
+
+def row_matches(row, since=None, until=None, state=None):
+    return ((not since or row[1] >= since) and (not until or row[1] < until)
+            and (not state or row[5] == state))
+
+class Archive:
+    """All segments in a directory, for the viewer.
+
+    `key_for(key_id)` returns the unwrapped data key of a segment. Decrypted
+    blocks are cached, so paging back and forth does not decrypt them again.
+    """
+
+    def __init__(self, key_for, directory=ARCHIVE_DIR, cache_size=ARCHIVE_BLOCK_CACHE):
+        self.key_for = key_for
+        self.directory = directory
+        self._segments = {}
+        self._cache = LRUCache(cache_size)
+
+    def segments(self):
+        try:
+            names = {name for name in os.listdir(self.directory) if name.endswith(SUFFIX)}
+        except FileNotFoundError:
+            names = set()
+        for name in set(self._segments) - names:
+            segment = self._segments.pop(name)
+            if segment:
+                segment.close()
+        for name in names - set(self._segments):
+            try:
+                self._segments[name] = Segment(os.path.join(self.directory, name))
+            except (OSError, ValueError) as e:
+                print(f"[ERROR] Skipping archive segment {name}: {e}")
+                self._segments[name] = None
+        return [segment for segment in self._segments.values() if segment]
+
+    def _rows(self, segment, index):
+        cache_key = (segment.segment, index)
+        rows = self._cache.get(cache_key)
+        if rows is None:
+            rows = segment.read_block(index, self.key_for(segment.key_id))
+            self._cache.put(cache_key, rows)
+        return rows
+
+    def fetch(self, before, limit, since=None, until=None, state=None, floor=None):
+        """Up to `limit` archived rows with id below `before`, newest first.
+
+        Blocks entirely below `floor` are skipped; the caller passes the lowest
+        id it already has when those rows could not make the page anyway.
+        """
+        candidates = [
+            (entry["last_id"], segment, index)
+            for segment in self.segments()
+            for index, entry in enumerate(segment.blocks)
+            if entry["first_id"] < before and (floor is None or entry["last_id"] > floor)
+            and block_matches(entry, since, until, state)
+        ]
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        found = {}
+        for last_id, segment, index in candidates:
+            if len(found) >= limit and last_id < sorted(found, reverse=True)[limit - 1]:
+                break
+            for row in self._rows(segment, index):
+                if row[0] < before and row_matches(row, since, until, state):
+                    found.setdefault(row[0], row)
+        return [found[id_] for id_ in sorted(found, reverse=True)[:limit]]
+
+    def fetch_ids(self, ids, since=None, until=None, state=None):
+        """Archived rows with the given ids, newest first."""
+        wanted = set(ids)
+        found = {}
+        for segment in self.segments():
+            for index, entry in enumerate(segment.blocks):
+                if not block_matches(entry, since, until, state):
+                    continue
+                if not any(entry["first_id"] <= id_ <= entry["last_id"] for id_ in wanted):
+                    continue
+                for row in self._rows(segment, index):
+                    if row[0] in wanted and row_matches(row, since, until, state):
+                        found.setdefault(row[0], row)
+        return [found[id_] for id_ in sorted(found, reverse=True)]
+
+class ArchivedIds:
+    """The ids already in segments, from the footers alone.
+
+    Segments written before blocks recorded their runs count as covering
+    their whole first_id..last_id range.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR):
+        segments = Archive(lambda key_id: None, directory).segments()
+        runs = sorted(tuple(run) for segment in segments for entry in segment.blocks
+                      for run in entry.get("runs", [(entry["first_id"], entry["last_id"])]))
+        for segment in segments:
+            segment.close()
+        self._runs = []
+        for first, last in runs:
+            if self._runs and first <= self._runs[-1][1] + 1:
+                self._runs[-1][1] = max(self._runs[-1][1], last)
+            else:
+                self._runs.append([first, last])
+        self._firsts = [run[0] for run in self._runs]
+
+    def __contains__(self, id_):
+        index = bisect.bisect_right(self._firsts, id_) - 1
+        return index >= 0 and self._runs[index][1] >= id_
+
+def segment_key(conn, user_key, first_ts):
+    """A fresh data key per segment, stored in data_keys so password changes re-wrap it."""
+    key = generate_data_key()
+    data_key = DataKey(key, encrypt_data_key(key, user_key), first_ts)
+    return DataKeyring.persist(conn, data_key), key
+
+def decrypt_stored(cursor, rows, user_key, keys):
+    """Decrypt stored rows; returns (plain rows, ids of rows that could not be decrypted)."""
+    load_data_keys(cursor, [row[7] for row in rows], user_key, keys)
+    plain = []
+    failed = []
+    for id_, ts, enc_host, enc_service, enc_msg, payload, state, key_id in rows:
+        try:
+            data_key = user_key if key_id is None else keys.get(key_id)
+            host, service, msg = decrypt_row(enc_host, enc_service, enc_msg, payload, data_key)
+        except (ValueError, TypeError):
+            # A missing key or a failed check: the ciphertext stays where it is
+            failed.append(id_)
+            continue
+        plain.append((id_, ts, host, service, msg, state))
+    return plain, failed
+
+def write_segments(conn, user_key, batches, directory, skip=()):
+    """Write rows from `batches` (lists of decrypted rows in id order) into segments; returns their ids.
+
+    Rows whose id is in `skip` are already archived; they are returned but not written again.
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    writer = None
+    archived = []
+    try:
+        for rows in batches:
+            for row in rows:
+                archived.append(row[0])
+                if row[0] in skip:
+                    continue
+                if writer is None:
+                    writer = SegmentWriter(directory, *segment_key(conn, user_key, row[1]))
+                writer.add(row)
+                if writer.rows >= ARCHIVE_SEGMENT_ROWS:
+                    writer.finish()
+                    writer = None
+        if writer:
+            writer.finish()
+            writer = None
+    finally:
+        if writer:
+            writer.abort()
+    return archived
+
+def _stream(conn, sql, params, user_key, failed):
+    """Yield decrypted rows chunk by chunk using an id cursor; `sql` filters on `id > %s`.
+
+    Ids of rows that do not decrypt are appended to `failed` instead.
+    """
+    cursor = conn.cursor()
+    # Large enough for every key a chunk can reference, so none is evicted before it is used
+    keys = LRUCache(ARCHIVE_CHUNK)
+    last_id = 0
+    while True:
+        cursor.execute(sql, tuple(params) + (last_id, ARCHIVE_CHUNK))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        plain, bad = decrypt_stored(cursor, rows, user_key, keys)
+        failed += bad
+        yield plain
+    cursor.close()
+
+def _delete_ids(conn, ids, table=TABLE_NAME):
+    cursor = conn.cursor()
+    for i in range(0, len(ids), ARCHIVE_CHUNK):
+        chunk = ids[i:i + ARCHIVE_CHUNK]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        cursor.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", tuple(chunk))
+        conn.commit()
+    cursor.close()
+
+def archive_rows(conn, user_key, partitions=(), now=None, after_days=ARCHIVE_AFTER_DAYS, directory=ARCHIVE_DIR):
+    """Move rows older than `after_days` into segments; returns how many were archived.
+
+    Whole partitions are archived and then dropped when the table has them;
+    otherwise rows are deleted in chunks once their segment is on disk. Rows
+    that do not decrypt are never archived and stay in the table. Search
+    tokens are kept, so the viewer can still find archived rows.
+    """
+    if after_days <= 0:
+        return 0
+    cutoff = (now or datetime.now()) - timedelta(days=after_days)
+    columns = "id, timestamp, hostname, service, message, payload, state, key_id"
+    # A run that stopped between writing segments and deleting their rows leaves those rows behind
+    skip = ArchivedIds(directory)
+    failed = []
+    total = 0
+    expired = [name for name, bound in partitions if bound and bound <= cutoff]
+    if expired:
+        for name in expired:
+            sql = f"SELECT {columns} FROM `{TABLE_NAME}` PARTITION ({name}) WHERE id > %s ORDER BY id LIMIT %s"
+            bad = []
+            archived = write_segments(conn, user_key, _stream(conn, sql, (), user_key, bad), directory, skip)
+            if bad:
+                # Dropping the partition would take the undecryptable rows with it
+                _delete_ids(conn, archived)
+            else:
+                cursor = conn.cursor()
+                cursor.execute(f"ALTER TABLE `{TABLE_NAME}` DROP PARTITION {name}")
+                cursor.close()
+            total += len(archived)
+            failed += bad
+    elif not partitions:
+        sql = f"SELECT {columns} FROM {TABLE_NAME} WHERE timestamp < %s AND id > %s ORDER BY id LIMIT %s"
+        archived = write_segments(conn, user_key, _stream(conn, sql, (cutoff,), user_key, failed), directory, skip)
+        _delete_ids(conn, archived)
+        total = len(archived)
+    # Otherwise the table is partitioned, but no partition is entirely old enough yet
+    if failed:
+        print(f"[ERROR] {len(failed)} rows could not be decrypted and were left in {TABLE_NAME} "
+              f"(ids {failed[0]}..{failed[-1]}).")
+    return total
+
+def expire_segments(conn, cutoff, directory=ARCHIVE_DIR):
+    """Delete segments whose newest row is older than `cutoff`; their search tokens are swept later."""
+    cursor = conn.cursor()
+    removed = 0
+    for segment in Archive(lambda key_id: None, directory).segments():
+        segment.close()
+        if segment.max_ts < cutoff:
+            cursor.execute(SWEEP_INSERT, (segment.first_id, segment.last_id))
+            conn.commit()
+            os.unlink(segment.path)
+            removed += 1
+    cursor.close()
+    return removed
+
+if __name__ == "__main__":
+    from log import load_user_key
+    from partitions import list_partitions
+    try:
+        conn = get_db_connection()
+        user_key = load_user_key(conn)
+        partitions = []
+        if get_storage().partitioned:
+            cursor = conn.cursor()
+            partitions = list_partitions(cursor)
+            cursor.close()
+        days = int(sys.argv[1]) if len(sys.argv) > 1 else ARCHIVE_AFTER_DAYS
+        archived = archive_rows(conn, user_key, partitions, after_days=days)
+        conn.close()
+        print(f"✅ Archived {archived} rows to {ARCHIVE_DIR}/")
+    except Exception as e:
+        print(f"❌ Archiving failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,41 @@
+import sys
+import argparse
+import secrets
+from lib import CIPHERS_BY_NAME, seal, unseal, encrypt_data, decrypt_data
+from benchmarks.report import measure, write_results
+
+# Typical auth.log message lengths: short session lines up to long PAM/ssh lines
+SIZES = (48, 96, 160, 320, 1024)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Encrypt/decrypt throughput per cipher")
+    ap.add_argument("--seconds", type=float, default=0.5, help="time spent per measurement")
+    ap.add_argument("--output", help="JSON file (default: benchmarks/results/cipher-<time>.json)")
+    args = ap.parse_args(argv)
+
+    key = secrets.token_bytes(32)
+    results = {}
+    print(f"{'mode':<22}{'bytes':>7}{'enc ops/s':>14}{'dec ops/s':>14}{'enc MB/s':>10}{'dec MB/s':>10}")
+    for size in SIZES:
+        plaintext = secrets.token_hex(size)[:size]
+        data = plaintext.encode()
+        cases = [
+            ("base64 aes-cbc (v1)",
+             lambda: encrypt_data(plaintext, key),
+             lambda blob=encrypt_data(plaintext, key): decrypt_data(blob, key)),
+        ]
+        for name in CIPHERS_BY_NAME:
+            blob = seal(data, key, name)
+            cases.append((name, lambda name=name: seal(data, key, name), lambda blob=blob: unseal(blob, key)))
+        for name, enc, dec in cases:
+            enc_rate = measure(enc, args.seconds)
+            dec_rate = measure(dec, args.seconds)
+            results.setdefault(name, {})[str(size)] = {"enc_ops_per_sec": enc_rate, "dec_ops_per_sec": dec_rate}
+            print(f"{name:<22}{size:>7}{enc_rate:>14,.0f}{dec_rate:>14,.0f}"
+                  f"{enc_rate * size / 1e6:>10.1f}{dec_rate * size / 1e6:>10.1f}")
+        print()
+    path = write_results("cipher", {"seconds": args.seconds, "sizes": list(SIZES)}, results, args.output)
+    print(f"[INFO] Results written to {path}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+import sys
+import json
+import argparse
+
+def flatten(value, prefix=""):
+    """Turn {"a": {"b": 1}} into {"a.b": 1}, keeping numeric leaves only."""
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(flatten(item, f"{prefix}{key}."))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix[:-1]: value}
+    return {}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Compare two benchmark result files")
+    ap.add_argument("baseline")
+    ap.add_argument("candidate")
+    args = ap.parse_args(argv)
+
+    with open(args.baseline) as f:
+        old = json.load(f)
+    with open(args.candidate) as f:
+        new = json.load(f)
+    if old.get("benchmark") != new.get("benchmark"):
+        print(f"[ERROR] Different benchmarks: {old.get('benchmark')} and {new.get('benchmark')}")
+        return 1
+    for label, doc in (("baseline", old), ("candidate", new)):
+        env = doc.get("environment", {})
+        print(f"{label:<10} {doc.get('created')}  rev {env.get('revision')}  python {env.get('python')}")
+    if old.get("params") != new.get("params"):
+        print("[INFO] Parameters differ; changes may not be comparable.")
+
+    old_values, new_values = flatten(old.get("results", {})), flatten(new.get("results", {}))
+    width = max((len(k) for k in old_values), default=10) + 2
+    print(f"\n{'metric':<{width}}{'baseline':>16}{'candidate':>16}{'change':>10}")
+    for key, before in old_values.items():
+        after = new_values.get(key)
+        if after is None:
+            continue
+        change = f"{(after - before) / before:+.1%}" if before else ""
+        print(f"{key:<{width}}{before:>16,.2f}{after:>16,.2f}{change:>10}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
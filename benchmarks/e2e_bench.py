@@ -0,0 +1,187 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import threading
+from benchmarks.loadgen import LoadGenerator, parse_mix, write_load
+from benchmarks.report import summarize, write_results
+
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench"
+VISIBLE_TIMEOUT = 60.0
+
+def configure(workdir):
+    """Point every module at a throwaway SQLite database and sockets in `workdir`.
+
+    Settings are read when the modules are imported, so this has to run first.
+    """
+    os.environ.update({
+        "DB_BACKEND": "sqlite",
+        "SQLITE_PATH": os.path.join(workdir, "bench.db"),
+        "NOTIFY_SOCKET": os.path.join(workdir, "notify.sock"),
+        "AGENT_SOCKET": os.path.join(workdir, "agent.sock"),
+        "CHECKPOINT_FILE": os.path.join(workdir, "checkpoint.json"),
+        "ARCHIVE_DIR": os.path.join(workdir, "archive"),
+        "STATE_RULES_FILE": "",
+        "MAINTENANCE_INTERVAL": "0",
+        "KDF": "pbkdf2",
+        "PBKDF2_ITERATIONS": "1000",
+        "USER_PASSWORD": BENCH_PASSWORD,
+    })
+    # UPDATE_FILE and the import marker are relative to the working directory
+    os.chdir(workdir)
+
+class Viewer(threading.Thread):
+    """Follows the notification socket like eye_view.py and decrypts every new row.
+
+    A row counts as visible once it has been read back from the database and
+    decrypted; `seen[id]` is that moment.
+    """
+
+    def __init__(self, user_key, path):
+        super().__init__(name="bench-viewer", daemon=True)
+        self.user_key = user_key
+        self.path = path
+        self.last_id = 0
+        self.seen = {}
+        self.failed = 0
+        self.changed = threading.Condition()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.sock.sendall(b"ids\n")
+
+    def run(self):
+        from lib import get_db_connection, load_data_keys, decrypt_row, LRUCache
+        from storage import get_storage
+        keys = LRUCache(64)
+        with self.sock.makefile("rb") as f:
+            for line in f:
+                if int(line) <= self.last_id:
+                    continue
+                with get_db_connection() as conn:
+                    cursor = conn.cursor()
+                    rows = get_storage().fetch_range(cursor, "id > %s", (self.last_id,), 1_000_000)
+                    load_data_keys(cursor, [row[7] for row in rows], self.user_key, keys)
+                    cursor.close()
+                for id_, ts, host, service, msg, payload, state, key_id in rows:
+                    try:
+                        decrypt_row(host, service, msg, payload, keys.get(key_id))
+                    except Exception:
+                        self.failed += 1
+                now = time.monotonic()
+                with self.changed:
+                    for row in rows:
+                        self.seen[row[0]] = now
+                    if rows:
+                        self.last_id = max(self.last_id, rows[0][0])
+                    self.changed.notify_all()
+
+    def wait_for(self, last_id, timeout=VISIBLE_TIMEOUT):
+        with self.changed:
+            return self.changed.wait_for(lambda: self.last_id >= last_id, timeout)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+def run_phase(name, log_path, viewer, generator, rate, seconds=None, count=None, rotate_every=0):
+    """Append load, wait until the viewer has every row, and time each line."""
+    appended = []
+    first_id = viewer.last_id + 1
+
+    def on_write(first, lines, at):
+        appended.extend([at] * len(lines))
+
+    start = time.monotonic()
+    written = write_load(log_path, generator, rate, seconds, count, rotate_every, on_write)
+    write_done = time.monotonic()
+    visible = viewer.wait_for(first_id + written - 1)
+    end = time.monotonic()
+    # Lines are written, parsed and inserted in order, so line i becomes row first_id + i
+    latencies = [viewer.seen[first_id + i] - at for i, at in enumerate(appended) if first_id + i in viewer.seen]
+    result = {
+        "lines": written,
+        "visible": len(latencies),
+        "complete": bool(visible),
+        "write_seconds": write_done - start,
+        "ingest_seconds": end - start,
+        "ingest_rows_per_sec": len(latencies) / max(end - start, 1e-9),
+        "latency": summarize(latencies),
+    }
+    lat = result["latency"]
+    print(f"[INFO] {name}: {len(latencies):,}/{written:,} rows visible in {end - start:.2f}s "
+          f"({result['ingest_rows_per_sec']:,.0f} rows/s), latency p50 {lat.get('p50_ms', 0):.1f}ms "
+          f"p99 {lat.get('p99_ms', 0):.1f}ms max {lat.get('max_ms', 0):.1f}ms")
+    return result
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(
+        description="Ingest throughput and append-to-visible latency of log.py against a scratch SQLite database"
+    )
+    ap.add_argument("--lines", type=int, default=50_000, help="lines in the unpaced throughput phase")
+    ap.add_argument("--rate", type=float, default=1000, help="lines per second in the paced latency phase")
+    ap.add_argument("--seconds", type=float, default=10, help="length of the latency phase")
+    ap.add_argument("--rotate-every", type=int, default=0, help="rotate the log every N lines in the latency phase")
+    ap.add_argument("--mix", default="brute=2,session=5,noise=3")
+    ap.add_argument("--workdir", help="keep the database and log here instead of a temporary directory")
+    ap.add_argument("--output", help="JSON file (default: benchmarks/results/e2e-<time>.json)")
+    args = ap.parse_args(argv)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="logcrypt-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    configure(workdir)
+
+    from watchdog.observers import Observer
+    from lib import get_db_connection, create_user, pool_stats
+    from schema import migrate
+    import log
+
+    with get_db_connection() as conn:
+        migrate(conn)
+    create_user(BENCH_USER, BENCH_PASSWORD)
+    log_path = os.path.join(workdir, "auth.log")
+    open(log_path, "a").close()
+
+    handler = log.LogHandler(log_path)
+    observer = Observer()
+    observer.schedule(handler, path=workdir, recursive=False)
+    observer.start()
+    viewer = Viewer(handler.user_key, os.environ["NOTIFY_SOCKET"])
+    viewer.start()
+
+    results = {}
+    mix = parse_mix(args.mix)
+    try:
+        if args.lines:
+            results["throughput"] = run_phase("throughput", log_path, viewer, LoadGenerator(mix, rate=0), 0,
+                                              count=args.lines)
+        if args.seconds:
+            results["latency"] = run_phase("latency", log_path, viewer, LoadGenerator(mix, rate=args.rate, seed=2),
+                                           args.rate, seconds=args.seconds, rotate_every=args.rotate_every)
+        results["decrypt_failures"] = viewer.failed
+        results["rejected_lines"] = handler.parser.rejected
+        results["pool"] = pool_stats()
+    finally:
+        viewer.close()
+        observer.stop()
+        handler.cleanup()
+        observer.join()
+
+    params = {
+        "lines": args.lines, "rate": args.rate, "seconds": args.seconds, "rotate_every": args.rotate_every,
+        "mix": args.mix, "backend": "sqlite", "batch_size": log.BATCH_SIZE,
+        "flush_interval_ms": log.FLUSH_INTERVAL_MS, "encrypt_workers": log.ENCRYPT_WORKERS,
+        "blind_index": log.BLIND_INDEX, "rollups": log.ROLLUPS,
+    }
+    path = write_results("e2e", params, results, args.output)
+    print(f"[INFO] Results written to {path}")
+    return 0 if all(r["complete"] for r in results.values() if isinstance(r, dict) and "complete" in r) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
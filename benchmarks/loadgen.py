@@ -0,0 +1,204 @@
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+RFC3339 = "rfc3339"
+BSD = "bsd"
+
+# Relative weight of each kind of event; one event can write several lines
+DEFAULT_MIX = {"brute": 2, "session": 5, "noise": 3}
+BRUTE_BURST = (5, 60)
+USERS = ("root", "admin", "deploy", "ubuntu", "git", "postgres", "backup", "alice", "bob")
+HOSTS = ("bastion", "web1", "web2", "db1")
+TICK = 0.01
+
+def parse_mix(text):
+    """Turn "brute=2,session=5" into {"brute": 2.0, "session": 5.0}."""
+    mix = {}
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX and name != "malformed":
+            raise ValueError(f"Unknown event kind {name!r}")
+        mix[name] = float(weight or 1)
+    return mix
+
+class LoadGenerator:
+    """Endless stream of synthetic auth.log lines.
+
+    Events are picked by weight from `mix`: `brute` is a burst of failed
+    logins from one address, `session` opens or closes an SSH session (so
+    open sessions accumulate and churn), `noise` is the preauth and cron
+    chatter of a busy host, and `malformed` is a line no parser accepts.
+    Timestamps advance by 1/`rate` seconds per line.
+    """
+
+    def __init__(self, mix=None, fmt=RFC3339, rate=1000, start=None, seed=1):
+        self.rng = random.Random(seed)
+        mix = mix or DEFAULT_MIX
+        self.kinds = list(mix)
+        self.weights = [mix[k] for k in self.kinds]
+        self.format = fmt
+        self.step = timedelta(seconds=1 / rate) if rate > 0 else timedelta(microseconds=100)
+        self.ts = start or datetime.now().replace(microsecond=0)
+        self.pid = 1000
+        self.sessions = []
+        self.counts = dict.fromkeys(self.kinds, 0)
+        self._pending = []
+
+    def _stamp(self):
+        self.ts += self.step
+        if self.format == BSD:
+            return f"{self.ts:%b} {self.ts.day:>2} {self.ts:%H:%M:%S}"
+        return self.ts.isoformat(timespec="microseconds") + "+00:00"
+
+    def _ip(self):
+        rng = self.rng
+        return f"{rng.choice((203, 198, 192))}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+
+    def _next_pid(self):
+        self.pid = self.pid + 1 if self.pid < 4_000_000 else 1000
+        return self.pid
+
+    def brute(self):
+        rng = self.rng
+        ip, pid = self._ip(), self._next_pid()
+        lines = []
+        for _ in range(rng.randint(*BRUTE_BURST)):
+            user = rng.choice(USERS + ("oracle", "test", "pi", "support"))
+            invalid = "" if user in USERS else "invalid user "
+            lines.append(("sshd", pid, f"Failed password for {invalid}{user} from {ip} port {rng.randrange(1024, 65536)} ssh2"))
+        lines.append(("sshd", pid, f"Disconnecting authenticating user root {ip} port {rng.randrange(1024, 65536)}: "
+                                   "Too many authentication failures [preauth]"))
+        return lines
+
+    def session(self):
+        rng = self.rng
+        if self.sessions and (len(self.sessions) > 50 or rng.random() < 0.45):
+            pid, user, ip, port = self.sessions.pop(rng.randrange(len(self.sessions)))
+            return [
+                ("sshd", pid, f"Received disconnect from {ip} port {port}:11: disconnected by user"),
+                ("sshd", pid, f"pam_unix(sshd:session): session closed for user {user}"),
+            ]
+        pid, user, ip, port = self._next_pid(), rng.choice(USERS), self._ip(), rng.randrange(1024, 65536)
+        self.sessions.append((pid, user, ip, port))
+        method = rng.choice(("password", "publickey"))
+        return [
+            ("sshd", pid, f"Accepted {method} for {user} from {ip} port {port} ssh2"),
+            ("sshd", pid, f"pam_unix(sshd:session): session opened for user {user}(uid=1000) by (uid=0)"),
+        ]
+
+    def noise(self):
+        rng = self.rng
+        pid, ip = self._next_pid(), self._ip()
+        return [rng.choice((
+            ("sshd", pid, f"Connection closed by {ip} port {rng.randrange(1024, 65536)} [preauth]"),
+            ("sshd", pid, f"Invalid user {rng.choice(USERS)} from {ip} port {rng.randrange(1024, 65536)}"),
+            ("CRON", pid, "pam_unix(cron:session): session opened for user root(uid=0) by (uid=0)"),
+            ("CRON", pid, "pam_unix(cron:session): session closed for user root"),
+            ("sudo", pid, f"pam_unix(sudo:session): session opened for user root(uid=0) by {rng.choice(USERS)}(uid=1000)"),
+            ("systemd-logind", pid, f"New session {pid} of user {rng.choice(USERS)}."),
+        ))]
+
+    def malformed(self):
+        return [None]
+
+    def line(self):
+        """One line, ending in a newline."""
+        if not self._pending:
+            kind = self.rng.choices(self.kinds, self.weights)[0]
+            self.counts[kind] += 1
+            self._pending = getattr(self, kind)()
+            self._pending.reverse()
+        entry = self._pending.pop()
+        stamp = self._stamp()
+        if entry is None:
+            return f"{stamp} -- MARK --\n"
+        service, pid, msg = entry
+        return f"{stamp} {self.rng.choice(HOSTS)} {service}[{pid}]: {msg}\n"
+
+    def lines(self, count):
+        return [self.line() for _ in range(count)]
+
+def rotate(path, keep=3):
+    """Rename path to path.1 (shifting older ones) and start an empty file, like logrotate."""
+    for i in range(keep - 1, 0, -1):
+        if os.path.exists(f"{path}.{i}"):
+            os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+    os.replace(path, f"{path}.1")
+    open(path, "a").close()
+
+def write_load(path, generator, rate, seconds=None, count=None, rotate_every=0, on_write=None, stop=None):
+    """Append lines to `path` at `rate` lines/s (0 = as fast as possible).
+
+    Stops after `seconds` or `count` lines, or when the `stop` event is set.
+    `on_write(first, lines, appended_at)` is called after each write with the
+    sequence number of its first line, so callers can time each line.
+    Returns the number of lines written.
+    """
+    written = 0
+    since_rotation = 0
+    start = time.monotonic()
+    f = open(path, "a")
+    try:
+        while True:
+            now = time.monotonic()
+            if seconds is not None and now - start >= seconds:
+                break
+            if count is not None and written >= count:
+                break
+            if stop is not None and stop.is_set():
+                break
+            if rate > 0:
+                due = int((now - start) * rate) + 1 - written
+                if due <= 0:
+                    time.sleep(TICK)
+                    continue
+            else:
+                due = 1000
+            if count is not None:
+                due = min(due, count - written)
+            if rotate_every:
+                due = min(due, rotate_every - since_rotation)
+            batch = generator.lines(due)
+            f.write("".join(batch))
+            f.flush()
+            if on_write:
+                on_write(written, batch, time.monotonic())
+            written += len(batch)
+            since_rotation += len(batch)
+            if rotate_every and since_rotation >= rotate_every:
+                f.close()
+                rotate(path)
+                f = open(path, "a")
+                since_rotation = 0
+    finally:
+        f.close()
+    return written
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Write synthetic auth.log traffic")
+    ap.add_argument("path", help="log file to append to")
+    ap.add_argument("--rate", type=float, default=1000, help="lines per second, 0 for as fast as possible")
+    ap.add_argument("--seconds", type=float, help="stop after this long")
+    ap.add_argument("--lines", type=int, help="stop after this many lines")
+    ap.add_argument("--mix", default="brute=2,session=5,noise=3",
+                    help="event weights: brute, session, noise, malformed")
+    ap.add_argument("--format", choices=(RFC3339, BSD), default=RFC3339)
+    ap.add_argument("--rotate-every", type=int, default=0, help="rotate the file every N lines")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args(argv)
+    if args.seconds is None and args.lines is None:
+        ap.error("one of --seconds or --lines is required")
+
+    generator = LoadGenerator(parse_mix(args.mix), args.format, args.rate, seed=args.seed)
+    start = time.monotonic()
+    written = write_load(args.path, generator, args.rate, args.seconds, args.lines, args.rotate_every)
+    elapsed = max(time.monotonic() - start, 1e-9)
+    print(f"[INFO] Wrote {written:,} lines to {args.path} in {elapsed:.1f}s ({written / elapsed:,.0f} lines/s), "
+          f"events: {generator.counts}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+import sys
+import time
+import secrets
+import argparse
+from lib import ROW_FORMAT_V1, ROW_FORMAT_V2, decrypt_row
+from log import encrypt_rows, prepare_rows
+from classifier import build_classifier
+from syslog_parser import SyslogParser, DETECT_SAMPLE
+from benchmarks.loadgen import LoadGenerator, parse_mix, RFC3339, BSD
+from benchmarks.report import write_results
+
+def rate(func, items, repeat):
+    """Items per second over `repeat` passes of `func(items)`, best pass."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(items)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(items) / max(best, 1e-9)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Parse, classify, encrypt and decrypt throughput")
+    ap.add_argument("--lines", type=int, default=50_000)
+    ap.add_argument("--repeat", type=int, default=3, help="passes per measurement; the best one counts")
+    ap.add_argument("--mix", default="brute=2,session=5,noise=3,malformed=0.2")
+    ap.add_argument("--output", help="JSON file (default: benchmarks/results/micro-<time>.json)")
+    args = ap.parse_args(argv)
+
+    key = secrets.token_bytes(32)
+    index_key = secrets.token_bytes(32)
+    results = {}
+
+    for fmt in (RFC3339, BSD):
+        lines = LoadGenerator(parse_mix(args.mix), fmt, seed=1).lines(args.lines)
+        parser = SyslogParser(SyslogParser.detect(lines[:DETECT_SAMPLE]))
+        results[f"parse_{fmt}"] = rate(lambda ls: [parser.parse(line) for line in ls], lines, args.repeat)
+
+    lines = LoadGenerator(parse_mix(args.mix), seed=1).lines(args.lines)
+    parsed = SyslogParser().parse_many(lines)
+    messages = [msg for _, _, _, msg in parsed]
+    classify = build_classifier()
+    results["classify"] = rate(lambda ms: [classify(m) for m in ms], messages, args.repeat)
+
+    for name, row_format in (("v1", ROW_FORMAT_V1), ("v2", ROW_FORMAT_V2)):
+        results[f"encrypt_{name}"] = rate(lambda batch: encrypt_rows(batch, key, row_format), parsed, args.repeat)
+        rows = encrypt_rows(parsed, key, row_format)
+        results[f"decrypt_{name}"] = rate(
+            lambda rs: [decrypt_row(r[1], r[2], r[3], r[4], key) for r in rs], rows, args.repeat
+        )
+    # What the ingester does per batch: encryption plus search tokens and rollups
+    results["prepare_rows"] = rate(lambda batch: prepare_rows(batch, key, index_key), parsed, args.repeat)
+
+    print(f"{'benchmark':<20}{'items/s':>14}{'us/item':>10}")
+    for name, per_second in results.items():
+        print(f"{name:<20}{per_second:>14,.0f}{1e6 / per_second:>10.2f}")
+    path = write_results(
+        "micro",
+        {"lines": args.lines, "parsed": len(parsed), "repeat": args.repeat, "mix": args.mix},
+        {name: {"items_per_sec": per_second, "us_per_item": 1e6 / per_second} for name, per_second in results.items()},
+        args.output,
+    )
+    print(f"[INFO] Results written to {path}")
+
+if __name__ == "__main__":
+    sys.exit(main())
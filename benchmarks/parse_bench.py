@@ -0,0 +1,82 @@
+import io
+import sys
+import random
+import argparse
+import contextlib
+from datetime import datetime, timedelta
+from syslog_parser import SyslogParser, DETECT_SAMPLE
+from benchmarks.report import measure, write_results
+
+MESSAGES = [
+    "Failed password for invalid user admin from 203.0.113.7 port 51234 ssh2",
+    "Accepted password for root from 198.51.100.4 port 40022 ssh2",
+    "pam_unix(sshd:session): session opened for user root(uid=0) by (uid=0)",
+    "pam_unix(sshd:session): session closed for user root",
+    "Disconnected from authenticating user root 203.0.113.7 port 51234 [preauth]",
+    "Connection closed by 192.0.2.10 port 60000 [preauth]",
+]
+
+def legacy_parse_log_line(line):
+    # parse_log_line as it was in log.py before syslog_parser
+    try:
+        parts = line.strip().split(' ', 3)
+        ts = datetime.fromisoformat(parts[0])
+        host = parts[1]
+        service, msg = parts[2].split(':', 1)
+        msg = parts[3] if len(parts) > 3 else ""
+        return ts, host, service.strip(), msg.strip()
+    except Exception as e:
+        print(f"[ERROR] Failed to parse line: {line.strip()} - {e}")
+        return None
+
+def synthetic_lines(count, fmt="rfc3339", lines_per_second=200, reject_ratio=0.0, seed=1):
+    rng = random.Random(seed)
+    start = datetime(2025, 6, 20, 10, 0, 0)
+    lines = []
+    for i in range(count):
+        ts = start + timedelta(seconds=i // lines_per_second, microseconds=rng.randrange(1_000_000))
+        if fmt == "bsd":
+            stamp = ts.strftime("%b %d %H:%M:%S").replace(" 0", "  ", 1)
+        else:
+            stamp = ts.isoformat() + "+00:00"
+        if rng.random() < reject_ratio:
+            lines.append(f"{stamp} -- MARK --\n")
+        else:
+            lines.append(f"{stamp} bastion sshd[{1000 + i % 5000}]: {rng.choice(MESSAGES)}\n")
+    return lines
+
+def run(name, func, lines, seconds):
+    """Lines per second of `func` over whole passes of `lines`, for at least one pass."""
+    ok = 0
+
+    def one_pass():
+        # Counted inside the timed pass, so the lines are not parsed an extra time
+        nonlocal ok
+        ok = sum(1 for line in lines if func(line))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        per_second = measure(one_pass, seconds, inner=1) * len(lines)
+    print(f"{name:<28} {per_second:>12,.0f} lines/s  {ok:>9,} parsed")
+    return {"lines_per_sec": per_second, "parsed": ok}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Compare SyslogParser with the legacy parse_log_line")
+    ap.add_argument("--lines", type=int, default=1_000_000)
+    ap.add_argument("--seconds", type=float, default=0, help="minimum time per measurement")
+    ap.add_argument("--output", help="JSON file (default: benchmarks/results/parse-<time>.json)")
+    args = ap.parse_args(argv)
+
+    results = {}
+    for fmt, reject_ratio in (("rfc3339", 0.0), ("rfc3339", 0.05), ("bsd", 0.0)):
+        lines = synthetic_lines(args.lines, fmt, reject_ratio=reject_ratio)
+        print(f"--- {fmt}, {reject_ratio:.0%} malformed: {len(lines):,} lines")
+        parser = SyslogParser(SyslogParser.detect(lines[:DETECT_SAMPLE]))
+        results[f"{fmt}_malformed_{reject_ratio * 100:g}pct"] = {
+            "legacy": run("legacy parse_log_line", legacy_parse_log_line, lines, args.seconds),
+            "syslog_parser": run("SyslogParser.parse", parser.parse, lines, args.seconds),
+        }
+    path = write_results("parse", {"lines": args.lines, "seconds": args.seconds}, results, args.output)
+    print(f"[INFO] Results written to {path}")
+
+if __name__ == "__main__":
+    sys.exit(main())
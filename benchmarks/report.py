@@ -0,0 +1,85 @@
+import os
+import sys
+import json
+import math
+import time
+import platform
+import subprocess
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+def git_revision():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def environment():
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    rank = max(0, math.ceil(pct / 100 * len(values)) - 1)
+    return values[rank]
+
+def summarize(samples):
+    """Latency summary in milliseconds from samples in seconds."""
+    values = sorted(samples)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50) * 1000,
+        "p90_ms": percentile(values, 90) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": values[-1] * 1000,
+        "mean_ms": sum(values) / len(values) * 1000,
+    }
+
+def measure(func, seconds, inner=200):
+    """Calls per second of `func`, run for about `seconds`."""
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while True:
+        for _ in range(inner):
+            func()
+        count += inner
+        now = time.perf_counter()
+        if now >= deadline:
+            return count / (now - start)
+
+def write_results(name, params, results, path=None):
+    """Write one run as JSON and return the path.
+
+    Every file has the same top-level shape, so `benchmarks.compare` can diff
+    any two runs of the same benchmark.
+    """
+    started = datetime.now()
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{name}-{started:%Y%m%d-%H%M%S}.json")
+    document = {
+        "benchmark": name,
+        "created": started.isoformat(timespec="seconds"),
+        "argv": sys.argv[1:],
+        "environment": environment(),
+        "params": params,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2, default=str)
+        f.write("\n")
+    return path
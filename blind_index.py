@@ -0,0 +1,118 @@
+import re
+import hmac
+import hashlib
+import ipaddress
+
+TOKEN_BYTES = 16
+MAX_WORDS = 64
+MAX_WORD_LENGTH = 64
+
+HOST = "host"
+SERVICE = "service"
+USER = "user"
+IP = "ip"
+WORD = "word"
+KINDS = (HOST, SERVICE, USER, IP, WORD)
+
+WORD_RE = re.compile(r"[a-z0-9_](?:[a-z0-9_.@\-]*[a-z0-9_])?")
+USER_RES = [
+    # Failed password for invalid user admin from ... / Accepted publickey for bob from ...
+    re.compile(r"\bfor (?:invalid user )?([^\s(]+) from\b"),
+    # Invalid user admin from ... / session opened for user root(uid=0) / pam: user=root
+    re.compile(r"\buser[= ]([^\s(;]+)"),
+]
+IP_CANDIDATE_RE = re.compile(r"(?:\bfrom |\brhost=|\[)([0-9a-fA-F.:]+)")
+IPV4_RE = re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}\b")
+
+def service_name(service):
+    # sshd[1234] -> sshd
+    return service.split("[", 1)[0]
+
+def _valid_ip(value):
+    try:
+        return str(ipaddress.ip_address(value))
+    except ValueError:
+        return None
+
+def extract_terms(host, service, msg):
+    """Return the set of (kind, value) pairs a log row can be found by."""
+    terms = {(HOST, host.lower()), (SERVICE, service_name(service).lower())}
+    for user_re in USER_RES:
+        for user in user_re.findall(msg):
+            terms.add((USER, user.lower()))
+    for candidate in IP_CANDIDATE_RE.findall(msg) + IPV4_RE.findall(msg):
+        ip = _valid_ip(candidate)
+        if ip:
+            terms.add((IP, ip))
+    words = 0
+    for word in WORD_RE.findall(msg.lower()):
+        if len(word) <= MAX_WORD_LENGTH and (WORD, word) not in terms:
+            terms.add((WORD, word))
+            words += 1
+            if words >= MAX_WORDS:
+                break
+    return terms
+
+def token(index_key, kind, value):
+    return hmac.new(index_key, f"{kind}\0{value}".encode(), hashlib.sha256).digest()[:TOKEN_BYTES]
+
+def row_tokens(index_key, host, service, msg):
+    return [token(index_key, kind, value) for kind, value in extract_terms(host, service, msg)]
+
+def index_rows(batch, index_key):
+    return [row_tokens(index_key, host, service, msg) for _, host, service, msg in batch]
+
+def parse_query(text):
+    """Split a search into terms; each term is a list of (kind, value) alternatives.
+
+    `host:`, `service:`, `user:`, `ip:` and `word:` prefixes select one kind;
+    a bare word matches any kind, so `203.0.113.7` finds the IP and `root`
+    finds the user.
+    """
+    terms = []
+    for part in text.split():
+        kind, sep, value = part.partition(":")
+        kind = kind.lower()
+        if sep and kind in KINDS and value:
+            value = value.lower()
+            if kind == IP:
+                value = _valid_ip(value) or value
+            elif kind == SERVICE:
+                value = service_name(value)
+            terms.append([(kind, value)])
+            continue
+        ip = _valid_ip(part)
+        if ip:
+            terms.append([(IP, ip), (WORD, part.lower()), (HOST, part.lower())])
+            continue
+        for word in WORD_RE.findall(part.lower()):
+            terms.append([(k, word) for k in KINDS if k != IP])
+    return terms
+
+def query_tokens(index_key, text):
+    return [[token(index_key, kind, value) for kind, value in term] for term in parse_query(text)]
+
+def search_query(token_sets, table="log_tokens", log_table=None, filters=(), filter_params=()):
+    """Build SQL returning matching log ids below a cursor, newest first.
+
+    Each term is one self-join on the token index, so every term must match;
+    the alternatives within a term are an IN list on the primary key. Extra
+    `filters` are conditions on the log row itself, aliased `l`.
+    """
+    if not token_sets:
+        raise ValueError("Empty search")
+    joins = []
+    params = []
+    for i, tokens in enumerate(token_sets[1:], start=1):
+        placeholders = ", ".join(["%s"] * len(tokens))
+        joins.append(f"JOIN {table} t{i} ON t{i}.log_id = t0.log_id AND t{i}.token IN ({placeholders})")
+        params.extend(tokens)
+    if filters:
+        joins.append(f"JOIN {log_table} l ON l.id = t0.log_id")
+    placeholders = ", ".join(["%s"] * len(token_sets[0]))
+    where = " ".join(f"AND {condition}" for condition in filters)
+    sql = (
+        f"SELECT DISTINCT t0.log_id FROM {table} t0 {' '.join(joins)} "
+        f"WHERE t0.token IN ({placeholders}) {where} AND t0.log_id < %s ORDER BY t0.log_id DESC LIMIT %s"
+    )
+    return sql, params + list(token_sets[0]) + list(filter_params)
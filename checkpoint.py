@@ -0,0 +1,68 @@
+import os
+import glob
+import json
+import hashlib
+from decouple import config
+
+CHECKPOINT_FILE = config("CHECKPOINT_FILE", default=".log_checkpoint.json")
+FINGERPRINT_BYTES = 1024
+
+def head_fingerprint(path_or_fd, length=FINGERPRINT_BYTES):
+    """Return (length, sha256) of the first bytes of a file, used to tell files apart."""
+    if isinstance(path_or_fd, int):
+        head = os.pread(path_or_fd, length, 0)
+    else:
+        with open(path_or_fd, "rb") as f:
+            head = f.read(length)
+    return len(head), hashlib.sha256(head).hexdigest()
+
+def matches(path, checkpoint):
+    try:
+        st = os.stat(path)
+        if st.st_ino != checkpoint["inode"]:
+            return False
+        return head_fingerprint(path, checkpoint["head_len"]) == (checkpoint["head_len"], checkpoint["head_sha"])
+    except OSError:
+        return False
+
+def find_rotated(path, checkpoint):
+    """Locate the file a checkpoint was taken on after logrotate renamed it."""
+    if matches(path, checkpoint):
+        return path
+    candidates = sorted(p for p in glob.glob(f"{path}.*") if not p.endswith(".gz"))
+    for candidate in candidates:
+        if matches(candidate, checkpoint):
+            return candidate
+    return None
+
+def newer_rotations(path, rotated):
+    """Rotations between `rotated` (path.N) and the live file, oldest first: path.N-1 ... path.1."""
+    suffix = rotated[len(path) + 1:]
+    if not rotated.startswith(f"{path}.") or not suffix.isdigit():
+        return []
+    newer = []
+    for index in range(int(suffix) - 1, 0, -1):
+        candidate = f"{path}.{index}"
+        if os.path.exists(candidate):
+            newer.append(candidate)
+        elif os.path.exists(f"{candidate}.gz"):
+            print(f"[ERROR] {candidate}.gz is compressed and cannot be resumed; import it with `log.py import`.")
+    return newer
+
+def load_checkpoint(path=CHECKPOINT_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[ERROR] Ignoring unreadable checkpoint {path}: {e}")
+        return None
+
+def save_checkpoint(state, path=CHECKPOINT_FILE):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
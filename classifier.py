@@ -0,0 +1,101 @@
+import re
+import json
+import pathlib
+from decouple import config
+
+STATE_RULES_FILE = config("STATE_RULES_FILE", default="state_rules.json")
+
+STATE_MAP = {
+    'Accepted password': 'success',
+    'session opened': 'success',
+    'password changed': 'success',
+    'Failed password': 'failed',
+    'authentication failure': 'failed',
+    'error': 'error',
+    'Failed to connect': 'error',
+    'Cannot bind': 'error',
+    'logout() returned an error': 'error',
+    'disconnect': 'failed',
+    'disconnected by user': 'failed',
+    'session closed': 'success',
+    'unable to open env file': 'error',
+    'starting session': 'success',
+    'connection from': 'success'
+}
+
+def load_rules(path=STATE_RULES_FILE):
+    """Read extra (pattern, state) rules from a JSON object or list of pairs."""
+    rules_path = pathlib.Path(path) if path else None
+    if not rules_path or not rules_path.exists():
+        return []
+    try:
+        data = json.loads(rules_path.read_text())
+        items = data.items() if isinstance(data, dict) else data
+        return [(str(key), str(state)) for key, state in items]
+    except Exception as e:
+        print(f"[ERROR] Failed to load state rules from {path}: {e}")
+        return []
+
+def _trie_pattern(keys):
+    trie = {}
+    for key in keys:
+        node = trie
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node):
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        # Greedy optional tail: the longest key at a position is tried first
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+class StateClassifier:
+    """Maps a message to the state of the first matching rule, in rule order.
+
+    Rules are compiled into a single prefix-trie regex, so each message is
+    lowercased once and scanned once regardless of how many rules exist.
+    """
+
+    def __init__(self, rules, default="unknown"):
+        self.default = default
+        self.states = []
+        priority = {}
+        for key, state in rules:
+            key = key.lower()
+            if key and key not in priority:
+                priority[key] = len(self.states)
+                self.states.append(state)
+        # A match is the longest key at its position; any shorter key matching
+        # there is a prefix of it, so precompute the best priority among them.
+        self._best = {
+            key: min(p for k, p in priority.items() if key.startswith(k))
+            for key in priority
+        }
+        self._search = re.compile(_trie_pattern(priority)).search if priority else None
+
+    def __call__(self, msg):
+        if self._search is None:
+            return self.default
+        text = msg.lower()
+        best = None
+        pos = 0
+        while True:
+            match = self._search(text, pos)
+            if match is None:
+                break
+            p = self._best[match.group()]
+            if best is None or p < best:
+                best = p
+                if best == 0:
+                    break
+            # Restart one character later so overlapping keys are still seen
+            pos = match.start() + 1
+        return self.default if best is None else self.states[best]
+
+def build_classifier(path=STATE_RULES_FILE):
+    return StateClassifier(list(STATE_MAP.items()) + load_rules(path))
@@ -1,18 +1,75 @@
+import re
 import sys
 import os
 import pathlib
 import time
 import asyncio
+from datetime import datetime, timedelta
 from lib import get_db_connection
-from lib import derive_aes_key, decrypt_data, hash_password
+from lib import decrypt_row, unlock_user, LRUCache, load_data_keys, load_index_key
+from lib import decrypt_data_key
+from blind_index import query_tokens, search_query
+import keyagent
+from storage import get_storage
+from notify import subscribe, decode_rows, UPDATE_FILE, IDS, ROWS
+from rollup import Dashboard
+from archive import Archive
+from classifier import build_classifier
 from textual.app import App, ComposeResult
-from textual.widgets import Input, Static, Button, DataTable
+from textual.widgets import Input, Static, Button, DataTable, Select
 from textual.containers import Vertical, Horizontal
 from textual.screen import Screen
 from textual.binding import Binding
+from textual.worker import get_current_worker
+from textual import work
 from decouple import config
 
 TABLE_NAME = config("TABLE_NAME", default="auth_log")
+KEY_CACHE_SIZE = config("KEY_CACHE_SIZE", default=64, cast=int)
+VIEW_WINDOW = config("VIEW_WINDOW", default=100, cast=int)
+PAGE_SIZE = config("PAGE_SIZE", default=100, cast=int)
+PAGE_CACHE_SIZE = config("PAGE_CACHE_SIZE", default=32, cast=int)
+PREFETCH_ROWS = config("PREFETCH_ROWS", default=20, cast=int)
+LOADED_PAGES = 3
+SEARCH_DEBOUNCE_MS = config("SEARCH_DEBOUNCE_MS", default=150, cast=int)
+FILTER_CHUNK = 2000
+NOTIFY_RETRY_SECONDS = 5
+DASHBOARD_MINUTES = config("DASHBOARD_MINUTES", default=30, cast=int)
+DASHBOARD_REFRESH_SECONDS = 5
+DASHBOARD_BUCKETS_SHOWN = 10
+COLUMNS = [
+    ("ID", "id"),
+    ("Timestamp", "timestamp"),
+    ("Hostname", "hostname"),
+    ("Service", "service"),
+    ("Message", "message"),
+    ("State", "state"),
+]
+RELATIVE_TIME_RE = re.compile(r"^(\d+)\s*([smhdw])$")
+TIME_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+
+def parse_when(text, now=None):
+    """'' -> None, '90m' / '1h' / '2d' -> that long ago, otherwise an ISO date and time."""
+    text = text.strip()
+    if not text:
+        return None
+    m = RELATIVE_TIME_RE.match(text.lower())
+    if m:
+        return (now or datetime.now()) - timedelta(**{TIME_UNITS[m.group(2)]: int(m.group(1))})
+    return datetime.fromisoformat(text)
+
+def state_options():
+    classifier = build_classifier()
+    return [(state, state) for state in sorted(set(classifier.states) | {classifier.default})]
+
+# Rows carry a lowercase copy of their fields after the displayed columns
+SEARCH_TEXT = len(COLUMNS)
+
+def make_row(id_, ts, host, service, msg, state):
+    return (id_, ts, host, service, msg, state, f"{id_}\t{ts}\t{host}\t{service}\t{msg}\t{state}".lower())
+
+def row_cells(log):
+    return [str(x) for x in log[:SEARCH_TEXT]]
 
 class LoginScreen(Screen):
     CSS_PATH = "style.tcss"
@@ -31,86 +88,663 @@ class LoginScreen(Screen):
 
 class LogViewerScreen(Screen):
     CSS_PATH = "style.tcss"
-    BINDINGS = [Binding("ctrl+q", "quit", "Quit")]
+    BINDINGS = [
+        Binding("ctrl+q", "quit", "Quit"),
+        Binding("ctrl+l", "latest", "Latest"),
+        Binding("ctrl+f", "follow", "Follow"),
+        Binding("ctrl+b", "dashboard", "Dashboard"),
+    ]
 
     def __init__(self, username, user_key):
         super().__init__()
         self.username = username
         self.user_key = user_key
+        # Unwrapped data keys by id, so a page costs one unwrap per key rather than per row
+        self.data_keys = LRUCache(KEY_CACHE_SIZE)
         self.logs = []
         self.filtered_logs = []
         self.search_term = ""
+        # Highest id loaded so far; refreshes only fetch rows above it
+        self.last_id = 0
+        # Decrypted history and search pages keyed by (query, "id <" cursor)
+        self.page_cache = LRUCache(PAGE_CACHE_SIZE)
+        self.index_key = None
+        self.history = None
+        self.new_while_paged = 0
+        self._paging = False
+        # Follow mode takes encrypted batches straight from log.py instead of the DB
+        self.follow = False
+        self.dashboard = None
+        # Time range and state, applied in SQL to every query the table makes
+        self.filters = {"since": None, "until": None, "state": None}
+        self.archive = Archive(self.archive_key)
 
     def compose(self) -> ComposeResult:
         with Vertical():
-            yield Static("Press Ctrl+Q to quit", id="quit-hint")
+            yield Static("Press Ctrl+Q to quit, Enter in the search box to search all history", id="quit-hint")
             yield Static(f"Logged in as: {self.username}", id="user-label")
-            with Horizontal():
+            with Horizontal(id="search-bar"):
                 yield Input(placeholder="Search logs...", id="searchbox")
-            self.table = DataTable(id="log-table")
-            yield self.table
+            with Horizontal(id="filter-bar"):
+                yield Input(placeholder="Since (1h, 30m, 2026-10-18 09:00)", id="since")
+                yield Input(placeholder="Until", id="until")
+                yield Select(state_options(), prompt="All states", id="state-filter")
+            with Horizontal(id="main-area"):
+                self.table = DataTable(id="log-table")
+                yield self.table
+                yield Static("", id="dashboard", markup=False)
 
     async def on_mount(self):
-        self.table.add_columns("ID", "Timestamp", "Hostname", "Service", "Message", "State")
+        for label, key in COLUMNS:
+            self.table.add_column(label, key=key)
         await self.load_logs()
-        self.last_update = pathlib.Path(".log_update").stat().st_mtime if pathlib.Path(".log_update").exists() else 0
+        self.last_update = pathlib.Path(UPDATE_FILE).stat().st_mtime if pathlib.Path(UPDATE_FILE).exists() else 0
+        self.subscribed = False
+        self.run_worker(self.follow_notifications(), group="notify")
         self.set_interval(1, self.check_for_update)
+        self.set_interval(DASHBOARD_REFRESH_SECONDS, self.refresh_dashboard)
+
+    async def follow_notifications(self):
+        # Pushed ids from log.py; while the socket is missing the file poll below takes over
+        while True:
+            try:
+                self.subscribed = True
+                if self.follow:
+                    await subscribe(self.on_stream, ROWS)
+                else:
+                    await subscribe(self.on_notify, IDS)
+            except (OSError, ValueError):
+                pass
+            finally:
+                self.subscribed = False
+            # Dropped for falling behind, or log.py stopped: catch up from the DB
+            await self.load_new_logs()
+            await asyncio.sleep(NOTIFY_RETRY_SECONDS)
+
+    async def on_notify(self, last_id):
+        if last_id > self.last_id:
+            await self.load_new_logs()
+
+    async def on_stream(self, message):
+        rows = decode_rows(message)
+        if not rows or rows[-1][0] <= self.last_id:
+            return
+        step = message.get("step", 1)
+        if self.history is not None or any(row[0] != self.last_id + step * (i + 1) for i, row in enumerate(rows)):
+            # Paged away, or a batch was missed: the DB has the full picture
+            await self.load_new_logs()
+            return
+        last_id = rows[-1][0]
+        if any(self.filters.values()):
+            rows = [row for row in rows if self.stream_matches(row)]
+        if rows:
+            key_id = message["key_id"]
+            if key_id not in self.data_keys:
+                self.data_keys.put(key_id, decrypt_data_key(message["wrapped_key"], self.user_key))
+            self.add_new_logs(self.decrypt_rows(reversed(rows)))
+        # Rows left out by the filters count as seen, so the next batch still follows on
+        self.last_id = last_id
+
+    def stream_matches(self, row):
+        # Streamed rows never went through the SQL filters, so they are checked here
+        state, since, until = self.filters["state"], self.filters["since"], self.filters["until"]
+        if state and row[6] != state:
+            return False
+        if since or until:
+            ts = datetime.fromisoformat(row[1])
+            if (since and ts < since) or (until and ts >= until):
+                return False
+        return True
+
+    def action_follow(self):
+        self.follow = not self.follow
+        self.workers.cancel_group(self, "notify")
+        self.run_worker(self.follow_notifications(), group="notify")
+        self.update_status()
 
     async def check_for_update(self):
-        update_file = pathlib.Path(".log_update")
+        if self.subscribed:
+            return
+        update_file = pathlib.Path(UPDATE_FILE)
         if update_file.exists():
             mtime = update_file.stat().st_mtime
             if mtime > getattr(self, "last_update", 0):
                 self.last_update = mtime
-                await asyncio.sleep(2)  # Debounce: wait for more logs
-                await self.load_logs()
+                await self.load_new_logs()
 
     async def refresh_logs(self):
-        await self.load_logs()
+        await self.load_new_logs()
 
-    async def load_logs(self):
+    def filter_sql(self, alias=""):
+        clauses, params = [], []
+        if self.filters["state"]:
+            clauses.append(f"{alias}state = %s")
+            params.append(self.filters["state"])
+        if self.filters["since"]:
+            clauses.append(f"{alias}timestamp >= %s")
+            params.append(self.filters["since"])
+        if self.filters["until"]:
+            clauses.append(f"{alias}timestamp < %s")
+            params.append(self.filters["until"])
+        return clauses, params
+
+    def fetch_logs(self, condition="", params=(), limit=VIEW_WINDOW):
+        clauses, filter_params = self.filter_sql()
+        clauses = ([condition] if condition else []) + clauses
+        conn = get_db_connection()
         try:
-            conn = get_db_connection()
             cursor = conn.cursor()
-            cursor.execute(f"SELECT id, timestamp, hostname, service, message, state FROM {TABLE_NAME} ORDER BY id DESC LIMIT 100")
-            rows = cursor.fetchall()
+            rows = get_storage().fetch_range(cursor, " AND ".join(clauses), tuple(params) + tuple(filter_params), limit)
+            load_data_keys(cursor, [row[7] for row in rows], self.user_key, self.data_keys)
             cursor.close()
+        finally:
             conn.close()
-            logs = []
-            for row in rows:
-                try:
-                    id_, ts, enc_host, enc_service, enc_msg, state = row
-                    host = decrypt_data(enc_host, self.user_key)
-                    service = decrypt_data(enc_service, self.user_key)
-                    msg = decrypt_data(enc_msg, self.user_key)
-                    logs.append((id_, str(ts), host, service, msg, state))
-                except Exception:
-                    continue
-            self.logs = logs
+        return self.decrypt_rows(rows)
+
+    def fetch_newest(self, after=0):
+        """Rows above `after` that pass the filters, and the highest id in the table when they were read.
+
+        With filters set the newest rows may not be shown, so `last_id` follows
+        the table rather than the rows; otherwise every later batch pushed by
+        log.py would look like it skipped some.
+        """
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT MAX(id) FROM {TABLE_NAME}")
+            newest = cursor.fetchone()[0] or 0
+            cursor.close()
+        return self.fetch_logs("id > %s AND id <= %s", (after, newest)), max(newest, after)
+
+    def archive_key(self, key_id):
+        if key_id not in self.data_keys:
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                load_data_keys(cursor, [key_id], self.user_key, self.data_keys)
+                cursor.close()
+        return self.data_keys.get(key_id)
+
+    def merge_archived(self, rows, archived, limit):
+        # Archived rows are mostly older, but imports can interleave ids, so merge by id
+        seen = {log[0] for log in rows}
+        rows = rows + [make_row(id_, str(ts), host, service, msg, state)
+                       for id_, ts, host, service, msg, state in archived if id_ not in seen]
+        return sorted(rows, key=lambda log: log[0], reverse=True)[:limit]
+
+    def decrypt_rows(self, rows):
+        logs = []
+        for row in rows:
+            id_, ts, enc_host, enc_service, enc_msg, payload, state, key_id = row
+            try:
+                # Rows written before envelope encryption use the user key directly
+                data_key = self.user_key if key_id is None else self.data_keys.get(key_id)
+                host, service, msg = decrypt_row(enc_host, enc_service, enc_msg, payload, data_key)
+                logs.append(make_row(id_, str(ts), host, service, msg, state))
+            except ValueError:
+                # Failed authentication or padding: show the row instead of hiding it
+                logs.append(make_row(id_, str(ts), "", "", "[integrity check failed]", state))
+            except Exception:
+                logs.append(make_row(id_, str(ts), "", "", "[decryption failed]", state))
+        return logs
+
+    async def load_logs(self):
+        try:
+            self.logs, self.last_id = self.fetch_newest()
             self.apply_filter()
         except Exception as e:
             self.query_one("#user-label", Static).update(f"[ERROR] Failed to load logs: {e}")
 
+    async def load_new_logs(self):
+        if self.history is not None:
+            self.count_new_logs()
+            return
+        try:
+            new_logs, newest = self.fetch_newest(self.last_id)
+        except Exception as e:
+            self.query_one("#user-label", Static).update(f"[ERROR] Failed to load logs: {e}")
+            return
+        self.add_new_logs(new_logs)
+        self.last_id = newest
+
+    def add_new_logs(self, new_logs):
+        if not new_logs:
+            return
+        if len(new_logs) >= VIEW_WINDOW:
+            # The whole window was replaced, a rebuild is as cheap as patching
+            self.logs = new_logs[:VIEW_WINDOW]
+            self.apply_filter()
+            return
+        self.logs = new_logs + self.logs
+        dropped = self.logs[VIEW_WINDOW:]
+        del self.logs[VIEW_WINDOW:]
+        self.prepend_rows(new_logs, dropped)
+
+    def matches(self, log, term):
+        return not term or term in log[SEARCH_TEXT]
+
+    def prepend_rows(self, new_logs, dropped):
+        term = self.search_term.lower()
+        added = [log for log in new_logs if self.matches(log, term)]
+        for log in added:
+            self.table.add_row(*row_cells(log), key=str(log[0]))
+        oldest_id = self.logs[-1][0]
+        filtered = added + self.filtered_logs
+        while filtered and filtered[-1][0] < oldest_id:
+            filtered.pop()
+        self.filtered_logs = filtered
+        for log in dropped:
+            row_key = str(log[0])
+            if row_key in self.table.rows:
+                self.table.remove_row(row_key)
+        if added:
+            # New rows were appended at the bottom; reorder the index, not the cells
+            self.table.sort("id", key=int, reverse=True)
+
+    def count_new_logs(self):
+        try:
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                clauses, params = self.filter_sql()
+                condition = " AND ".join(["id > %s"] + clauses)
+                cursor.execute(f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE {condition}", (self.last_id, *params))
+                self.new_while_paged = cursor.fetchone()[0]
+                cursor.close()
+        except Exception:
+            return
+        self.update_status()
+
+    def update_status(self):
+        label = f"Logged in as: {self.username}"
+        if self.follow:
+            label += " | following"
+        if self.history is not None:
+            query = self.history["query"]
+            label += f" | results for '{query}'" if query else " | browsing history"
+            if self.new_while_paged:
+                label += f", {self.new_while_paged} new rows"
+            label += " (Ctrl+L for latest)"
+        self.query_one("#user-label", Static).update(label)
+
+    def fetch_page(self, query, tokens, cursor):
+        # Called from paging workers: it reads the DB and the archive and fills only the caches
+        cache_key = (query, cursor)
+        rows = self.page_cache.get(cache_key)
+        if rows is None:
+            if tokens:
+                rows = self.search_page(tokens, cursor)
+            else:
+                rows = self.fetch_logs("id < %s", (cursor,), PAGE_SIZE)
+                # A full page from the live table can only be beaten by archived rows above its lowest id
+                floor = rows[-1][0] if len(rows) == PAGE_SIZE else None
+                archived = self.archive.fetch(cursor, PAGE_SIZE, floor=floor, **self.filters)
+                if archived:
+                    rows = self.merge_archived(rows, archived, PAGE_SIZE)
+            self.page_cache.put(cache_key, rows)
+        return rows
+
+    def add_cursor(self, history, index, rows):
+        cursors = history["cursors"]
+        if index == len(cursors) - 1 and len(rows) == PAGE_SIZE:
+            cursors.append(rows[-1][0])
+
+    def start_paging(self, fetch, apply, error="Failed to load page"):
+        self._paging = True
+        self.paging_worker(fetch, apply, error)
+
+    @work(exclusive=True, group="paging", thread=True)
+    def paging_worker(self, fetch, apply, error):
+        # Queries and decryption run here, off the event loop; only `apply` touches the table
+        worker = get_current_worker()
+        try:
+            result = fetch()
+        except Exception as e:
+            if not worker.is_cancelled:
+                self.app.call_from_thread(self.paging_done, None, f"[ERROR] {error}: {e}")
+            return
+        if not worker.is_cancelled:
+            self.app.call_from_thread(self.paging_done, lambda: apply(result))
+
+    def paging_done(self, apply=None, error=None):
+        try:
+            if apply:
+                apply()
+            if error:
+                self.query_one("#user-label", Static).update(error)
+        finally:
+            self._paging = False
+
+    def enter_history(self):
+        logs = self.logs
+
+        def fetch():
+            segments = self.archive.segments()
+            if len(logs) < VIEW_WINDOW:
+                # The live window is not full, so older rows can only be in the archive
+                lowest = min((log[0] for log in logs), default=None)
+                if not any(lowest is None or segment.first_id < lowest for segment in segments):
+                    return None
+            anchor = logs[0][0] + 1 if logs else max(segment.last_id for segment in segments) + 1
+            if len(logs) >= PAGE_SIZE:
+                # The live window already holds the first page, decrypted
+                self.page_cache.put((None, anchor), logs[:PAGE_SIZE])
+            first = self.fetch_page(None, None, anchor)
+            older = self.fetch_page(None, None, first[-1][0]) if len(first) == PAGE_SIZE else []
+            return anchor, first, older
+
+        def apply(result):
+            if result is None or self.history is not None or self.logs is not logs:
+                # Nothing older, or rows arrived meanwhile; the next cursor move tries again
+                return
+            anchor, first, older = result
+            history = {"cursors": [anchor], "first": 0, "last": 0, "sizes": [len(first)], "query": None,
+                       "tokens": None}
+            self.add_cursor(history, 0, first)
+            self.history = history
+            self.logs = list(first)
+            self.new_while_paged = 0
+            row = self.table.cursor_row
+            self.apply_filter()
+            self.table.move_cursor(row=row, animate=False)
+            self.update_status()
+            self.show_older_page(history, 1, older)
+
+        self.start_paging(fetch, apply)
+
+    def search_page(self, tokens, before):
+        filters, filter_params = self.filter_sql("l.")
+        sql, params = search_query(tokens, log_table=TABLE_NAME, filters=filters, filter_params=filter_params)
+        rows = []
+        # Tokens of expired rows linger until the maintenance sweep, so a page of ids can come up short
+        while len(rows) < PAGE_SIZE:
+            conn = get_db_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(sql, tuple(params) + (before, PAGE_SIZE))
+                ids = [row[0] for row in cursor.fetchall()]
+                cursor.close()
+            finally:
+                conn.close()
+            if not ids:
+                break
+            placeholders = ", ".join(["%s"] * len(ids))
+            found = self.fetch_logs(f"id IN ({placeholders})", ids, len(ids))
+            if len(found) < len(ids):
+                # Tokens outlive archiving, so the rest of the ids are in archive segments
+                missing = set(ids) - {log[0] for log in found}
+                found = self.merge_archived(found, self.archive.fetch_ids(missing, **self.filters), len(ids))
+            rows += found
+            if len(ids) < PAGE_SIZE:
+                break
+            before = ids[-1]
+        # The next page starts below the last row kept, so rows cut off here come back on it
+        return rows[:PAGE_SIZE]
+
+    def enter_search(self, query):
+        query = " ".join(query.split())
+
+        def fetch():
+            if self.index_key is None:
+                with get_db_connection() as conn:
+                    self.index_key = load_index_key(conn, self.user_key)
+            tokens = query_tokens(self.index_key, query)
+            if not tokens:
+                return None
+            # Matching ids come from the token index; only those rows are decrypted
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                # Tokens are kept for archived rows, so this is above every row a search can find
+                cursor.execute("SELECT MAX(log_id) FROM log_tokens")
+                newest = cursor.fetchone()[0] or 0
+                cursor.close()
+            history = {
+                "cursors": [max(newest, self.last_id) + 1], "first": 0, "last": 0, "sizes": [],
+                "query": query, "tokens": tokens,
+            }
+            return history, self.fetch_page(query, tokens, history["cursors"][0])
+
+        def apply(result):
+            if result is None:
+                return
+            history, rows = result
+            self.add_cursor(history, 0, rows)
+            history["sizes"].append(len(rows))
+            self.history = history
+            self.logs = list(rows)
+            self.new_while_paged = 0
+            self.search_term = ""
+            self.workers.cancel_group(self, "filter")
+            self.apply_filter()
+            self.table.move_cursor(row=0, animate=False)
+            self.update_status()
+
+        self.start_paging(fetch, apply, "Search failed")
+
+    def load_older_page(self):
+        history = self.history
+        index = history["last"] + 1
+        if index >= len(history["cursors"]):
+            return
+        cursor = history["cursors"][index]
+        self.start_paging(lambda: self.fetch_page(history["query"], history["tokens"], cursor),
+                          lambda rows: self.show_older_page(history, index, rows))
+
+    def show_older_page(self, history, index, rows):
+        if self.history is not history or index != history["last"] + 1 or not rows:
+            return
+        self.add_cursor(history, index, rows)
+        history["last"] = index
+        history["sizes"].append(len(rows))
+        self.logs.extend(rows)
+        term = self.search_term.lower()
+        for log in rows:
+            if self.matches(log, term):
+                self.filtered_logs.append(log)
+                self.table.add_row(*row_cells(log), key=str(log[0]))
+        if len(history["sizes"]) > LOADED_PAGES:
+            self.drop_page(top=True)
+
+    def load_newer_page(self):
+        history = self.history
+        index = history["first"] - 1
+        if index < 0:
+            return
+        cursor = history["cursors"][index]
+        self.start_paging(lambda: self.fetch_page(history["query"], history["tokens"], cursor),
+                          lambda rows: self.show_newer_page(history, index, rows))
+
+    def show_newer_page(self, history, index, rows):
+        if self.history is not history or index != history["first"] - 1:
+            return
+        history["first"] = index
+        history["sizes"].insert(0, len(rows))
+        self.logs = rows + self.logs
+        term = self.search_term.lower()
+        added = [log for log in rows if self.matches(log, term)]
+        for log in added:
+            self.table.add_row(*row_cells(log), key=str(log[0]))
+        self.filtered_logs = added + self.filtered_logs
+        row = self.table.cursor_row
+        self.table.sort("id", key=int, reverse=True)
+        self.table.move_cursor(row=row + len(added), animate=False)
+        if len(history["sizes"]) > LOADED_PAGES:
+            self.drop_page(top=False)
+
+    def drop_page(self, top):
+        history = self.history
+        if top:
+            size = history["sizes"].pop(0)
+            dropped, self.logs = self.logs[:size], self.logs[size:]
+            history["first"] += 1
+        else:
+            size = history["sizes"].pop()
+            dropped, self.logs = self.logs[-size:], self.logs[:-size]
+            history["last"] -= 1
+        dropped_ids = {log[0] for log in dropped}
+        removed = 0
+        for row_id in dropped_ids:
+            row_key = str(row_id)
+            if row_key in self.table.rows:
+                self.table.remove_row(row_key)
+                removed += 1
+        self.filtered_logs = [log for log in self.filtered_logs if log[0] not in dropped_ids]
+        if top and removed:
+            self.table.move_cursor(row=max(0, self.table.cursor_row - removed), animate=False)
+
+    def on_data_table_cell_highlighted(self, event):
+        if event.data_table is self.table:
+            self.page_near(event.coordinate.row)
+
+    def on_data_table_row_highlighted(self, event):
+        if event.data_table is self.table:
+            self.page_near(event.cursor_row)
+
+    def page_near(self, row):
+        # Keep PREFETCH_ROWS of decrypted rows ahead of the cursor in either direction
+        if self._paging:
+            return
+        count = self.table.row_count
+        # The page is fetched and decrypted by a worker, which clears _paging once it is shown
+        if row >= count - PREFETCH_ROWS:
+            if self.history is None:
+                self.enter_history()
+            else:
+                self.load_older_page()
+        elif self.history is not None and row < PREFETCH_ROWS:
+            self.load_newer_page()
+
+    async def action_latest(self):
+        def apply(result):
+            self.history = None
+            self.new_while_paged = 0
+            self.logs, self.last_id = result
+            self.apply_filter()
+            self.table.move_cursor(row=0, animate=False)
+            self.update_status()
+            # Rows committed while the window was loading come in through the usual path
+            self.call_later(self.load_new_logs)
+
+        self.start_paging(self.fetch_newest, apply, "Failed to load logs")
+
     def apply_filter(self):
         term = self.search_term.lower()
         if term:
-            self.filtered_logs = [
-                log for log in self.logs
-                if any(term in str(field).lower() for field in log)
-            ]
+            self.filtered_logs = [log for log in self.logs if self.matches(log, term)]
         else:
-            self.filtered_logs = self.logs
+            self.filtered_logs = list(self.logs)
         self.update_table()
 
     def update_table(self):
         self.table.clear()
         for log in self.filtered_logs:
-            self.table.add_row(*[str(x) for x in log])
+            self.table.add_row(*row_cells(log), key=str(log[0]))
 
     async def on_input_changed(self, event):
         if event.input.id == "searchbox":
-            self.search_term = event.value
-            self.apply_filter()
+            self.filter_logs(event.value)
+
+    def filter_source(self, term):
+        # A longer term can only match a subset of what the current one matched
+        base = self.filtered_logs if self.search_term and term.startswith(self.search_term) else self.logs
+        return list(base), self.logs, len(self.logs)
+
+    @work(exclusive=True, group="filter", thread=True)
+    def filter_logs(self, value, delay=SEARCH_DEBOUNCE_MS / 1000):
+        # Exclusive: each keystroke cancels the previous worker, which also debounces
+        worker = get_current_worker()
+        time.sleep(delay)
+        if worker.is_cancelled:
+            return
+        term = value.lower()
+        base, logs, size = self.app.call_from_thread(self.filter_source, term)
+        if not term:
+            result = base
+        else:
+            result = []
+            for i in range(0, len(base), FILTER_CHUNK):
+                if worker.is_cancelled:
+                    return
+                result.extend(log for log in base[i:i + FILTER_CHUNK] if term in log[SEARCH_TEXT])
+        if not worker.is_cancelled:
+            self.app.call_from_thread(self.show_filtered, value, term, result, logs, size)
+
+    def show_filtered(self, value, term, result, logs, size):
+        if logs is not self.logs or size != len(self.logs):
+            # Rows arrived or were paged out meanwhile; filter again from the new set
+            self.filter_logs(value, delay=0)
+            return
+        self.search_term = term
+        self.filtered_logs = result
+        self.update_table()
+
+    async def on_input_submitted(self, event):
+        if event.input.id in ("since", "until"):
+            await self.apply_sql_filters()
+            return
+        if event.input.id != "searchbox":
+            return
+        if not event.value.strip():
+            await self.action_latest()
+            return
+        self.enter_search(event.value)
+
+    async def on_select_changed(self, event):
+        if event.select.id == "state-filter":
+            await self.apply_sql_filters()
+
+    async def apply_sql_filters(self):
+        try:
+            since = parse_when(self.query_one("#since", Input).value)
+            until = parse_when(self.query_one("#until", Input).value)
+        except ValueError as e:
+            self.query_one("#user-label", Static).update(f"Invalid time: {e}")
+            return
+        state = self.query_one("#state-filter", Select).value
+        self.filters = {"since": since, "until": until, "state": state if isinstance(state, str) else None}
+        # Cached pages were fetched under the old filters
+        self.page_cache.clear()
+        query = self.history["query"] if self.history else None
+        if query:
+            self.enter_search(query)
+        else:
+            await self.action_latest()
+
+    def action_dashboard(self):
+        panel = self.query_one("#dashboard", Static)
+        panel.toggle_class("visible")
+        if panel.has_class("visible"):
+            self.refresh_dashboard()
+
+    def refresh_dashboard(self):
+        panel = self.query_one("#dashboard", Static)
+        if not panel.has_class("visible"):
+            return
+        try:
+            with get_db_connection() as conn:
+                if self.dashboard is None:
+                    if self.index_key is None:
+                        self.index_key = load_index_key(conn, self.user_key)
+                    self.dashboard = Dashboard(self.index_key, DASHBOARD_MINUTES)
+                cursor = conn.cursor()
+                self.dashboard.refresh(cursor)
+                cursor.close()
+        except Exception as e:
+            panel.update(f"[ERROR] Failed to load rollups: {e}")
+            return
+        panel.update(self.render_dashboard())
+
+    def render_dashboard(self):
+        dashboard = self.dashboard
+        buckets = dashboard.per_bucket()[-DASHBOARD_BUCKETS_SHOWN:]
+        peak = max([c["success"] + c["failed"] for _, c in buckets] or [0]) or 1
+        lines = [f"Last {DASHBOARD_MINUTES} min", "", "Time   success failed"]
+        for bucket, counts in buckets:
+            ok, failed = counts["success"], counts["failed"]
+            bar = "█" * round(6 * failed / peak) + "░" * round(6 * ok / peak)
+            lines.append(f"{bucket:%H:%M} {ok:>7} {failed:>6} {bar}")
+        lines += ["", "Top failing hosts"]
+        lines += [f"  {name[:20]:<20} {count:>6}" for name, count in dashboard.top_hosts()] or ["  none"]
+        lines += ["", "Top services"]
+        lines += [f"  {name[:20]:<20} {count:>6}" for name, count in dashboard.top_services()] or ["  none"]
+        return "\n".join(lines)
 
     def action_quit(self):
         self.app.exit()
@@ -135,26 +769,22 @@ class EyeViewerApp(App):
     BINDINGS = [Binding("ctrl+q", "quit", "Quit")]
 
     async def on_mount(self):
-        username = None
+        # A running agent already holds the key, so no password or KDF run is needed
+        unlocked = keyagent.get_key()
+        if unlocked:
+            self.push_screen(LogViewerScreen(*unlocked))
+            return
         password = config("USER_PASSWORD", default=None)
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT username, password_hash, kdf_salt FROM users LIMIT 1")
-            row = cursor.fetchone()
-            cursor.close()
-            conn.close()
-            if row:
-                username, stored_hash, kdf_salt = row
-                if password and stored_hash == hash_password(password):
-                    user_key = derive_aes_key(password, kdf_salt)
-                    env_path = pathlib.Path(".env")
-                    if env_path.exists():
-                        lines = env_path.read_text().splitlines()
-                        new_lines = [line for line in lines if not line.strip().startswith("USER_PASSWORD=")]
-                        env_path.write_text("\n".join(new_lines) + ("\n" if new_lines else ""))
-                    self.push_screen(LogViewerScreen(username, user_key))
-                    return
+            unlocked = unlock_user(password) if password else None
+            if unlocked:
+                env_path = pathlib.Path(".env")
+                if env_path.exists():
+                    lines = env_path.read_text().splitlines()
+                    new_lines = [line for line in lines if not line.strip().startswith("USER_PASSWORD=")]
+                    env_path.write_text("\n".join(new_lines) + ("\n" if new_lines else ""))
+                self.push_screen(LogViewerScreen(*unlocked))
+                return
         except Exception as e:
             self.push_screen(ErrorScreen(f"Auto-login failed: {e}"))
             return
@@ -171,21 +801,14 @@ class EyeViewerApp(App):
                 error_widget.update("Username and password required.")
                 return
             try:
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute("SELECT password_hash, kdf_salt FROM users WHERE username = %s", (username,))
-                row = cursor.fetchone()
-                cursor.close()
-                conn.close()
-                if not row:
-                    error_widget.update("Invalid username or password.")
-                    return
-                stored_hash, kdf_salt = row
-                if stored_hash != hash_password(password):
+                try:
+                    unlocked = keyagent.unlock(password, username)
+                except OSError:
+                    unlocked = unlock_user(password, username)
+                if not unlocked:
                     error_widget.update("Invalid username or password.")
                     return
-                user_key = derive_aes_key(password, kdf_salt)
-                self.push_screen(LogViewerScreen(username, user_key))
+                self.push_screen(LogViewerScreen(*unlocked))
             except Exception as e:
                 error_widget.update(f"Login failed: {e}")
 
@@ -0,0 +1,178 @@
+import os
+import re
+import sys
+import gzip
+import time
+import hashlib
+import argparse
+import itertools
+import pathlib
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from decouple import config
+from lib import DataKeyring, get_db_connection, load_index_key
+from log import BLIND_INDEX, ROLLUPS, KEY_PERIOD_SECONDS, prepare_rows, insert_rows, load_user_key
+from rollup import RollupWriter
+from schema import migrate
+from storage import get_storage
+from syslog_parser import SyslogParser, DETECT_SAMPLE
+
+IMPORT_BATCH_SIZE = config("IMPORT_BATCH_SIZE", default=5000, cast=int)
+IMPORT_WORKERS = config("IMPORT_WORKERS", default=os.cpu_count() or 1, cast=int)
+IDENTITY_BYTES = 64 * 1024
+PROGRESS_INTERVAL = 2.0
+
+LEDGER_UPSERT = get_storage().upsert(
+    "import_ledger", ("fingerprint", "path", "lines_done", "file_size", "head_len", "completed"), keys=("fingerprint",)
+)
+
+def open_log(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+def read_head(path):
+    # The decompressed head, so auth.log.1 and auth.log.1.gz are the same file
+    with open_log(path) as f:
+        return f.read(IDENTITY_BYTES).encode()
+
+def find_ledger(cursor, head):
+    """(fingerprint, lines_done, file_size, head_len, completed) of the file starting with `head`.
+
+    A file shorter than IDENTITY_BYTES when it was imported has a different
+    fingerprint once lines are appended, so it is found by its hashed prefix.
+    """
+    fingerprint = hashlib.sha256(head).hexdigest()
+    columns = "fingerprint, lines_done, file_size, head_len, completed"
+    cursor.execute(f"SELECT {columns} FROM import_ledger WHERE fingerprint = %s", (fingerprint,))
+    row = cursor.fetchone()
+    if row:
+        return row
+    cursor.execute(f"SELECT {columns} FROM import_ledger WHERE head_len < %s", (len(head),))
+    for row in cursor.fetchall():
+        if hashlib.sha256(head[:row[3]]).hexdigest() == row[0]:
+            return row
+    return fingerprint, 0, 0, len(head), 0
+
+def rotation_index(path):
+    # auth.log.3.gz -> 3, auth.log -> 0; higher numbers are older
+    m = re.search(r"\.(\d+)(?:\.gz)?$", path)
+    return int(m.group(1)) if m else 0
+
+def _process_chunk(lines, fmt, now, data_key, index_key=None):
+    parser = SyslogParser(fmt, now=now)
+    parsed = [p for p in map(parser.parse, lines) if p]
+    rows, tokens, rollup = prepare_rows(parsed, data_key, index_key)
+    return rows, tokens, rollup, parser.rejected
+
+def import_file(path, conn, keyring, pool, workers, batch_size=IMPORT_BATCH_SIZE, index_key=None):
+    cursor = conn.cursor()
+    file_size = os.path.getsize(path)
+    fingerprint, lines_done, done_size, head_len, completed = find_ledger(cursor, read_head(path))
+    # The same head with a different size is the same file after more lines were appended
+    # (e.g. the live auth.log imported, then rotated), so it resumes after the lines already done
+    if completed and done_size == file_size:
+        print(f"[IMPORT] {path}: already imported, skipping.")
+        cursor.close()
+        return 0
+    if completed:
+        print(f"[IMPORT] {path}: changed since it was imported, resuming after line {lines_done}.")
+    rollups = RollupWriter(index_key) if index_key and ROLLUPS else None
+
+    # Undated BSD stamps are resolved relative to when the file was last written
+    now = datetime.fromtimestamp(os.path.getmtime(path))
+    inserted = rejected = 0
+    start = last_report = time.monotonic()
+    with open_log(path) as f:
+        lines = itertools.islice(f, lines_done, None)
+        head = list(itertools.islice(lines, DETECT_SAMPLE))
+        fmt = SyslogParser.detect(head)
+        if fmt is None and head:
+            print(f"[IMPORT] {path}: unrecognised log format, skipping.")
+            cursor.close()
+            return 0
+        lines = itertools.chain(head, lines)
+        pending = deque()
+
+        def commit_next():
+            nonlocal inserted, rejected, lines_done, last_report
+            future, data_key, consumed = pending.popleft()
+            rows, tokens, rollup, chunk_rejected = future.result()
+            labelled = []
+            if rows:
+                key_id = keyring.persist(conn, data_key)
+                insert_rows(cursor, rows, tokens, key_id)
+                if rollup and rollups:
+                    labelled = rollups.write(cursor, *rollup)
+            lines_done += consumed
+            # Rows and progress are committed together, so a re-run resumes exactly here
+            cursor.execute(LEDGER_UPSERT, (fingerprint, path, lines_done, 0, head_len, 0))
+            conn.commit()
+            if labelled:
+                rollups.stored(labelled)
+            inserted += len(rows)
+            rejected += chunk_rejected
+            now_ts = time.monotonic()
+            if now_ts - last_report >= PROGRESS_INTERVAL:
+                last_report = now_ts
+                print(f"[IMPORT] {path}: {inserted} rows, {inserted / (now_ts - start):,.0f} rows/s")
+
+        while True:
+            chunk = list(itertools.islice(lines, batch_size))
+            if not chunk:
+                break
+            data_key = keyring.current()
+            pending.append((pool.submit(_process_chunk, chunk, fmt, now, data_key.key, index_key), data_key, len(chunk)))
+            if len(pending) >= workers * 2:
+                commit_next()
+        while pending:
+            commit_next()
+
+    cursor.execute(LEDGER_UPSERT, (fingerprint, path, lines_done, file_size, head_len, 1))
+    conn.commit()
+    cursor.close()
+    elapsed = max(time.monotonic() - start, 1e-9)
+    print(f"[IMPORT] {path}: done, {inserted} rows ({rejected} rejected) in {elapsed:.1f}s, "
+          f"{inserted / elapsed:,.0f} rows/s")
+    return inserted
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="log.py import", description="Import historical auth.log files")
+    ap.add_argument("files", nargs="+", help="log files, plain or .gz")
+    ap.add_argument("--workers", type=int, default=IMPORT_WORKERS)
+    ap.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = ap.parse_args(argv)
+
+    # Oldest rotation first so row ids follow time order
+    files = sorted(args.files, key=rotation_index, reverse=True)
+    try:
+        conn = get_db_connection()
+        migrate(conn)
+        user_key = load_user_key(conn)
+        keyring = DataKeyring(user_key, KEY_PERIOD_SECONDS)
+        index_key = load_index_key(conn, user_key) if BLIND_INDEX or ROLLUPS else None
+    except Exception as e:
+        print(f"[ERROR] Failed to set up DB/key: {e}")
+        return 1
+
+    total = 0
+    start = time.monotonic()
+    workers = max(1, args.workers)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path in files:
+                try:
+                    total += import_file(path, conn, keyring, pool, workers, args.batch_size, index_key)
+                except Exception as e:
+                    conn.rollback()
+                    print(f"[ERROR] Failed to import {path}: {e}")
+    finally:
+        conn.close()
+    pathlib.Path(".log_update").touch()
+    elapsed = max(time.monotonic() - start, 1e-9)
+    print(f"[IMPORT] {total} rows from {len(files)} files in {elapsed:.1f}s, {total / elapsed:,.0f} rows/s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
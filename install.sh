@@ -29,9 +29,18 @@ detect_env() {
     fi
 }
 
+choose_backend() {
+    read -p "Storage backend, mysql or sqlite (default: mysql): " backend
+    DB_BACKEND=${backend:-mysql}
+}
+
 install_dependencies() {
     $SUDO apt update
-    $SUDO apt install -y python3 openssh-server mariadb-server rsyslog curl
+    if [ "$DB_BACKEND" = "sqlite" ]; then
+        $SUDO apt install -y python3 openssh-server rsyslog curl
+    else
+        $SUDO apt install -y python3 openssh-server mariadb-server rsyslog curl
+    fi
 }
 
 install_uv() {
@@ -70,6 +79,20 @@ start_service() {
 }
 
 
+setup_sqlite() {
+    read -p "Enter database file (default: $(pwd)/logcrypt.db): " dbpath
+    dbpath=${dbpath:-$(pwd)/logcrypt.db}
+    read -p "Enter table name (default: auth_log): " tablename
+    tablename=${tablename:-auth_log}
+
+    # Tables are created by the loader on first start
+    cat > .env <<EOF
+DB_BACKEND=sqlite
+SQLITE_PATH=${dbpath}
+TABLE_NAME=${tablename}
+EOF
+}
+
 setup_database() {
     read -p "Enter database name (default: grooot): " dbname
     dbname=${dbname:-grooot}
@@ -87,19 +110,80 @@ setup_database() {
 
     CREATE TABLE IF NOT EXISTS \`${tablename}\` (
         id INT(11) NOT NULL AUTO_INCREMENT,
-        timestamp DATETIME DEFAULT NULL,
+        timestamp DATETIME NOT NULL,
         hostname VARCHAR(255) DEFAULT NULL,
         service VARCHAR(255) DEFAULT NULL,
         message TEXT DEFAULT NULL,
+        payload BLOB DEFAULT NULL,
         state VARCHAR(255) DEFAULT NULL,
+        key_id INT DEFAULT NULL,
+        PRIMARY KEY (id, timestamp),
+        KEY idx_state_ts (state, timestamp),
+        KEY idx_timestamp (timestamp)
+    )
+    PARTITION BY RANGE COLUMNS(timestamp) (PARTITION pmax VALUES LESS THAN (MAXVALUE));
+
+    CREATE TABLE IF NOT EXISTS data_keys (
+        id INT NOT NULL AUTO_INCREMENT,
+        period_start DATETIME NOT NULL,
+        wrapped_key VARCHAR(255) NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS index_keys (
+        id TINYINT NOT NULL,
+        wrapped_key VARCHAR(255) NOT NULL,
         PRIMARY KEY (id)
     );
 
+    CREATE TABLE IF NOT EXISTS log_tokens (
+        token BINARY(16) NOT NULL,
+        log_id INT NOT NULL,
+        PRIMARY KEY (token, log_id),
+        KEY idx_log_id (log_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS token_sweeps (
+        first_id INT NOT NULL,
+        last_id INT NOT NULL,
+        PRIMARY KEY (first_id, last_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS log_rollup (
+        bucket DATETIME NOT NULL,
+        state VARCHAR(255) NOT NULL,
+        host_token BINARY(16) NOT NULL,
+        service_token BINARY(16) NOT NULL,
+        count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, state, host_token, service_token)
+    );
+
+    CREATE TABLE IF NOT EXISTS rollup_labels (
+        token BINARY(16) NOT NULL,
+        kind VARCHAR(16) NOT NULL,
+        label VARBINARY(1024) NOT NULL,
+        PRIMARY KEY (token)
+    );
+
     CREATE TABLE IF NOT EXISTS users (
         id INT PRIMARY KEY AUTO_INCREMENT,
         username VARCHAR(255) NOT NULL,
         password_hash TEXT NOT NULL,
-        kdf_salt VARBINARY(16) NOT NULL
+        kdf_salt VARBINARY(16) NOT NULL,
+        kdf_params VARCHAR(255) DEFAULT NULL,
+        key_check CHAR(64) DEFAULT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS import_ledger (
+        fingerprint CHAR(64) NOT NULL,
+        path VARCHAR(1024) NOT NULL,
+        lines_done BIGINT NOT NULL DEFAULT 0,
+        file_size BIGINT NOT NULL DEFAULT 0,
+        head_len INT NOT NULL DEFAULT 65536,
+        completed TINYINT(1) NOT NULL DEFAULT 0,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (fingerprint)
     );
 
     CREATE USER IF NOT EXISTS '${dbuser}'@'localhost' IDENTIFIED BY '${dbpass}';
@@ -130,13 +214,18 @@ EOF
 main() {
     print_banner
     detect_env
+    choose_backend
     install_dependencies
     install_uv
     configure_services
     start_service rsyslogd
     start_service /usr/sbin/sshd
-    start_service mariadb
-    setup_database
+    if [ "$DB_BACKEND" = "sqlite" ]; then
+        setup_sqlite
+    else
+        start_service mariadb
+        setup_database
+    fi
     create_logcrypt_launcher
     echo "LogCrypt installation complete."
     echo "Enter 'logcrypt' to start the application."
@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import time
+import base64
+import fcntl
+import ctypes
+import socket
+import struct
+import resource
+import subprocess
+import socketserver
+import threading
+from decouple import config
+from lib import unlock_user, runtime_path, make_socket_dir
+
+AGENT_SOCKET = config("AGENT_SOCKET", default=runtime_path("agent.sock"))
+AGENT_START_TIMEOUT = 5.0
+AGENT_REQUEST_TIMEOUT = 30.0
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+class LockedKey:
+    """Holds the user key in a buffer pinned with mlock, so it is never swapped out.
+
+    Python may still make short-lived copies when the key is used; the buffer
+    itself is zeroed on `wipe`.
+    """
+
+    def __init__(self, key: bytes):
+        self._buf = bytearray(key)
+        self._view = (ctypes.c_char * len(self._buf)).from_buffer(self._buf)
+        self.locked = _libc.mlock(ctypes.addressof(self._view), len(self._buf)) == 0
+        if not self.locked:
+            print(f"[ERROR] mlock failed ({os.strerror(ctypes.get_errno())}), key may be swapped")
+
+    def get(self) -> bytes:
+        return bytes(self._buf)
+
+    def wipe(self):
+        ctypes.memset(ctypes.addressof(self._view), 0, len(self._buf))
+        if self.locked:
+            _libc.munlock(ctypes.addressof(self._view), len(self._buf))
+            self.locked = False
+
+class KeyAgent:
+    def __init__(self):
+        self.username = None
+        self.key = None
+        self._lock = threading.Lock()
+
+    def handle(self, request):
+        op = request.get("op")
+        if op == "ping":
+            return {"ok": True, "unlocked": self.key is not None}
+        if op == "get":
+            with self._lock:
+                if self.key is None:
+                    return {"ok": False, "error": "locked"}
+                return {"ok": True, "username": self.username, "key": base64.b64encode(self.key.get()).decode()}
+        if op == "unlock":
+            # The KDF runs here, once per login; later callers only ask for the result
+            unlocked = unlock_user(request["password"], request.get("username"))
+            if not unlocked:
+                return {"ok": False, "error": "wrong password"}
+            with self._lock:
+                if self.key:
+                    self.key.wipe()
+                self.username, self.key = unlocked[0], LockedKey(unlocked[1])
+            return {"ok": True, "username": self.username, "key": base64.b64encode(unlocked[1]).decode()}
+        if op == "lock":
+            with self._lock:
+                if self.key:
+                    self.key.wipe()
+                self.username = self.key = None
+            return {"ok": True}
+        return {"ok": False, "error": f"unknown op {op!r}"}
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        creds = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        _, uid, _ = struct.unpack("3i", creds)
+        if uid not in (0, os.getuid()):
+            return
+        try:
+            response = self.server.agent.handle(json.loads(self.rfile.readline()))
+        except Exception as e:
+            response = {"ok": False, "error": str(e)}
+        self.wfile.write((json.dumps(response) + "\n").encode())
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+def serve(path=AGENT_SOCKET):
+    # No core dumps: they would contain the key
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    make_socket_dir(path)
+    # Held while the agent runs, so two agents started together never take each other's socket
+    lock = open(f"{path}.lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return
+    if os.path.exists(path):
+        try:
+            request({"op": "ping"}, path, timeout=1)
+            # An agent from before the lock file is still answering
+            lock.close()
+            return
+        except (OSError, ValueError):
+            os.unlink(path)
+    old_umask = os.umask(0o177)
+    try:
+        server = _Server(path, _Handler)
+    finally:
+        os.umask(old_umask)
+    server.agent = KeyAgent()
+    try:
+        server.serve_forever()
+    finally:
+        if server.agent.key:
+            server.agent.key.wipe()
+        server.server_close()
+        os.unlink(path)
+        lock.close()
+
+def request(message, path=AGENT_SOCKET, timeout=AGENT_REQUEST_TIMEOUT):
+    """Send one request to the agent; raises OSError when it is not running."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall((json.dumps(message) + "\n").encode())
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data)
+
+def get_key(path=AGENT_SOCKET):
+    """Return (username, user_key) from a running, unlocked agent, else None."""
+    try:
+        response = request({"op": "get"}, path)
+    except (OSError, ValueError):
+        return None
+    if not response.get("ok"):
+        return None
+    return response["username"], base64.b64decode(response["key"])
+
+def unlock(password, username=None, path=AGENT_SOCKET):
+    """Unlock the agent; returns (username, user_key) or None for a wrong password."""
+    response = request({"op": "unlock", "password": password, "username": username}, path)
+    if not response.get("ok"):
+        if response.get("error") == "wrong password":
+            return None
+        raise OSError(response.get("error"))
+    return response["username"], base64.b64decode(response["key"])
+
+def ensure_agent(path=AGENT_SOCKET):
+    """Start the agent in the background unless it is already answering; True once it is."""
+    try:
+        request({"op": "ping"}, path, timeout=1)
+        return True
+    except (OSError, ValueError):
+        pass
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__)],
+        start_new_session=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + AGENT_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            request({"op": "ping"}, path, timeout=1)
+            return True
+        except (OSError, ValueError):
+            time.sleep(0.05)
+    return False
+
+if __name__ == "__main__":
+    serve()
@@ -1,20 +1,214 @@
 import os
+import hmac
+import json
+import time
 import hashlib
 import base64
+import struct
 import secrets
-import mysql.connector
+import tempfile
+import threading
+from datetime import datetime, timezone
+from collections import OrderedDict
 from hashlib import pbkdf2_hmac
-from Crypto.Cipher import AES
+from Crypto.Cipher import AES, ChaCha20_Poly1305
 from Crypto.Util.Padding import pad, unpad
 from decouple import config
+from storage import get_storage
 
-def get_db_connection():
-    return mysql.connector.connect(
-        host="localhost",
-        user=config("DB_USER", default="grooot"),
-        password=config("DB_PASS", default="grooot"),
-        database=config("DB_NAME", default="grooot")
-    )
+DB_POOL_SIZE = config("DB_POOL_SIZE", default=4, cast=int)
+DB_POOL_TIMEOUT = config("DB_POOL_TIMEOUT", default=10.0, cast=float)
+DB_HEALTH_CHECK_INTERVAL = config("DB_HEALTH_CHECK_INTERVAL", default=30.0, cast=float)
+DB_RECONNECT_ATTEMPTS = config("DB_RECONNECT_ATTEMPTS", default=5, cast=int)
+DB_RECONNECT_BACKOFF = config("DB_RECONNECT_BACKOFF", default=0.5, cast=float)
+DB_RECONNECT_BACKOFF_MAX = 10.0
+KDF = config("KDF", default="scrypt")
+PBKDF2_ITERATIONS = config("PBKDF2_ITERATIONS", default=600_000, cast=int)
+SCRYPT_N = config("SCRYPT_N", default=1 << 15, cast=int)
+SCRYPT_R = config("SCRYPT_R", default=8, cast=int)
+SCRYPT_P = config("SCRYPT_P", default=1, cast=int)
+# What users created before KDF parameters were stored were derived with
+LEGACY_KDF_PARAMS = {"alg": "pbkdf2-sha256", "iterations": 100_000}
+
+def connect_db():
+    return get_storage().connect()
+
+def is_connection_error(error: Exception) -> bool:
+    return get_storage().is_connection_error(error)
+
+def backoff_delay(attempt: int) -> float:
+    return min(DB_RECONNECT_BACKOFF * (2 ** attempt), DB_RECONNECT_BACKOFF_MAX)
+
+def runtime_path(name: str) -> str:
+    """`name` in this user's runtime directory, so every process finds it whatever its working directory."""
+    base = os.environ.get("XDG_RUNTIME_DIR")
+    if base:
+        return os.path.join(base, "logcrypt", name)
+    return os.path.join(tempfile.gettempdir(), f"logcrypt-{os.getuid()}", name)
+
+def make_socket_dir(path: str) -> None:
+    """Create the directory a socket is bound in, private to this user."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    # The fallback lives in the shared temp directory, where someone else could have created it first
+    if directory.startswith(tempfile.gettempdir()) and os.stat(directory).st_uid != os.getuid():
+        raise OSError(f"{directory} belongs to another user")
+
+class PooledConnection:
+    """A connection borrowed from a ConnectionPool; close() hands it back."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._broken = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def invalidate(self):
+        """Mark the connection as dead so it is discarded instead of reused."""
+        self._broken = True
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn, broken=self._broken)
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and is_connection_error(exc):
+            self._broken = True
+        self.close()
+
+class ConnectionPool:
+    def __init__(self, size=DB_POOL_SIZE, connect=connect_db, timeout=DB_POOL_TIMEOUT,
+                 health_check_interval=DB_HEALTH_CHECK_INTERVAL):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._connect = connect
+        self._idle = []
+        self._open = 0
+        self._cond = threading.Condition()
+        self.stats = {"checkouts": 0, "waits": 0, "reconnects": 0, "connect_failures": 0,
+                      "health_checks": 0, "open": 0, "idle": 0}
+
+    def _connect_with_backoff(self):
+        for attempt in range(DB_RECONNECT_ATTEMPTS):
+            try:
+                return self._connect()
+            except Exception as e:
+                with self._cond:
+                    self.stats["connect_failures"] += 1
+                if attempt == DB_RECONNECT_ATTEMPTS - 1 or not is_connection_error(e):
+                    raise
+                time.sleep(backoff_delay(attempt))
+
+    def _healthy(self, conn, idle_since):
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        with self._cond:
+            self.stats["health_checks"] += 1
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def get(self) -> PooledConnection:
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            self.stats["checkouts"] += 1
+            waited = False
+            while not self._idle and self._open >= self.size:
+                if not waited:
+                    self.stats["waits"] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No database connection available within {self.timeout}s")
+                self._cond.wait(remaining)
+            if self._idle:
+                conn, idle_since = self._idle.pop()
+            else:
+                conn, idle_since = None, None
+                self._open += 1
+            self._update_gauges()
+
+        if conn is not None and self._healthy(conn, idle_since):
+            return PooledConnection(self, conn)
+        try:
+            if conn is not None:
+                self._close_quietly(conn)
+            fresh = self._connect_with_backoff()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._update_gauges()
+                self._cond.notify()
+            raise
+        if conn is not None:
+            with self._cond:
+                self.stats["reconnects"] += 1
+        return PooledConnection(self, fresh)
+
+    def release(self, conn, broken=False):
+        if not broken:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except Exception:
+                broken = True
+        with self._cond:
+            if broken:
+                self._open -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._update_gauges()
+            self._cond.notify()
+        if broken:
+            self._close_quietly(conn)
+
+    def _update_gauges(self):
+        self.stats["open"] = self._open
+        self.stats["idle"] = len(self._idle)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return dict(self.stats)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._update_gauges()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
+
+def get_db_connection() -> PooledConnection:
+    return get_pool().get()
+
+def pool_stats() -> dict:
+    return get_pool().snapshot()
 
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
@@ -25,16 +219,70 @@ def generate_salt(length: int = 16) -> bytes:
 def derive_aes_key(password: str, salt: bytes, iterations: int = 100_000) -> bytes:
     return pbkdf2_hmac('sha256', password.encode(), salt, iterations, dklen=32)
 
+def default_kdf_params() -> dict:
+    if KDF == "pbkdf2":
+        return {"alg": "pbkdf2-sha256", "iterations": PBKDF2_ITERATIONS}
+    return {"alg": "scrypt", "n": SCRYPT_N, "r": SCRYPT_R, "p": SCRYPT_P}
+
+def derive_user_key(password: str, salt: bytes, params=None) -> bytes:
+    """Derive the user key with the parameters stored for that user."""
+    params = params or LEGACY_KDF_PARAMS
+    if params["alg"] == "scrypt":
+        n, r, p = params["n"], params["r"], params["p"]
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=128 * r * (n + p + 2), dklen=32)
+    if params["alg"] == "pbkdf2-sha256":
+        return derive_aes_key(password, salt, params["iterations"])
+    raise ValueError(f"Unknown KDF: {params['alg']}")
+
+def key_check_value(user_key: bytes) -> str:
+    # Proves the password without storing anything a fast hash could be tried against
+    return hmac.new(user_key, b"logcrypt key check", hashlib.sha256).hexdigest()
+
+def unlock_user(password: str, username: str = None, conn=None):
+    """Run the KDF once and return (username, user_key), or None for a wrong password.
+
+    Users from before key-check values existed are verified against the old
+    SHA-256 hash once, then upgraded so the hash is no longer stored.
+    """
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        cursor = conn.cursor()
+        row = get_storage().find_user(cursor, username)
+        if not row:
+            cursor.close()
+            return None
+        username, stored_hash, kdf_salt, kdf_params, key_check = row
+        if key_check:
+            user_key = derive_user_key(password, kdf_salt, json.loads(kdf_params) if kdf_params else None)
+            ok = hmac.compare_digest(key_check_value(user_key), key_check)
+        else:
+            ok = hmac.compare_digest(stored_hash or "", hash_password(password))
+            if ok:
+                user_key = derive_user_key(password, kdf_salt, LEGACY_KDF_PARAMS)
+                cursor.execute(
+                    "UPDATE users SET kdf_params = %s, key_check = %s, password_hash = '' WHERE username = %s",
+                    (json.dumps(LEGACY_KDF_PARAMS), key_check_value(user_key), username)
+                )
+                conn.commit()
+        cursor.close()
+        return (username, user_key) if ok else None
+    finally:
+        if own_conn:
+            conn.close()
+
 def create_user(username: str, password: str):
     try:
         conn = get_db_connection()
-        password_hash = hash_password(password)
         kdf_salt = generate_salt()
+        kdf_params = default_kdf_params()
+        user_key = derive_user_key(password, kdf_salt, kdf_params)
 
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO users (username, password_hash, kdf_salt) VALUES (%s, %s, %s)",
-            (username, password_hash, kdf_salt)
+            "INSERT INTO users (username, password_hash, kdf_salt, kdf_params, key_check) VALUES (%s, '', %s, %s, %s)",
+            (username, kdf_salt, json.dumps(kdf_params), key_check_value(user_key))
         )
         conn.commit()
         cursor.close()
@@ -69,4 +317,295 @@ def decrypt_data(enc_data_b64: str, data_key: bytes) -> str:
     raw = base64.b64decode(enc_data_b64)
     iv, ciphertext = raw[:16], raw[16:]
     cipher = AES.new(data_key, AES.MODE_CBC, iv)
-    return unpad(cipher.decrypt(ciphertext), AES.block_size).decode() 
\ No newline at end of file
+    return unpad(cipher.decrypt(ciphertext), AES.block_size).decode() 
+
+# Base64 text columns, one cipher text per field
+ROW_FORMAT_V1 = 1
+# One sealed binary record per row in the payload column
+ROW_FORMAT_V2 = 2
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+class AesCbcCipher:
+    """Legacy AES-CBC with PKCS#7 padding; no integrity check."""
+    name = "aes-cbc"
+    tag = 1
+
+    def seal(self, plaintext: bytes, key: bytes) -> bytes:
+        iv = secrets.token_bytes(AES.block_size)
+        return iv + AES.new(key, AES.MODE_CBC, iv).encrypt(pad(plaintext, AES.block_size))
+
+    def open(self, body: bytes, key: bytes) -> bytes:
+        iv, ciphertext = body[:AES.block_size], body[AES.block_size:]
+        return unpad(AES.new(key, AES.MODE_CBC, iv).decrypt(ciphertext), AES.block_size)
+
+class AesGcmCipher:
+    name = "aes-gcm"
+    tag = 2
+
+    def seal(self, plaintext: bytes, key: bytes) -> bytes:
+        nonce = secrets.token_bytes(NONCE_SIZE)
+        ciphertext, mac = AES.new(key, AES.MODE_GCM, nonce=nonce).encrypt_and_digest(plaintext)
+        return nonce + ciphertext + mac
+
+    def open(self, body: bytes, key: bytes) -> bytes:
+        nonce, ciphertext, mac = body[:NONCE_SIZE], body[NONCE_SIZE:-TAG_SIZE], body[-TAG_SIZE:]
+        return AES.new(key, AES.MODE_GCM, nonce=nonce).decrypt_and_verify(ciphertext, mac)
+
+class ChaCha20Poly1305Cipher:
+    name = "chacha20-poly1305"
+    tag = 3
+
+    def seal(self, plaintext: bytes, key: bytes) -> bytes:
+        nonce = secrets.token_bytes(NONCE_SIZE)
+        ciphertext, mac = ChaCha20_Poly1305.new(key=key, nonce=nonce).encrypt_and_digest(plaintext)
+        return nonce + ciphertext + mac
+
+    def open(self, body: bytes, key: bytes) -> bytes:
+        nonce, ciphertext, mac = body[:NONCE_SIZE], body[NONCE_SIZE:-TAG_SIZE], body[-TAG_SIZE:]
+        return ChaCha20_Poly1305.new(key=key, nonce=nonce).decrypt_and_verify(ciphertext, mac)
+
+CIPHERS = {}
+CIPHERS_BY_NAME = {}
+
+def register_cipher(cipher) -> None:
+    if cipher.tag in CIPHERS and CIPHERS[cipher.tag] is not cipher:
+        raise ValueError(f"Cipher tag {cipher.tag} is already registered")
+    CIPHERS[cipher.tag] = cipher
+    CIPHERS_BY_NAME[cipher.name] = cipher
+
+for _cipher in (AesCbcCipher(), AesGcmCipher(), ChaCha20Poly1305Cipher()):
+    register_cipher(_cipher)
+
+DEFAULT_CIPHER = config("CIPHER", default=ChaCha20Poly1305Cipher.name)
+
+def get_cipher(name: str):
+    try:
+        return CIPHERS_BY_NAME[name]
+    except KeyError:
+        raise ValueError(f"Unknown cipher {name!r}, expected one of {sorted(CIPHERS_BY_NAME)}")
+
+def seal(plaintext: bytes, key: bytes, cipher: str = DEFAULT_CIPHER) -> bytes:
+    """Encrypt with the named cipher; the output starts with its one-byte tag."""
+    impl = get_cipher(cipher)
+    return bytes([impl.tag]) + impl.seal(plaintext, key)
+
+def unseal(blob: bytes, key: bytes) -> bytes:
+    """Decrypt a `seal` output, picking the cipher from its tag. Raises ValueError on tampering."""
+    blob = bytes(blob)
+    impl = CIPHERS.get(blob[0]) if blob else None
+    if impl is None:
+        raise ValueError(f"Unknown cipher tag {blob[:1].hex() or 'none'}")
+    return impl.open(blob[1:], key)
+
+def pack_fields(fields) -> bytes:
+    parts = []
+    for field in fields:
+        raw = field.encode()
+        parts.append(struct.pack(">I", len(raw)))
+        parts.append(raw)
+    return b"".join(parts)
+
+def unpack_fields(blob: bytes) -> tuple:
+    fields = []
+    pos = 0
+    while pos < len(blob):
+        (length,) = struct.unpack_from(">I", blob, pos)
+        pos += 4
+        fields.append(blob[pos:pos + length].decode())
+        pos += length
+    return tuple(fields)
+
+def seal_record(fields, data_key: bytes, cipher: str = DEFAULT_CIPHER) -> bytes:
+    """Encrypt all fields of a row together: cipher tag | nonce | ciphertext | MAC."""
+    return seal(pack_fields(fields), data_key, cipher)
+
+def open_record(record: bytes, data_key: bytes) -> tuple:
+    return unpack_fields(unseal(record, data_key))
+
+def decrypt_row(enc_host, enc_service, enc_msg, payload, data_key: bytes) -> tuple:
+    """Return (host, service, message) from either storage format."""
+    if payload is not None:
+        return open_record(payload, data_key)
+    return (
+        decrypt_data(enc_host, data_key),
+        decrypt_data(enc_service, data_key),
+        decrypt_data(enc_msg, data_key),
+    )
+
+class LRUCache:
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        # The viewer fills its caches from worker threads while the UI reads them
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+                return self._data[key]
+            except KeyError:
+                return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        self._data.clear()
+
+class DataKey:
+    def __init__(self, key: bytes, wrapped: str, period_start: datetime, key_id=None):
+        self.key = key
+        self.wrapped = wrapped
+        self.period_start = period_start
+        self.id = key_id
+
+class DataKeyring:
+    """Hands out one random data key per period, wrapped with the user key.
+
+    Keys are created in memory and only written to `data_keys` by `persist`,
+    so the caller can do that on whichever thread owns the DB connection.
+    """
+
+    def __init__(self, user_key: bytes, period_seconds: int = 86400):
+        self.user_key = user_key
+        self.period_seconds = max(1, period_seconds)
+        self._current = None
+        self._lock = threading.Lock()
+
+    def _period_start(self, now: datetime) -> datetime:
+        epoch = int(now.timestamp())
+        start = epoch - epoch % self.period_seconds
+        return datetime.fromtimestamp(start, timezone.utc).replace(tzinfo=None)
+
+    def current(self) -> DataKey:
+        period_start = self._period_start(datetime.now(timezone.utc))
+        with self._lock:
+            if self._current is None or self._current.period_start != period_start:
+                key = generate_data_key()
+                self._current = DataKey(key, encrypt_data_key(key, self.user_key), period_start)
+            return self._current
+
+    @staticmethod
+    def persist(conn, data_key: DataKey) -> int:
+        # Committed on its own so a failed batch can never orphan rows from their key
+        if data_key.id is None:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO data_keys (period_start, wrapped_key) VALUES (%s, %s)",
+                (data_key.period_start, data_key.wrapped)
+            )
+            conn.commit()
+            data_key.id = cursor.lastrowid
+            cursor.close()
+        return data_key.id
+
+def load_data_keys(cursor, key_ids, user_key: bytes, cache: LRUCache) -> None:
+    """Unwrap every key in `key_ids` that is not cached yet, with a single query."""
+    missing = [key_id for key_id in set(key_ids) if key_id is not None and key_id not in cache]
+    if not missing:
+        return
+    placeholders = ", ".join(["%s"] * len(missing))
+    cursor.execute(f"SELECT id, wrapped_key FROM data_keys WHERE id IN ({placeholders})", tuple(missing))
+    for key_id, wrapped in cursor.fetchall():
+        cache.put(key_id, decrypt_data_key(wrapped, user_key))
+
+def load_index_key(conn, user_key: bytes) -> bytes:
+    """Return the blind-index HMAC key, creating it on first use.
+
+    It is random and wrapped like a data key, so a password change only has to
+    re-wrap it; the tokens already stored stay valid.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT wrapped_key FROM index_keys WHERE id = 1")
+    row = cursor.fetchone()
+    if row is None:
+        # Insert-or-ignore so two processes starting together agree on one key
+        cursor.execute(
+            get_storage().insert_ignore("index_keys", ("id", "wrapped_key")),
+            (1, encrypt_data_key(generate_data_key(), user_key))
+        )
+        conn.commit()
+        cursor.execute("SELECT wrapped_key FROM index_keys WHERE id = 1")
+        row = cursor.fetchone()
+    cursor.close()
+    return decrypt_data_key(row[0], user_key)
+
+def adopt_legacy_rows(conn, table_name: str, user_key: bytes, chunk_size: int = 10_000) -> int:
+    """Point rows encrypted directly with the user key at a data key holding that key.
+
+    Afterwards every row is reached through `data_keys`, so a password change
+    only has to rewrap keys instead of re-encrypting rows.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT MIN(id), MAX(id) FROM {table_name} WHERE key_id IS NULL")
+    low, high = cursor.fetchone()
+    if low is None:
+        cursor.close()
+        return 0
+    cursor.execute(
+        "INSERT INTO data_keys (period_start, wrapped_key) VALUES (%s, %s)",
+        (datetime.now(timezone.utc).replace(tzinfo=None), encrypt_data_key(user_key, user_key))
+    )
+    legacy_key_id = cursor.lastrowid
+    conn.commit()
+    updated = 0
+    # Chunked by id range to keep each transaction short for the ingester
+    for start in range(low, high + 1, chunk_size):
+        cursor.execute(
+            f"UPDATE {table_name} SET key_id = %s WHERE key_id IS NULL AND id >= %s AND id < %s",
+            (legacy_key_id, start, start + chunk_size)
+        )
+        updated += cursor.rowcount
+        conn.commit()
+    cursor.close()
+    return updated
+
+def change_password(username: str, old_password: str, new_password: str) -> bool:
+    conn = get_db_connection()
+    try:
+        unlocked = unlock_user(old_password, username, conn)
+        if not unlocked:
+            return False
+        old_key = unlocked[1]
+        cursor = conn.cursor()
+        adopt_legacy_rows(conn, config("TABLE_NAME", default="auth_log"), old_key)
+        new_salt = generate_salt()
+        new_params = default_kdf_params()
+        new_key = derive_user_key(new_password, new_salt, new_params)
+        cursor.execute("SELECT id, wrapped_key FROM data_keys")
+        rewrapped = [
+            (encrypt_data_key(decrypt_data_key(wrapped, old_key), new_key), key_id)
+            for key_id, wrapped in cursor.fetchall()
+        ]
+        cursor.executemany("UPDATE data_keys SET wrapped_key = %s WHERE id = %s", rewrapped)
+        cursor.execute("SELECT wrapped_key FROM index_keys WHERE id = 1")
+        row = cursor.fetchone()
+        if row:
+            cursor.execute(
+                "UPDATE index_keys SET wrapped_key = %s WHERE id = 1",
+                (encrypt_data_key(decrypt_data_key(row[0], old_key), new_key),)
+            )
+        cursor.execute(
+            "UPDATE users SET password_hash = '', kdf_salt = %s, kdf_params = %s, key_check = %s WHERE username = %s",
+            (new_salt, json.dumps(new_params), key_check_value(new_key), username)
+        )
+        conn.commit()
+        cursor.close()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
@@ -6,7 +6,10 @@ import termios
 import tty
 import subprocess
 import json
+import threading
 from lib import get_db_connection
+from schema import migrate
+from storage import get_storage
 
 RED = "\033[91m"
 BLUE = "\033[94m"
@@ -18,35 +21,52 @@ TEXT = ">_ logcrypt"
 MAX_LOG_WIDTH = 45
 LOG_PADDING = 4
 LOG_LINES_DISPLAYED = 10
-SERVICE_START_DELAY = 0.5
 LOADER_END_DELAY = 2
 
-SERVICES = [
-    {
+if get_storage().embedded:
+    # The database is a file opened by each process; only migration and the user check remain
+    DATABASE_SERVICE = {"name": "database", "embedded": True, "ready": {"db": True}}
+else:
+    DATABASE_SERVICE = {
         "name": "mariadb",
         "check": "mariadbd",
-        "start": ["service", "mariadb", "start"]
-    },
+        "start": ["service", "mariadb", "start"],
+        "ready": {"db": True}
+    }
+
+SERVICES = [
+    DATABASE_SERVICE,
     {
         "name": "rsyslogd",
         "check": "rsyslogd",
-        "start": ["rsyslogd"]
+        "start": ["rsyslogd"],
+        "ready": {"pidfile": "/run/rsyslogd.pid"}
     },
     {
         "name": "ssh",
         "check": "sshd",
-        "start": ["/usr/sbin/sshd"]
+        "start": ["/usr/sbin/sshd"],
+        "ready": {"pidfile": "/run/sshd.pid"}
     },
     {
         "name": "application",
         "check": "log.py",
-        "start": ["/logcrypt/start.sh"]
+        "start": ["/logcrypt/start.sh"],
+        "requires": [DATABASE_SERVICE["name"]],
+        "ready": {"process": True}
     }
 ]
 
 APP_LOG_PATH = "/var/log/app.log"
 APP_CWD = "/logcrypt"
 LOADER_STATE_FILE = "loader_state.json"
+ANIMATION_INTERVAL = 0.5
+READY_POLL_INTERVAL = 0.1
+READY_TIMEOUT = 30
+
+# Exit codes main.py reacts to
+EXIT_NO_USER = 11
+EXIT_AWAIT_LOGIN = 12
 
 def hide_cursor():
     sys.stdout.write("\033[?25l")
@@ -76,12 +96,25 @@ def get_log_color(msg: str) -> str:
         return BLUE
     return WHITE
 
-def is_process_running(name: str) -> bool:
-    try:
-        output = subprocess.check_output(["pgrep", "-f", name])
-        return bool(output.strip())
-    except subprocess.CalledProcessError:
-        return False
+def process_table() -> list:
+    """Command lines of every running process, read once from /proc."""
+    own = os.getpid()
+    cmdlines = []
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit() or int(pid) == own:
+            continue
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                cmdline = f.read().replace(b"\0", b" ").decode(errors="replace").strip()
+        except OSError:
+            continue
+        if cmdline:
+            cmdlines.append(cmdline)
+    return cmdlines
+
+def is_process_running(name: str, table=None) -> bool:
+    # Same match as `pgrep -f`: the pattern anywhere in the full command line
+    return any(name in cmdline for cmdline in (process_table() if table is None else table))
 
 def start_service(command: list) -> bool:
     try:
@@ -98,6 +131,41 @@ def user_exists(conn):
         count = cursor.fetchone()[0]
     return count > 0
 
+def pid_alive(pidfile: str) -> bool:
+    try:
+        with open(pidfile) as f:
+            os.kill(int(f.read().split()[0]), 0)
+        return True
+    except PermissionError:
+        return True
+    except (OSError, ValueError, IndexError):
+        return False
+
+def probe_ready(service) -> bool:
+    ready = service.get("ready", {})
+    if ready.get("db"):
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+    if "pidfile" in ready and os.path.exists(ready["pidfile"]):
+        return pid_alive(ready["pidfile"])
+    if "socket" in ready:
+        return os.path.exists(ready["socket"])
+    return is_process_running(service["check"])
+
+def wait_ready(service, timeout=READY_TIMEOUT) -> bool:
+    deadline = time.monotonic() + timeout
+    while True:
+        if probe_ready(service):
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(READY_POLL_INTERVAL)
+
 def display_logs(logs, width, height, log_col):
     log_lines = logs[-LOG_LINES_DISPLAYED:]
     for i, log in enumerate(reversed(log_lines)):
@@ -107,10 +175,10 @@ def display_logs(logs, width, height, log_col):
         sys.stdout.write(f"{get_log_color(log)}{log.ljust(MAX_LOG_WIDTH)[:MAX_LOG_WIDTH]}{RESET}")
     sys.stdout.flush()
 
-def save_loader_state(logs, service_index):
+def save_loader_state(logs, done):
     state = {
         "logs": logs,
-        "service_index": service_index
+        "done": sorted(done)
     }
     with open(LOADER_STATE_FILE, "w") as f:
         json.dump(state, f)
@@ -120,8 +188,127 @@ def load_loader_state():
         with open(LOADER_STATE_FILE, "r") as f:
             state = json.load(f)
         os.remove(LOADER_STATE_FILE)
-        return state.get("logs", []), state.get("service_index", 0)
-    return [], 0
+        if "done" in state:
+            done = set(state["done"])
+        else:
+            # State written by the sequential loader
+            done = {service["name"] for service in SERVICES[:state.get("service_index", 0)]}
+        return state.get("logs", []), done
+    return [], set()
+
+class Startup:
+    """Brings SERVICES up concurrently, each one as soon as its `requires` are ready.
+
+    Workers only append to `logs`; the animation thread draws them. A worker
+    that needs main.py to step in (no user yet, login pending) records the
+    exit code in `exit_code` and stops its dependants.
+    """
+
+    def __init__(self, services, resume=False, logs=None, done=()):
+        self.services = services
+        self.resume = resume
+        self.logs = logs if logs is not None else []
+        self.warnings = []
+        self.exit_code = None
+        self.done = set(done)
+        self._lock = threading.Lock()
+        self._ready = {service["name"]: threading.Event() for service in services}
+        self._failed = set()
+        self.finished = threading.Event()
+
+    def log(self, msg, warning=False):
+        with self._lock:
+            self.logs.append(msg)
+            if warning:
+                self.warnings.append(msg)
+
+    def stop(self, code):
+        with self._lock:
+            # The first reason wins; "no user" is found before the application is reached
+            if self.exit_code is None:
+                self.exit_code = code
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.logs)
+
+    def _finish(self, name, ok):
+        with self._lock:
+            if ok:
+                self.done.add(name)
+            else:
+                self._failed.add(name)
+        self._ready[name].set()
+        if all(event.is_set() for event in self._ready.values()):
+            self.finished.set()
+
+    def _run(self, service, table):
+        name = service["name"]
+        for dep in service.get("requires", []):
+            self._ready[dep].wait()
+            if dep in self._failed:
+                self.log(f"Skipping {name}, {dep} is not ready..........")
+                self._finish(name, False)
+                return
+        try:
+            ok = self._bring_up(service, table)
+        except Exception as e:
+            self.log(f"❌ {name}: {e}", warning=True)
+            ok = False
+        self._finish(name, ok)
+
+    def _bring_up(self, service, table):
+        name = service["name"]
+        if name in self.done:
+            return True
+        if service.get("embedded"):
+            return self._check_database()
+        self.log(f"Checking {name}..........")
+        if is_process_running(service["check"], table):
+            self.log(f"{name} is already running..........")
+        else:
+            self.log(f"{name} not running..........")
+            if name == "application" and not self.resume:
+                self.log("🔒 Awaiting user login before starting application service...")
+                self.stop(EXIT_AWAIT_LOGIN)
+                return False
+            self.log(f"Starting service {name}..........")
+            if not start_service(service["start"]):
+                self.log(f"❌ Failed to start {name}.", warning=True)
+                return False
+            if not wait_ready(service):
+                self.log(f"❌ {name} did not become ready.", warning=True)
+                return False
+            self.log(f"Service {name} started..........")
+
+        if service.get("ready", {}).get("db"):
+            return self._check_database()
+        return True
+
+    def _check_database(self):
+        self.log("Checking database connection..........")
+        try:
+            with get_db_connection() as conn:
+                self.log("✅ Database connection established..........")
+                # Login reads the users columns added by later releases
+                migrate(conn)
+                if not user_exists(conn):
+                    self.log("❌ No user found. Please create a user in the UI.", warning=True)
+                    self.stop(EXIT_NO_USER)
+                    return False
+                self.log("User exists. Continuing startup..........")
+                return True
+        except Exception as e:
+            self.log(f"❌ Database connection failed: {e}", warning=True)
+            return False
+
+    def start(self):
+        # One scan answers every "is it running" question; only readiness polls look again
+        table = process_table()
+        for service in self.services:
+            threading.Thread(
+                target=self._run, args=(service, table), name=f"start-{service['name']}", daemon=True
+            ).start()
 
 def loader():
     size = shutil.get_terminal_size()
@@ -134,106 +321,44 @@ def loader():
     old_settings = termios.tcgetattr(fd)
     tty.setcbreak(fd)
 
-    logs, service_index = [], 0
-    warnings = []
-    if "--resume" in sys.argv:
-        logs, service_index = load_loader_state()
+    resume = "--resume" in sys.argv
+    logs, done = load_loader_state() if resume else ([], set())
+    startup = Startup(SERVICES, resume, logs, done)
 
     visible = True
     hide_cursor()
     clear_screen()
 
     try:
-        loading_done = False
-
-        while service_index < len(SERVICES):
+        startup.start()
+        shown = None
+        while True:
+            finished = startup.finished.wait(ANIMATION_INTERVAL)
             move_cursor(center_line, center_col)
             clear_line()
             cursor = f"{RED}{CURSOR_BLOCK}{RESET}" if visible else " "
             sys.stdout.write(f"{WHITE}{TEXT}{RESET} {cursor}")
             visible = not visible
-
-            service = SERVICES[service_index]
-            name = service["name"]
-
-            logs.append(f"Checking {name}..........")
-            display_logs(logs, width, height, log_col)
-            time.sleep(SERVICE_START_DELAY)
-
-            running = is_process_running(service["check"])
-
-            if running:
-                logs.append(f"{name} is already running..........")
+            logs = startup.snapshot()
+            if logs != shown:
                 display_logs(logs, width, height, log_col)
-                time.sleep(SERVICE_START_DELAY)
+                shown = logs
             else:
-                logs.append(f"{name} not running..........")
-                display_logs(logs, width, height, log_col)
-                time.sleep(SERVICE_START_DELAY)
+                sys.stdout.flush()
+            if finished:
+                break
 
-                if name == "application":
-                    if "--resume" not in sys.argv:
-                        logs.append("🔒 Awaiting user login before starting application service...")
-                        display_logs(logs, width, height, log_col)
-                        save_loader_state(logs, service_index)
-                        time.sleep(SERVICE_START_DELAY)
-                        sys.exit(12)
+        if startup.exit_code is not None:
+            save_loader_state(startup.logs, startup.done)
+            sys.exit(startup.exit_code)
 
-                logs.append(f"Starting service {name}..........")
-                display_logs(logs, width, height, log_col)
-                time.sleep(SERVICE_START_DELAY)
-
-                result = start_service(service["start"])
-                if result:
-                    logs.append(f"Service {name} started..........")
-                else:
-                    error_msg = f"❌ Failed to start {name}."
-                    logs.append(error_msg)
-                    warnings.append(error_msg)
-                display_logs(logs, width, height, log_col)
-                time.sleep(SERVICE_START_DELAY)
-
-            if name == "mariadb":
-                logs.append("Checking database connection..........")
-                display_logs(logs, width, height, log_col)
-                time.sleep(SERVICE_START_DELAY)
-                try:
-                    with get_db_connection() as conn:
-                        logs.append("✅ Database connection established..........")
-                        display_logs(logs, width, height, log_col)
-                        time.sleep(SERVICE_START_DELAY)
-
-                        if not user_exists(conn):
-                            warn_msg = "❌ No user found. Please create a user in the UI."
-                            logs.append(warn_msg)
-                            warnings.append(warn_msg)
-                            display_logs(logs, width, height, log_col)
-                            save_loader_state(logs, service_index)
-                            time.sleep(SERVICE_START_DELAY)
-                            sys.exit(11)
-                        else:
-                            logs.append("User exists. Continuing startup..........")
-                            display_logs(logs, width, height, log_col)
-                            time.sleep(SERVICE_START_DELAY)
-                except Exception as e:
-                    warn_msg = f"❌ Database connection failed: {e}"
-                    logs.append(warn_msg)
-                    warnings.append(warn_msg)
-                    display_logs(logs, width, height, log_col)
-                    time.sleep(SERVICE_START_DELAY)
-
-            service_index += 1
-            display_logs(logs, width, height, log_col)
-            time.sleep(0.3)
-
-        # All services done
-        time.sleep(LOADER_END_DELAY)
-
-        if warnings:
+        if startup.warnings:
             move_cursor(center_line + 2, 1)
             print(f"{RED}Warnings during startup:{RESET}")
-            for w in warnings:
+            for w in startup.warnings:
                 print(f"{RED}- {w}{RESET}")
+            # Leave the warnings on screen long enough to read
+            time.sleep(LOADER_END_DELAY)
 
     finally:
         termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
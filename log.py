@@ -1,136 +1,502 @@
 import os
+import sys
 import time
-from datetime import datetime
+import queue
+import collections
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-import mysql.connector
-from lib import derive_aes_key, encrypt_data
+from lib import unlock_user, encrypt_data, seal_record, get_cipher, DataKeyring, adopt_legacy_rows, load_index_key
+from lib import DEFAULT_CIPHER, ROW_FORMAT_V2
+from lib import get_db_connection, get_pool, pool_stats, is_connection_error, backoff_delay
+from schema import migrate
+from storage import get_storage
+from classifier import build_classifier
+from blind_index import index_rows
+from rollup import rollup_rows, RollupWriter
+from partitions import MaintenanceThread, MAINTENANCE_INTERVAL
+from syslog_parser import SyslogParser
+from notify import Publisher, UPDATE_FILE
+from metrics import counter, gauge, histogram, MetricsExporter, SummaryLog, SIZE_BUCKETS, install_profiler
+from keyagent import get_key as get_agent_key
+from checkpoint import FINGERPRINT_BYTES, head_fingerprint, find_rotated, newer_rotations, load_checkpoint, save_checkpoint
 from decouple import config
 import pathlib
 
 LOG_FILE = "/var/log/auth.log"
-DB_CONFIG = {
-    "host": "localhost",
-    "user": config("DB_USER", default="grooot"),
-    "password": config("DB_PASS", default="grooot"),
-    "database": config("DB_NAME", default="grooot"),
-}
-
 TABLE_NAME = config("TABLE_NAME", default="auth_log")
+BATCH_SIZE = config("BATCH_SIZE", default=500, cast=int)
+FLUSH_INTERVAL_MS = config("FLUSH_INTERVAL_MS", default=200, cast=int)
+BUFFER_SIZE = config("BUFFER_SIZE", default=10_000, cast=int)
+ENCRYPT_WORKERS = config("ENCRYPT_WORKERS", default=0, cast=int)
+ENCRYPT_POOL = config("ENCRYPT_POOL", default="thread")
+ENCRYPT_CHUNK_SIZE = config("ENCRYPT_CHUNK_SIZE", default=128, cast=int)
+READ_CHUNK_SIZE = config("READ_CHUNK_SIZE", default=1 << 20, cast=int)
+# At least one attempt, or a batch would be dropped without ever being tried
+WRITE_RETRIES = max(1, config("WRITE_RETRIES", default=10, cast=int))
+KEY_PERIOD_SECONDS = config("KEY_PERIOD_SECONDS", default=86400, cast=int)
+ROW_FORMAT = config("ROW_FORMAT", default=ROW_FORMAT_V2, cast=int)
+BLIND_INDEX = config("BLIND_INDEX", default=True, cast=bool)
+STREAM_ROWS = config("STREAM_ROWS", default=True, cast=bool)
+ROLLUPS = config("ROLLUPS", default=True, cast=bool)
 
-STATE_MAP = {
-    'Accepted password': 'success',
-    'session opened': 'success',
-    'password changed': 'success',
-    'Failed password': 'failed',
-    'authentication failure': 'failed',
-    'error': 'error',
-    'Failed to connect': 'error',
-    'Cannot bind': 'error',
-    'logout() returned an error': 'error',
-    'disconnect': 'failed',
-    'disconnected by user': 'failed',
-    'session closed': 'success',
-    'unable to open env file': 'error',
-    'starting session': 'success',
-    'connection from': 'success'
-}
-
-def parse_log_line(line):
-    try:
-        parts = line.strip().split(' ', 3)
-        ts = datetime.fromisoformat(parts[0])
-        host = parts[1]
-        service, msg = parts[2].split(':', 1)
-        msg = parts[3] if len(parts) > 3 else ""
-        return ts, host, service.strip(), msg.strip()
-    except Exception as e:
-        print(f"[ERROR] Failed to parse line: {line.strip()} - {e}")
-        return None
-
-def get_state(msg):
-    for key, state in STATE_MAP.items():
-        if key.lower() in msg.lower():
-            return state
-    return "unknown"
+TOKEN_INSERT_QUERY = get_storage().insert_ignore("log_tokens", ("token", "log_id"))
+
+LINES_READ = counter("logcrypt_lines_read_total", "Lines read from the log file")
+BYTES_READ = counter("logcrypt_bytes_read_total", "Bytes read from the log file")
+LINES_PARSED = counter("logcrypt_lines_parsed_total", "Lines parsed into log rows")
+LINES_REJECTED = counter("logcrypt_lines_rejected_total", "Lines no syslog format matched")
+ROWS_CLASSIFIED = counter("logcrypt_rows_total", "Rows committed, by classified state", labels=("state",))
+ROWS_FAILED = counter("logcrypt_rows_failed_total", "Rows dropped because their batch could not be inserted")
+DB_RETRIES = counter("logcrypt_db_retries_total", "Batch inserts retried after a lost connection")
+ENCRYPT_SECONDS = histogram("logcrypt_encrypt_seconds", "Time spent encrypting and indexing one batch, summed over workers")
+FLUSH_SECONDS = histogram("logcrypt_db_flush_seconds", "Time to insert and commit one batch")
+BATCH_ROWS = histogram("logcrypt_batch_rows", "Rows per committed batch", SIZE_BUCKETS)
+
+get_state = build_classifier()
+
+def load_user_key(conn):
+    # A running key agent already did the KDF at login; the env password is the fallback
+    unlocked = get_agent_key()
+    if unlocked:
+        return unlocked[1]
+    user_password = config("USER_PASSWORD", default=None)
+    if not user_password:
+        raise Exception("Key agent not unlocked and USER_PASSWORD env var missing")
+    unlocked = unlock_user(user_password, conn=conn)
+    if not unlocked:
+        raise Exception("USER_PASSWORD does not match the stored key check")
+    return unlocked[1]
+
+def encrypt_rows(batch, data_key, row_format=ROW_FORMAT):
+    rows = []
+    if row_format == ROW_FORMAT_V2:
+        # One sealed binary record per row; the base64 text columns stay empty
+        for ts, host, service, msg in batch:
+            rows.append((ts, None, None, None, seal_record((host, service, msg), data_key), get_state(msg)))
+        return rows
+    for ts, host, service, msg in batch:
+        rows.append((
+            ts,
+            encrypt_data(host, data_key),
+            encrypt_data(service, data_key),
+            encrypt_data(msg, data_key),
+            None,
+            get_state(msg),
+        ))
+    return rows
+
+def with_key_id(rows, key_id):
+    return [row + (key_id,) for row in rows]
+
+def prepare_rows(batch, data_key, index_key=None):
+    # Blind-index tokens and rollups need the plaintext, so they are computed next to the encryption
+    rows = encrypt_rows(batch, data_key)
+    if not index_key:
+        return rows, None, None
+    tokens = index_rows(batch, index_key) if BLIND_INDEX else None
+    rollup = rollup_rows(batch, [row[5] for row in rows], index_key) if ROLLUPS else None
+    return rows, tokens, rollup
+
+def timed_prepare_rows(batch, data_key, index_key=None):
+    # Timed where it runs, so pool workers report their own encryption time
+    start = time.perf_counter()
+    prepared = prepare_rows(batch, data_key, index_key)
+    return prepared, time.perf_counter() - start
+
+def insert_rows(cursor, rows, tokens, key_id):
+    """Insert a batch and its search tokens; returns the id of each row."""
+    ids = get_storage().insert_batch(cursor, with_key_id(rows, key_id))
+    if tokens:
+        cursor.executemany(TOKEN_INSERT_QUERY, [
+            (token, id_) for id_, row_tokens in zip(ids, tokens) for token in row_tokens
+        ])
+    return ids
+
+class EncryptionPool:
+    def __init__(self, workers=ENCRYPT_WORKERS, kind=ENCRYPT_POOL, chunk_size=ENCRYPT_CHUNK_SIZE):
+        self.workers = workers
+        self.chunk_size = max(1, chunk_size)
+        if kind == "process":
+            # Forked workers would inherit the writer's threads, locks and open DB connections
+            self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver"))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encrypt")
+
+    def submit(self, batch, data_key, index_key=None):
+        return [
+            self._executor.submit(timed_prepare_rows, batch[i:i + self.chunk_size], data_key, index_key)
+            for i in range(0, len(batch), self.chunk_size)
+        ]
+
+    @staticmethod
+    def result(futures):
+        # Chunks are collected in submission order, so rows keep their line order
+        rows = []
+        tokens = []
+        rollup = None
+        seconds = 0.0
+        for future in futures:
+            (chunk_rows, chunk_tokens, chunk_rollup), chunk_seconds = future.result()
+            seconds += chunk_seconds
+            rows.extend(chunk_rows)
+            if chunk_tokens is not None:
+                tokens.extend(chunk_tokens)
+            if chunk_rollup is not None:
+                if rollup is None:
+                    rollup = chunk_rollup
+                else:
+                    rollup[0].update(chunk_rollup[0])
+                    rollup[1].update(chunk_rollup[1])
+        return rows, tokens or None, rollup, seconds
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+class BatchWriter:
+    def __init__(self, user_key, batch_size=BATCH_SIZE, flush_interval_ms=FLUSH_INTERVAL_MS,
+                 buffer_size=BUFFER_SIZE, workers=ENCRYPT_WORKERS, on_commit=None, index_key=None,
+                 publisher=None):
+        self.keyring = DataKeyring(user_key, KEY_PERIOD_SECONDS)
+        self.index_key = index_key
+        self.rollups = RollupWriter(index_key) if index_key and ROLLUPS else None
+        self.publisher = publisher
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000
+        self.on_commit = on_commit
+        # Bounded so a burst blocks the reader instead of growing without limit
+        self._buffer = queue.Queue(maxsize=buffer_size)
+        self._stop = object()
+        self.pool = None
+        self._pending = None
+        self._write_thread = None
+        self.saved = SummaryLog("SAVED")
+        if workers > 0:
+            self.pool = EncryptionPool(workers)
+            # Batches being encrypted while the previous one is written
+            self._pending = queue.Queue(maxsize=max(2, workers))
+            self._write_thread = threading.Thread(target=self._write_loop, name="batch-db-writer", daemon=True)
+            self._write_thread.start()
+        self._thread = threading.Thread(target=self._run, name="batch-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, parsed, position=None):
+        self._buffer.put((parsed, position))
+
+    def pending(self):
+        """Lines put but not yet taken into a batch."""
+        return self._buffer.qsize()
+
+    def _run(self):
+        while True:
+            item = self._buffer.get()
+            if item is self._stop:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._buffer.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._stop:
+                    stopping = True
+                    break
+                batch.append(item)
+            self.flush(batch)
+            if stopping:
+                return
+
+    def flush(self, batch):
+        parsed = [item[0] for item in batch]
+        position = batch[-1][1]
+        data_key = self.keyring.current()
+        if self.pool:
+            self._pending.put((self.pool.submit(parsed, data_key.key, self.index_key), data_key, position))
+        else:
+            (rows, tokens, rollup), seconds = timed_prepare_rows(parsed, data_key.key, self.index_key)
+            ENCRYPT_SECONDS.observe(seconds)
+            self.write(rows, tokens, data_key, position, rollup)
+
+    def _write_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is self._stop:
+                return
+            futures, data_key, position = item
+            try:
+                rows, tokens, rollup, seconds = self.pool.result(futures)
+            except Exception as e:
+                print(f"[ERROR] Failed to encrypt batch - {e}")
+                continue
+            ENCRYPT_SECONDS.observe(seconds)
+            self.write(rows, tokens, data_key, position, rollup)
+
+    def write(self, rows, tokens, data_key, position=None, rollup=None):
+        start = time.perf_counter()
+        for attempt in range(WRITE_RETRIES):
+            conn = None
+            try:
+                conn = get_db_connection()
+                # The key row is only written once, on the first batch that uses it
+                key_id = self.keyring.persist(conn, data_key)
+                cursor = conn.cursor()
+                ids = insert_rows(cursor, rows, tokens, key_id)
+                labelled = self.rollups.write(cursor, *rollup) if rollup and self.rollups else []
+                conn.commit()
+                cursor.close()
+                if labelled:
+                    self.rollups.stored(labelled)
+                break
+            except Exception as e:
+                if not is_connection_error(e) or attempt == WRITE_RETRIES - 1:
+                    print(f"[ERROR] Failed to insert batch of {len(rows)} rows - {e}")
+                    ROWS_FAILED.inc(len(rows))
+                    return
+                if conn is not None:
+                    conn.invalidate()
+                # Keep the batch and retry on a fresh connection, e.g. across a MariaDB restart
+                print(f"[ERROR] Lost DB connection ({e}), retrying batch of {len(rows)} rows")
+                DB_RETRIES.inc()
+                time.sleep(backoff_delay(attempt))
+            finally:
+                if conn is not None:
+                    conn.close()
+        FLUSH_SECONDS.observe(time.perf_counter() - start)
+        BATCH_ROWS.observe(len(rows))
+        for state, count in collections.Counter(row[5] for row in rows).items():
+            ROWS_CLASSIFIED.inc(count, state=state)
+        # Push the new id to connected viewers; the file is for viewers without the socket
+        if self.publisher:
+            self.publisher.publish(ids[-1])
+            # Followers get the encrypted rows themselves and skip the SELECT
+            if STREAM_ROWS and self.publisher.followers:
+                self.publisher.publish_rows(ids, get_storage().id_step, key_id, data_key.wrapped, rows)
+        pathlib.Path(UPDATE_FILE).touch()
+        self.saved.add(len(rows))
+        if position and self.on_commit:
+            try:
+                self.on_commit(position)
+            except Exception as e:
+                print(f"[ERROR] Failed to save checkpoint - {e}")
+
+    def close(self):
+        if self._thread.is_alive():
+            self._buffer.put(self._stop)
+            self._thread.join()
+        if self._write_thread and self._write_thread.is_alive():
+            self._pending.put(self._stop)
+            self._write_thread.join()
+        if self.pool:
+            self.pool.shutdown()
+        self.saved.flush()
 
 class LogHandler(FileSystemEventHandler):
     def __init__(self, filepath):
         self.filepath = filepath
-        self._file = open(filepath, 'r')
-        self._file.seek(0, os.SEEK_END)
-        self.conn = None
-        self.cursor = None
+        self._file = None
+        self._path = None
+        self._inode = None
+        self._offset = 0
+        self._partial = b""
+        self._head = (0, None)
+        self._lock = threading.Lock()
+        self.parser = SyslogParser()
         self.user_key = None
+        self.index_key = None
+        self.writer = None
+        self.publisher = None
+        self.maintenance = None
+        self.exporter = None
+        # (inode, offset) of the last line whose row is committed
+        self._committed = (None, 0)
         self._setup_db_and_key()
+        try:
+            self.publisher = Publisher()
+        except OSError as e:
+            print(f"[ERROR] Notification socket unavailable, viewers will poll {UPDATE_FILE}: {e}")
+        self.writer = BatchWriter(self.user_key, on_commit=self._save_checkpoint, index_key=self.index_key,
+                                  publisher=self.publisher)
+        if MAINTENANCE_INTERVAL > 0:
+            self.maintenance = MaintenanceThread(user_key=self.user_key)
+            self.maintenance.start()
+        self._resume()
+        # Published once a file is open, so the offset gauges never read a missing path
+        gauge("logcrypt_read_offset_bytes", "Offset read up to in the file being tailed", lambda: self._offset)
+        gauge("logcrypt_committed_offset_bytes", "Offset of the last committed line", lambda: self._committed[1])
+        gauge("logcrypt_ingest_lag_bytes", "Bytes of the file being tailed that are not committed yet", self._lag)
+        gauge("logcrypt_buffered_lines", "Parsed lines waiting to be batched", self.writer.pending)
+        self.exporter = MetricsExporter()
+        if self.exporter.enabled:
+            try:
+                self.exporter.start()
+            except OSError as e:
+                print(f"[ERROR] Metrics endpoint unavailable: {e}")
+
+    def _lag(self):
+        # Counts lines not read yet as well as those still in the writer
+        size = os.path.getsize(self._path)
+        inode, offset = self._committed
+        return size - offset if inode == self._inode else size
 
     def _setup_db_and_key(self):
         try:
-            self.conn = mysql.connector.connect(**DB_CONFIG)
-            self.cursor = self.conn.cursor()
-            print("[INFO] DB connection established.")
-
-            user_password = config("USER_PASSWORD", default=None)
-            if not user_password:
-                raise Exception("USER_PASSWORD env var missing")
-
-            self.cursor.execute("SELECT kdf_salt FROM users LIMIT 1")
-            row = self.cursor.fetchone()
-            if not row:
-                raise Exception("No user salt found")
-            
-            kdf_salt = row[0]
-            self.user_key = derive_aes_key(user_password, kdf_salt)
+            get_cipher(DEFAULT_CIPHER)
+            with get_db_connection() as conn:
+                print("[INFO] DB connection established.")
+                migrate(conn)
+                self.user_key = load_user_key(conn)
+                adopted = adopt_legacy_rows(conn, TABLE_NAME, self.user_key)
+                if BLIND_INDEX or ROLLUPS:
+                    self.index_key = load_index_key(conn, self.user_key)
+            if adopted:
+                print(f"[INFO] Moved {adopted} legacy rows onto envelope encryption.")
         except Exception as e:
             print(f"[ERROR] Failed to set up DB/key: {e}")
             self.cleanup()
             exit(1)
 
-    def save_log(self, parsed):
-        try:
-            ts, host, service, msg = parsed
-            state = get_state(msg)
-            enc_host = encrypt_data(host, self.user_key)
-            enc_service = encrypt_data(service, self.user_key)
-            enc_msg = encrypt_data(msg, self.user_key)
-            query = (
-                f"INSERT INTO {TABLE_NAME} (timestamp, hostname, service, message, state) "
-                "VALUES (%s, %s, %s, %s, %s)"
-            )
-            self.cursor.execute(query, (ts, enc_host, enc_service, enc_msg, state))
-            self.conn.commit()
-            # Touch the update file
-            pathlib.Path(".log_update").touch()
-            print(f"[SAVED] {parsed} with state: {state}")
-        except Exception as e:
-            print(f"[ERROR] Failed to insert log: {parsed} - {e}")
+    def _open(self, path, offset):
+        if self._file:
+            self._file.close()
+        self._file = open(path, 'rb')
+        st = os.fstat(self._file.fileno())
+        if offset > st.st_size:
+            offset = 0
+        self._file.seek(offset)
+        self._path = path
+        self._inode = st.st_ino
+        self._offset = offset
+        self._partial = b""
+        self._head = head_fingerprint(self._file.fileno())
+        # Each file gets its own format detection
+        self.parser = SyslogParser()
 
-    def process_new_lines(self):
+    def _resume(self):
+        checkpoint = load_checkpoint()
+        if not checkpoint:
+            self._open(self.filepath, os.path.getsize(self.filepath))
+            print("[INFO] No checkpoint found, tailing from end of file.")
+            return
+        rotated = find_rotated(self.filepath, checkpoint)
+        with self._lock:
+            if rotated and rotated != self.filepath:
+                print(f"[INFO] Draining rotated file {rotated} from offset {checkpoint['offset']}.")
+                self._open(rotated, checkpoint["offset"])
+                self._drain()
+                # Several rotations while stopped: the files in between are read whole, oldest first
+                for newer in newer_rotations(self.filepath, rotated):
+                    print(f"[INFO] Draining rotated file {newer}.")
+                    self._open(newer, 0)
+                    self._drain()
+                self._open(self.filepath, 0)
+            elif rotated:
+                self._open(self.filepath, checkpoint["offset"])
+            else:
+                print("[INFO] Checkpointed file not found, reading current file from the start.")
+                self._open(self.filepath, 0)
+            print(f"[INFO] Resuming {self._path} at offset {self._offset}.")
+        self.process_new_lines()
+
+    def _drain(self):
+        read = 0
+        parsed_lines = 0
+        rejected = self.parser.rejected
         while True:
-            line = self._file.readline()
-            if not line:
+            chunk = self._file.read(READ_CHUNK_SIZE)
+            if not chunk:
                 break
-            parsed = parse_log_line(line)
-            if parsed:
-                self.save_log(parsed)
+            read += len(chunk)
+            lines = (self._partial + chunk).split(b"\n")
+            # Keep an unterminated last line until the rest of it is written
+            self._partial = lines.pop()
+            for raw in lines:
+                self._offset += len(raw) + 1
+                parsed = self.parser.parse(raw.decode("utf-8", "replace"))
+                if parsed:
+                    parsed_lines += 1
+                    self.writer.put(parsed, (self._path, self._inode, self._offset, self._head))
+            LINES_READ.inc(len(lines))
+            BYTES_READ.inc(len(chunk))
+        LINES_PARSED.inc(parsed_lines)
+        LINES_REJECTED.inc(self.parser.rejected - rejected)
+        if read and self._head[0] < FINGERPRINT_BYTES:
+            self._head = head_fingerprint(self._file.fileno())
+        return read
+
+    def _save_checkpoint(self, position):
+        path, inode, offset, (head_len, head_sha) = position
+        self._committed = (inode, offset)
+        save_checkpoint({
+            "path": path,
+            "inode": inode,
+            "offset": offset,
+            "head_len": head_len,
+            "head_sha": head_sha,
+        })
+
+    def process_new_lines(self):
+        with self._lock:
+            read = self._drain()
+            try:
+                st = os.stat(self.filepath)
+            except FileNotFoundError:
+                # Renamed by logrotate, the new file is not there yet
+                return
+            if st.st_ino != self._inode:
+                print(f"[INFO] {self.filepath} was rotated, switching to the new file.")
+                self._open(self.filepath, 0)
+                self._drain()
+            elif st.st_size < self._offset or (
+                not read and head_fingerprint(self._file.fileno(), self._head[0]) != self._head
+            ):
+                print(f"[INFO] {self.filepath} was truncated, reading from the start.")
+                self._open(self.filepath, 0)
+                self._drain()
 
     def on_modified(self, event):
         if os.path.abspath(event.src_path) == os.path.abspath(self.filepath):
             self.process_new_lines()
 
+    def on_created(self, event):
+        self.on_modified(event)
+
+    def on_moved(self, event):
+        if os.path.abspath(event.src_path) == os.path.abspath(self.filepath):
+            self.process_new_lines()
+
     def cleanup(self):
         try:
+            if self.maintenance:
+                self.maintenance.stop()
+            if self.writer:
+                self.writer.close()
+            if self.exporter:
+                self.exporter.stop()
+            if self.publisher:
+                self.publisher.close()
+            if self.parser.rejected:
+                print(f"[INFO] {self.parser.rejected} unparseable lines skipped, last: {self.parser.last_rejected!r}")
             if self._file:
                 self._file.close()
-            if self.cursor:
-                self.cursor.close()
-            if self.conn:
-                self.conn.close()
+            print(f"[INFO] DB pool stats: {pool_stats()}")
+            get_pool().close_all()
             print("[INFO] Resources cleaned up.")
         except Exception:
             pass
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "import":
+        from importer import main as import_main
+        sys.exit(import_main(sys.argv[2:]))
+
+    install_profiler()
     abs_log_path = os.path.abspath(LOG_FILE)
     handler = LogHandler(abs_log_path)
     observer = Observer()
@@ -1,7 +1,8 @@
 import os
 import sys
 import subprocess
-from lib import get_db_connection, create_user, hash_password
+import keyagent
+from lib import get_db_connection, create_user, unlock_user
 from textual.app import App, ComposeResult
 from textual.widgets import Input, Static, Button, OptionList
 from textual.containers import Vertical
@@ -154,8 +155,10 @@ class SecureApp(App):
                 if await self.verify_password(username, password):
                     print("✅ Login successful. Starting application service...")
                     await self.action_quit()
-                    os.environ["USER_PASSWORD"] = password
-                    code = run_loader(resume=True, password=password)
+                    # With the agent holding the key, the password never reaches the environment
+                    if not self.agent_unlocked:
+                        os.environ["USER_PASSWORD"] = password
+                    code = run_loader(resume=True, password=None if self.agent_unlocked else password)
                     if code == 0:
                         print("✅ Application started. Opening log viewer...")
                         os.execvp("uv", ["uv", "run", "eye_view.py"])
@@ -183,15 +186,16 @@ class SecureApp(App):
                 sys.exit(1)
 
     async def verify_password(self, username: str, password: str) -> bool:
+        self.agent_unlocked = False
         try:
-            with get_db_connection() as conn:
-                with conn.cursor() as cursor:
-                    cursor.execute("SELECT password_hash FROM users WHERE username = %s", (username,))
-                    row = cursor.fetchone()
-            if not row:
-                return False
-            stored_hash = row[0]
-            return stored_hash == hash_password(password)
+            if keyagent.ensure_agent():
+                try:
+                    unlocked = keyagent.unlock(password, username)
+                    self.agent_unlocked = unlocked is not None
+                    return self.agent_unlocked
+                except OSError as e:
+                    print(f"[ERROR] Key agent unavailable, verifying locally: {e}")
+            return unlock_user(password, username) is not None
         except Exception as e:
             print(f"[ERROR] Password verification failed: {e}")
             return False
@@ -0,0 +1,351 @@
+import os
+import sys
+import time
+import signal
+import bisect
+import threading
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from decouple import config
+
+METRICS_FILE = config("METRICS_FILE", default="")
+METRICS_PORT = config("METRICS_PORT", default=0, cast=int)
+METRICS_HOST = config("METRICS_HOST", default="127.0.0.1")
+METRICS_INTERVAL = config("METRICS_INTERVAL", default=15.0, cast=float)
+LOG_LEVEL = config("LOG_LEVEL", default="info")
+LOG_SUMMARY_SECONDS = config("LOG_SUMMARY_SECONDS", default=60.0, cast=float)
+PROFILE_SIGNAL = config("PROFILE_SIGNAL", default="SIGUSR2")
+PROFILE_SECONDS = config("PROFILE_SECONDS", default=10.0, cast=float)
+PROFILE_INTERVAL_MS = config("PROFILE_INTERVAL_MS", default=5.0, cast=float)
+PROFILE_DIR = config("PROFILE_DIR", default=".")
+PROFILE_TOP = 10
+# Leaf frames of threads that are blocked rather than working, left out of the printed summary
+IDLE_FRAMES = {
+    "threading.py:wait", "queue.py:get", "selectors.py:select", "socket.py:accept",
+    "socket.py:readinto", "inotify_c.py:do_poll",
+}
+
+LEVELS = {"debug": 10, "info": 20, "error": 40}
+
+# Seconds, from a fast local commit up to a stalled database
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = collections.defaultdict(int)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labels:
+            values = [((), 0)]
+        lines += [f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in values]
+        return lines
+
+class Gauge:
+    """A value that is set, or read from `func` whenever metrics are rendered."""
+
+    def __init__(self, name, help, func=None):
+        self.name = name
+        self.help = help
+        self.func = func
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def value(self):
+        if self.func is None:
+            return self._value
+        try:
+            return self.func()
+        except Exception:
+            return float("nan")
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {_number(self.value())}"]
+
+class Histogram:
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    def render(self):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{_number(bound)}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_number(total)}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        # Modules are imported once per process, but a re-registration keeps the first instance
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def counter(name, help, labels=()):
+    return REGISTRY.register(Counter(name, help, labels))
+
+def gauge(name, help, func=None):
+    metric = REGISTRY.register(Gauge(name, help))
+    if func is not None:
+        metric.func = func
+    return metric
+
+def histogram(name, help, buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, buckets))
+
+def write_metrics_file(path, registry=REGISTRY):
+    # The node_exporter textfile collector may read at any time, so replace the file atomically
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(registry.render())
+    os.replace(tmp, path)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsExporter:
+    """Publishes the registry as a Prometheus textfile and/or on a local HTTP port.
+
+    Nothing is started when neither METRICS_FILE nor METRICS_PORT is set.
+    """
+
+    def __init__(self, path=METRICS_FILE, port=METRICS_PORT, host=METRICS_HOST, interval=METRICS_INTERVAL,
+                 registry=REGISTRY):
+        self.path = path
+        self.port = port
+        self.host = host
+        self.interval = interval
+        self.registry = registry
+        self._server = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return bool(self.path or self.port)
+
+    def start(self):
+        if self.port:
+            handler = type("MetricsHandler", (_MetricsHandler,), {"registry": self.registry})
+            self._server = ThreadingHTTPServer((self.host, self.port), handler)
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+            print(f"[INFO] Metrics served on http://{self.host}:{self._server.server_port}/metrics")
+        if self.path:
+            self._thread = threading.Thread(target=self._write_loop, name="metrics-file", daemon=True)
+            self._thread.start()
+
+    def _write_loop(self):
+        while True:
+            try:
+                write_metrics_file(self.path, self.registry)
+            except OSError as e:
+                print(f"[ERROR] Failed to write metrics to {self.path}: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            # Leave the final counts behind for the last scrape
+            try:
+                write_metrics_file(self.path, self.registry)
+            except OSError:
+                pass
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+def log_enabled(level):
+    return LEVELS[level] >= LEVELS.get(LOG_LEVEL.lower(), LEVELS["info"])
+
+class SummaryLog:
+    """One line per LOG_SUMMARY_SECONDS for an event that happens on every batch.
+
+    Printing each event costs more than it tells at high rates; with
+    LOG_LEVEL=debug every event is still printed as it happens.
+    """
+
+    def __init__(self, tag, unit="rows", interval=LOG_SUMMARY_SECONDS):
+        self.tag = tag
+        self.unit = unit
+        self.interval = interval
+        self.debug = log_enabled("debug")
+        self.enabled = log_enabled("info")
+        self._lock = threading.Lock()
+        self._reset(time.monotonic())
+
+    def _reset(self, now):
+        self._since = now
+        self._events = 0
+        self._amount = 0
+
+    def add(self, amount):
+        if not self.enabled:
+            return
+        if self.debug:
+            print(f"[{self.tag}] {amount} {self.unit}")
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._events += 1
+            self._amount += amount
+            if now - self._since < self.interval:
+                return
+            line = self._line(now)
+        print(line)
+
+    def _line(self, now):
+        line = f"[{self.tag}] {self._amount:,} {self.unit} in {self._events:,} batches over {now - self._since:.0f}s"
+        self._reset(now)
+        return line
+
+    def flush(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            line = self._line(time.monotonic()) if self._events else None
+        if line:
+            print(line)
+
+class SamplingProfiler:
+    """Samples the stack of every thread for a while and writes them in folded form.
+
+    The output has one `thread;outer;...;inner count` line per distinct stack,
+    the input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, seconds=PROFILE_SECONDS, interval_ms=PROFILE_INTERVAL_MS, directory=PROFILE_DIR):
+        self.seconds = seconds
+        self.interval = interval_ms / 1000
+        self.directory = directory
+        self._running = threading.Lock()
+
+    def start(self):
+        if not self._running.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._run, name="profiler", daemon=True).start()
+        return True
+
+    def _run(self):
+        try:
+            print(f"[INFO] Profiling for {self.seconds:.0f}s")
+            stacks = self.sample()
+            path = os.path.join(self.directory, f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+            with open(path, "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            leaves = collections.Counter()
+            for stack, count in stacks.items():
+                leaf = stack.rsplit(";", 1)[-1]
+                if leaf not in IDLE_FRAMES:
+                    leaves[leaf] += count
+            busy = sum(leaves.values()) or 1
+            top = ", ".join(f"{name} {count / busy:.0%}" for name, count in leaves.most_common(PROFILE_TOP))
+            print(f"[INFO] Profile of {sum(stacks.values())} samples written to {path}; busiest: {top}")
+        except Exception as e:
+            print(f"[ERROR] Profiling failed: {e}")
+        finally:
+            self._running.release()
+
+    def sample(self):
+        me = threading.get_ident()
+        stacks = collections.Counter()
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(frames))] += 1
+            time.sleep(self.interval)
+        return stacks
+
+def install_profiler(signal_name=PROFILE_SIGNAL, profiler=None):
+    """Start a profiling run whenever the process gets `signal_name`; must be called from the main thread."""
+    if not signal_name:
+        return None
+    profiler = profiler or SamplingProfiler()
+    signal.signal(getattr(signal, signal_name), lambda signum, frame: profiler.start())
+    return profiler
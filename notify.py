@@ -0,0 +1,180 @@
+import os
+import json
+import queue
+import base64
+import socket
+import asyncio
+import threading
+from decouple import config
+from lib import runtime_path, make_socket_dir
+
+NOTIFY_SOCKET = config("NOTIFY_SOCKET", default=runtime_path("notify.sock"))
+NOTIFY_QUEUE = config("NOTIFY_QUEUE", default=64, cast=int)
+UPDATE_FILE = ".log_update"
+HELLO_TIMEOUT = 1.0
+LINE_LIMIT = 64 * 1024 * 1024
+
+# Topics a subscriber picks with its first line: new row ids, or whole encrypted batches
+IDS = "ids"
+ROWS = "rows"
+
+class Subscriber:
+    """One connected viewer, fed from a bounded queue by its own sender thread."""
+
+    def __init__(self, sock, topic, maxsize=NOTIFY_QUEUE):
+        self.sock = sock
+        self.topic = topic
+        self.closed = False
+        self._queue = queue.Queue(maxsize=maxsize)
+        threading.Thread(target=self._send_loop, name=f"notify-{topic}", daemon=True).start()
+
+    def offer(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            # The viewer fell behind; it catches up from the DB after reconnecting
+            self.close()
+
+    def _send_loop(self):
+        while not self.closed:
+            message = self._queue.get()
+            if message is None:
+                break
+            try:
+                self.sock.sendall(message)
+            except OSError:
+                break
+        self.closed = True
+        self.sock.close()
+
+    def close(self):
+        self.closed = True
+        try:
+            # Unblocks a sendall stuck on a full socket buffer
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+class Publisher:
+    """Unix socket that pushes committed rows to every connected viewer.
+
+    Messages are one line each: the newest row id on the `ids` topic, or a
+    JSON batch of still-encrypted rows on the `rows` topic. Subscribers that
+    stop reading are dropped rather than allowed to stall the writer.
+    """
+
+    def __init__(self, path=NOTIFY_SOCKET):
+        self.path = path
+        self._clients = []
+        self._lock = threading.Lock()
+        make_socket_dir(path)
+        if os.path.exists(path):
+            os.unlink(path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Subscribers get wrapped keys and ciphertext, so only this user may connect, as with the key agent
+        old_umask = os.umask(0o177)
+        try:
+            self._server.bind(path)
+        finally:
+            os.umask(old_umask)
+        self._server.listen()
+        self._closed = False
+        self._thread = threading.Thread(target=self._accept_loop, name="notify-accept", daemon=True)
+        self._thread.start()
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            topic = IDS
+            try:
+                client.settimeout(HELLO_TIMEOUT)
+                if client.recv(16).strip() == ROWS.encode():
+                    topic = ROWS
+                client.settimeout(None)
+            except OSError:
+                client.close()
+                continue
+            with self._lock:
+                self._clients.append(Subscriber(client, topic))
+
+    def _send(self, topic, message):
+        with self._lock:
+            self._clients = [client for client in self._clients if not client.closed]
+            for client in self._clients:
+                if client.topic == topic:
+                    client.offer(message)
+
+    def publish(self, last_id):
+        self._send(IDS, f"{last_id}\n".encode())
+
+    @property
+    def followers(self):
+        with self._lock:
+            return any(client.topic == ROWS and not client.closed for client in self._clients)
+
+    def publish_rows(self, ids, step, key_id, wrapped_key, rows):
+        # Rows are sent as stored: the data key travels wrapped, exactly as in data_keys
+        message = {
+            "ids": ids,
+            # Ids a batch would take with nothing else inserting, so viewers can tell when they missed rows
+            "step": step,
+            "key_id": key_id,
+            "wrapped_key": wrapped_key,
+            "rows": [
+                (ts.strftime("%Y-%m-%d %H:%M:%S"), host, service, msg,
+                 base64.b64encode(payload).decode() if payload else None, state)
+                for ts, host, service, msg, payload, state in rows
+            ],
+        }
+        self._send(ROWS, (json.dumps(message) + "\n").encode())
+
+    @property
+    def subscribers(self):
+        with self._lock:
+            return sum(not client.closed for client in self._clients)
+
+    def close(self):
+        self._closed = True
+        self._server.close()
+        with self._lock:
+            for client in self._clients:
+                client.close()
+            self._clients = []
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+def decode_rows(message):
+    """Turn a `rows` message back into (id, ts, host, service, msg, payload, state, key_id) tuples."""
+    key_id = message["key_id"]
+    return [
+        (id_, ts, host, service, msg, base64.b64decode(payload) if payload else None, state, key_id)
+        for id_, (ts, host, service, msg, payload, state) in zip(message["ids"], message["rows"])
+    ]
+
+async def subscribe(on_update, topic=IDS, path=NOTIFY_SOCKET):
+    """Call `on_update` for each message until the publisher goes away.
+
+    Raises OSError right away when nobody is publishing, so the caller can fall
+    back to watching UPDATE_FILE. `ids` messages arrive as ints, `rows`
+    messages as dicts.
+    """
+    reader, writer = await asyncio.open_unix_connection(path, limit=LINE_LIMIT)
+    try:
+        writer.write(f"{topic}\n".encode())
+        await writer.drain()
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            await on_update(json.loads(line) if topic == ROWS else int(line))
+    finally:
+        writer.close()
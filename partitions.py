@@ -0,0 +1,264 @@
+import sys
+import threading
+from datetime import datetime, timedelta
+from decouple import config
+from lib import get_db_connection
+from storage import get_storage
+from archive import ARCHIVE_DIR, ARCHIVE_AFTER_DAYS, SWEEP_INSERT, ArchivedIds, archive_rows, expire_segments
+
+TABLE_NAME = config("TABLE_NAME", default="auth_log")
+PARTITION_PERIOD = config("PARTITION_PERIOD", default="day")
+PARTITIONS_AHEAD = config("PARTITIONS_AHEAD", default=3, cast=int)
+RETENTION_DAYS = config("RETENTION_DAYS", default=0, cast=int)
+MAINTENANCE_INTERVAL = config("MAINTENANCE_INTERVAL", default=3600, cast=int)
+EXPIRE_CHUNK = 5000
+PERIODS = {"day": timedelta(days=1), "week": timedelta(weeks=1)}
+CATCH_ALL = "pmax"
+
+def period_start(ts, period=PARTITION_PERIOD):
+    day = ts.replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+    if period == "week":
+        # Weeks start on Monday, like ISO week numbers
+        return day - timedelta(days=day.weekday())
+    return day
+
+def partition_name(start):
+    return f"p{start:%Y%m%d}"
+
+def partition_clause(start, period=PARTITION_PERIOD):
+    end = start + PERIODS[period]
+    return f"PARTITION {partition_name(start)} VALUES LESS THAN ('{end:%Y-%m-%d %H:%M:%S}')"
+
+def retention_cutoff(now=None, days=RETENTION_DAYS):
+    """Rows older than this are expired; None keeps everything."""
+    if days <= 0:
+        return None
+    return (now or datetime.now()) - timedelta(days=days)
+
+def list_partitions(cursor, table=TABLE_NAME):
+    """(name, upper bound) of each partition in order; the bound is None for MAXVALUE.
+
+    Returns an empty list when the table is not partitioned.
+    """
+    cursor.execute(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY PARTITION_ORDINAL_POSITION",
+        (table,)
+    )
+    partitions = []
+    for name, description in cursor.fetchall():
+        if name is None:
+            return []
+        bound = None if description == "MAXVALUE" else datetime.fromisoformat(description.strip("'"))
+        partitions.append((name, bound))
+    return partitions
+
+def convert_table(conn, now=None, table=TABLE_NAME, period=PARTITION_PERIOD, ahead=PARTITIONS_AHEAD):
+    """Partition an existing table by time. This rebuilds the table, so run it while ingest is quiet."""
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT MIN(timestamp) FROM `{table}`")
+    oldest = cursor.fetchone()[0]
+    current = period_start(now or datetime.now(), period)
+    start = period_start(oldest, period) if oldest else current
+    clauses = []
+    while start <= current + PERIODS[period] * ahead:
+        clauses.append(partition_clause(start, period))
+        start += PERIODS[period]
+    clauses.append(f"PARTITION {CATCH_ALL} VALUES LESS THAN (MAXVALUE)")
+    # The partitioning column must be NOT NULL; a made-up stamp would let retention drop those rows
+    cursor.execute(f"SELECT COUNT(*) FROM `{table}` WHERE timestamp IS NULL")
+    missing = cursor.fetchone()[0]
+    if missing:
+        cursor.close()
+        raise ValueError(f"{missing} rows in {table} have no timestamp; set one before partitioning the table")
+    # Every unique key must contain the partitioning column, so the primary key gains timestamp
+    cursor.execute(
+        f"ALTER TABLE `{table}` MODIFY timestamp DATETIME NOT NULL, "
+        f"DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp), "
+        f"PARTITION BY RANGE COLUMNS(timestamp) ({', '.join(clauses)})"
+    )
+    cursor.close()
+    return len(clauses)
+
+def add_partitions(conn, partitions, now=None, table=TABLE_NAME, period=PARTITION_PERIOD, ahead=PARTITIONS_AHEAD):
+    """Split the catch-all partition so the next `ahead` periods each have their own."""
+    current = period_start(now or datetime.now(), period)
+    # A fresh table only has the catch-all; older rows then land in the first period created
+    start = max((bound for _, bound in partitions if bound), default=current)
+    target = current + PERIODS[period] * (ahead + 1)
+    if start >= target:
+        return 0
+    clauses = []
+    while start < target:
+        clauses.append(partition_clause(start, period))
+        start += PERIODS[period]
+    cursor = conn.cursor()
+    # The catch-all only holds rows stamped in the future, so this is close to free
+    cursor.execute(
+        f"ALTER TABLE `{table}` REORGANIZE PARTITION {CATCH_ALL} INTO "
+        f"({', '.join(clauses)}, PARTITION {CATCH_ALL} VALUES LESS THAN (MAXVALUE))"
+    )
+    cursor.close()
+    return len(clauses)
+
+def drop_partitions(conn, partitions, cutoff, table=TABLE_NAME):
+    """Drop partitions whose rows are all older than `cutoff`; returns how many."""
+    expired = [name for name, bound in partitions if bound and bound <= cutoff]
+    if not expired:
+        return 0
+    cursor = conn.cursor()
+    for name in expired:
+        # Search tokens of the dropped rows are left to sweep_tokens; search only returns rows that exist
+        cursor.execute(f"SELECT MIN(id), MAX(id) FROM `{table}` PARTITION ({name})")
+        first_id, last_id = cursor.fetchone()
+        if first_id is not None:
+            cursor.execute(SWEEP_INSERT, (first_id, last_id))
+            conn.commit()
+    cursor.execute(f"ALTER TABLE `{table}` DROP PARTITION {', '.join(expired)}")
+    cursor.close()
+    return len(expired)
+
+def delete_expired(conn, cutoff, table=TABLE_NAME):
+    """Retention without partitions: delete in small transactions so the writer is never held up for long."""
+    cursor = conn.cursor()
+    deleted = 0
+    while True:
+        cursor.execute(f"SELECT id FROM {table} WHERE timestamp < %s LIMIT %s", (cutoff, EXPIRE_CHUNK))
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            break
+        placeholders = ", ".join(["%s"] * len(ids))
+        cursor.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", tuple(ids))
+        cursor.execute(SWEEP_INSERT, (min(ids), max(ids)))
+        conn.commit()
+        deleted += len(ids)
+    cursor.close()
+    return deleted
+
+def sweep_tokens(conn, table=TABLE_NAME, directory=ARCHIVE_DIR):
+    """Delete the search tokens of expired rows; returns how many.
+
+    Only the id ranges queued in token_sweeps by retention are walked, and
+    within them only tokens whose row is neither live nor archived go.
+    Imported rows can sit anywhere in a range, so each id is checked. This
+    runs after archiving in the same maintenance pass, so no row moves into
+    the archive while it looks.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT first_id, last_id FROM token_sweeps ORDER BY first_id")
+    ranges = cursor.fetchall()
+    archived = ArchivedIds(directory) if ranges else None
+    swept = 0
+    for first_id, last_id in ranges:
+        start = first_id
+        while True:
+            cursor.execute(
+                "SELECT DISTINCT log_id FROM log_tokens WHERE log_id >= %s AND log_id <= %s "
+                "ORDER BY log_id LIMIT %s",
+                (start, last_id, EXPIRE_CHUNK)
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                break
+            placeholders = ", ".join(["%s"] * len(ids))
+            cursor.execute(f"SELECT id FROM {table} WHERE id IN ({placeholders})", tuple(ids))
+            live = {row[0] for row in cursor.fetchall()}
+            orphans = [id_ for id_ in ids if id_ not in live and id_ not in archived]
+            if orphans:
+                placeholders = ", ".join(["%s"] * len(orphans))
+                cursor.execute(f"DELETE FROM log_tokens WHERE log_id IN ({placeholders})", tuple(orphans))
+                swept += cursor.rowcount
+                conn.commit()
+            start = ids[-1] + 1
+        cursor.execute("DELETE FROM token_sweeps WHERE first_id = %s AND last_id = %s", (first_id, last_id))
+        conn.commit()
+    cursor.close()
+    return swept
+
+def maintain(conn, now=None, convert=False, user_key=None):
+    """Keep future partitions in place, archive aged rows and expire data past RETENTION_DAYS.
+
+    Archiving needs the user key to re-encrypt rows, so it only runs when one
+    is given. Returns a dict describing what was done, for logging.
+    """
+    result = {"added": 0, "dropped": 0, "deleted": 0, "converted": 0, "archived": 0, "segments_expired": 0,
+              "tokens_swept": 0, "partitioned": False}
+    partitions = []
+    if get_storage().partitioned:
+        cursor = conn.cursor()
+        partitions = list_partitions(cursor)
+        cursor.close()
+        if not partitions and convert:
+            result["converted"] = convert_table(conn, now)
+            cursor = conn.cursor()
+            partitions = list_partitions(cursor)
+            cursor.close()
+        if partitions:
+            result["partitioned"] = True
+            result["added"] = add_partitions(conn, partitions, now)
+
+    if user_key and ARCHIVE_AFTER_DAYS > 0:
+        result["archived"] = archive_rows(conn, user_key, partitions, now)
+        if result["archived"] and partitions:
+            cursor = conn.cursor()
+            partitions = list_partitions(cursor)
+            cursor.close()
+
+    cutoff = retention_cutoff(now)
+    if cutoff is None:
+        return result
+    if partitions:
+        # Whole periods are dropped; rows in the period straddling the cutoff stay until it ends
+        result["dropped"] = drop_partitions(conn, partitions, cutoff)
+    else:
+        result["deleted"] = delete_expired(conn, cutoff)
+    result["segments_expired"] = expire_segments(conn, cutoff)
+    result["tokens_swept"] = sweep_tokens(conn)
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM log_rollup WHERE bucket < %s", (cutoff,))
+    conn.commit()
+    cursor.close()
+    return result
+
+class MaintenanceThread:
+    """Runs `maintain` every MAINTENANCE_INTERVAL seconds next to the ingester."""
+
+    def __init__(self, interval=MAINTENANCE_INTERVAL, user_key=None):
+        self.interval = interval
+        self.user_key = user_key
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="maintenance", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        warned = False
+        while True:
+            try:
+                with get_db_connection() as conn:
+                    result = maintain(conn, user_key=self.user_key)
+                if any(result[k] for k in ("added", "dropped", "deleted", "archived", "segments_expired", "tokens_swept")):
+                    print(f"[INFO] Maintenance: {result}")
+                if get_storage().partitioned and not result["partitioned"] and not warned:
+                    # Converting rebuilds the table, so it is left to an explicit run
+                    print(f"[INFO] {TABLE_NAME} is not partitioned; run `uv run partitions.py` "
+                          "so retention can drop whole partitions.")
+                    warned = True
+            except Exception as e:
+                print(f"[ERROR] Maintenance failed: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stop.set()
+
+if __name__ == "__main__":
+    try:
+        conn = get_db_connection()
+        result = maintain(conn, convert=True)
+        conn.close()
+        print(f"✅ Maintenance done: {result}")
+    except Exception as e:
+        print(f"❌ Maintenance failed: {e}")
+        sys.exit(1)
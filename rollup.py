@@ -0,0 +1,136 @@
+import hmac
+import hashlib
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from decouple import config
+from lib import seal, unseal
+from storage import get_storage
+from blind_index import HOST, SERVICE, token, service_name
+
+ROLLUP_BUCKET_SECONDS = config("ROLLUP_BUCKET_SECONDS", default=60, cast=int)
+
+ROLLUP_UPSERT = get_storage().upsert(
+    "log_rollup", ("bucket", "state", "host_token", "service_token", "count"),
+    keys=("bucket", "state", "host_token", "service_token"), add=("count",)
+)
+LABEL_INSERT = get_storage().insert_ignore("rollup_labels", ("token", "kind", "label"))
+
+def bucket_start(ts, seconds=ROLLUP_BUCKET_SECONDS):
+    # Buckets are aligned within the day, so any size dividing a day works
+    ts = ts.replace(tzinfo=None, microsecond=0)
+    second_of_day = ts.hour * 3600 + ts.minute * 60 + ts.second
+    midnight = ts.replace(hour=0, minute=0, second=0)
+    return midnight + timedelta(seconds=second_of_day - second_of_day % seconds)
+
+def label_key(index_key):
+    # Display names are sealed with a key derived from the blind-index key, not with it directly
+    return hmac.new(index_key, b"rollup labels", hashlib.sha256).digest()
+
+def rollup_rows(batch, states, index_key, seconds=ROLLUP_BUCKET_SECONDS):
+    """Count parsed rows by (bucket, state, host token, service token).
+
+    Also returns the plaintext name behind each token, so the writer can store
+    a sealed label the first time a host or service shows up.
+    """
+    counts = Counter()
+    names = {}
+    for (ts, host, service, _), state in zip(batch, states):
+        host = host.lower()
+        service = service_name(service).lower()
+        host_token = token(index_key, HOST, host)
+        service_token = token(index_key, SERVICE, service)
+        names[host_token] = (HOST, host)
+        names[service_token] = (SERVICE, service)
+        counts[(bucket_start(ts, seconds), state, host_token, service_token)] += 1
+    return counts, names
+
+class RollupWriter:
+    """Adds rollup counts and new sealed labels inside the caller's transaction."""
+
+    def __init__(self, index_key):
+        self.key = label_key(index_key)
+        # Tokens whose label is already stored, so each name is sealed once per process
+        self.labelled = set()
+
+    def write(self, cursor, counts, names):
+        """Returns the tokens labelled here; pass them to `stored` once the transaction commits."""
+        if counts:
+            cursor.executemany(ROLLUP_UPSERT, [group + (count,) for group, count in counts.items()])
+        new = [(tok, kind, seal(name.encode(), self.key)) for tok, (kind, name) in names.items()
+               if tok not in self.labelled]
+        if new:
+            cursor.executemany(LABEL_INSERT, new)
+        return [tok for tok, _, _ in new]
+
+    def stored(self, tokens):
+        # Only after the commit: a rolled back label has to be written again with the next batch
+        self.labelled.update(tokens)
+
+class Dashboard:
+    """In-memory rollup window for the viewer, refreshed from the last bucket seen.
+
+    Each refresh reads only buckets at or after the newest one already loaded
+    (it may still be growing), so the cost follows the number of new buckets.
+    """
+
+    def __init__(self, index_key, minutes=30, seconds=ROLLUP_BUCKET_SECONDS):
+        self.key = label_key(index_key)
+        self.window = timedelta(minutes=minutes)
+        self.seconds = seconds
+        self.buckets = defaultdict(Counter)
+        self.hosts = defaultdict(Counter)
+        self.services = defaultdict(Counter)
+        self.labels = {}
+        self._since = None
+
+    def refresh(self, cursor, now=None):
+        start = bucket_start((now or datetime.now()) - self.window, self.seconds)
+        since = max(start, self._since) if self._since else start
+        for old in [b for b in self.buckets if b < start]:
+            del self.buckets[old], self.hosts[old], self.services[old]
+        cursor.execute(
+            "SELECT bucket, state, host_token, service_token, count FROM log_rollup WHERE bucket >= %s",
+            (since,)
+        )
+        fresh = defaultdict(list)
+        for row in cursor.fetchall():
+            fresh[row[0]].append(row[1:])
+        for bucket, rows in fresh.items():
+            states, hosts, services = Counter(), Counter(), Counter()
+            for state, host_token, service_token, count in rows:
+                states[state] += count
+                services[bytes(service_token)] += count
+                if state == "failed":
+                    hosts[bytes(host_token)] += count
+            self.buckets[bucket], self.hosts[bucket], self.services[bucket] = states, hosts, services
+        if fresh:
+            self._since = max(fresh)
+        self._load_labels(cursor)
+
+    def _load_labels(self, cursor):
+        missing = {tok for counter in (*self.hosts.values(), *self.services.values()) for tok in counter}
+        missing -= self.labels.keys()
+        if not missing:
+            return
+        placeholders = ", ".join(["%s"] * len(missing))
+        cursor.execute(f"SELECT token, label FROM rollup_labels WHERE token IN ({placeholders})", tuple(missing))
+        for tok, label in cursor.fetchall():
+            try:
+                self.labels[bytes(tok)] = unseal(bytes(label), self.key).decode()
+            except ValueError:
+                self.labels[bytes(tok)] = "[integrity check failed]"
+
+    def per_bucket(self):
+        return [(bucket, self.buckets[bucket]) for bucket in sorted(self.buckets)]
+
+    def top(self, per_bucket, limit=5):
+        total = Counter()
+        for counter in per_bucket.values():
+            total.update(counter)
+        return [(self.labels.get(tok, "?"), count) for tok, count in total.most_common(limit)]
+
+    def top_hosts(self, limit=5):
+        return self.top(self.hosts, limit)
+
+    def top_services(self, limit=5):
+        return self.top(self.services, limit)
@@ -0,0 +1,187 @@
+import sys
+from decouple import config
+from lib import get_db_connection
+from storage import get_storage
+
+TABLE_NAME = config("TABLE_NAME", default="auth_log")
+
+# Idempotent statements bringing an existing install up to date; install.sh
+# creates the same objects for new installs.
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS import_ledger (
+        fingerprint CHAR(64) NOT NULL,
+        path VARCHAR(1024) NOT NULL,
+        lines_done BIGINT NOT NULL DEFAULT 0,
+        completed TINYINT(1) NOT NULL DEFAULT 0,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (fingerprint)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS data_keys (
+        id INT NOT NULL AUTO_INCREMENT,
+        period_start DATETIME NOT NULL,
+        wrapped_key VARCHAR(255) NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS index_keys (
+        id TINYINT NOT NULL,
+        wrapped_key VARCHAR(255) NOT NULL,
+        PRIMARY KEY (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS log_tokens (
+        token BINARY(16) NOT NULL,
+        log_id INT NOT NULL,
+        PRIMARY KEY (token, log_id),
+        KEY idx_log_id (log_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS log_rollup (
+        bucket DATETIME NOT NULL,
+        state VARCHAR(255) NOT NULL,
+        host_token BINARY(16) NOT NULL,
+        service_token BINARY(16) NOT NULL,
+        count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, state, host_token, service_token)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS rollup_labels (
+        token BINARY(16) NOT NULL,
+        kind VARCHAR(16) NOT NULL,
+        label VARBINARY(1024) NOT NULL,
+        PRIMARY KEY (token)
+    )
+    """,
+    # Id ranges expired by retention whose search tokens are still to be swept
+    """
+    CREATE TABLE IF NOT EXISTS token_sweeps (
+        first_id INT NOT NULL,
+        last_id INT NOT NULL,
+        PRIMARY KEY (first_id, last_id)
+    )
+    """,
+    f"ALTER TABLE `{TABLE_NAME}` ADD COLUMN IF NOT EXISTS key_id INT DEFAULT NULL",
+    f"ALTER TABLE `{TABLE_NAME}` ADD COLUMN IF NOT EXISTS payload BLOB DEFAULT NULL AFTER message",
+    # Size of the file when its import completed, so a file that grew since is resumed, and
+    # the length of the head behind the fingerprint for files shorter than importer.IDENTITY_BYTES
+    "ALTER TABLE import_ledger ADD COLUMN IF NOT EXISTS file_size BIGINT NOT NULL DEFAULT 0 AFTER lines_done",
+    "ALTER TABLE import_ledger ADD COLUMN IF NOT EXISTS head_len INT NOT NULL DEFAULT 65536 AFTER file_size",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS kdf_params VARCHAR(255) DEFAULT NULL",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS key_check CHAR(64) DEFAULT NULL",
+    # Time-range and state filters in the viewer are index range scans
+    f"CREATE INDEX IF NOT EXISTS idx_state_ts ON `{TABLE_NAME}` (state, timestamp)",
+    f"CREATE INDEX IF NOT EXISTS idx_timestamp ON `{TABLE_NAME}` (timestamp)",
+]
+
+def sqlite_schema(table=TABLE_NAME):
+    # The embedded backend has no installer, so this creates everything install.sh would
+    return [
+        f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT NULL,
+            hostname TEXT DEFAULT NULL,
+            service TEXT DEFAULT NULL,
+            message TEXT DEFAULT NULL,
+            payload BLOB DEFAULT NULL,
+            state TEXT DEFAULT NULL,
+            key_id INTEGER DEFAULT NULL
+        )
+        """,
+        f"CREATE INDEX IF NOT EXISTS idx_state_ts ON {table} (state, timestamp)",
+        f"CREATE INDEX IF NOT EXISTS idx_timestamp ON {table} (timestamp)",
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            password_hash TEXT NOT NULL,
+            kdf_salt BLOB NOT NULL,
+            kdf_params TEXT DEFAULT NULL,
+            key_check TEXT DEFAULT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS import_ledger (
+            fingerprint TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            lines_done INTEGER NOT NULL DEFAULT 0,
+            file_size INTEGER NOT NULL DEFAULT 0,
+            head_len INTEGER NOT NULL DEFAULT 65536,
+            completed INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS data_keys (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            period_start DATETIME NOT NULL,
+            wrapped_key TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS index_keys (
+            id INTEGER PRIMARY KEY,
+            wrapped_key TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS log_tokens (
+            token BLOB NOT NULL,
+            log_id INTEGER NOT NULL,
+            PRIMARY KEY (token, log_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_log_id ON log_tokens (log_id)",
+        """
+        CREATE TABLE IF NOT EXISTS token_sweeps (
+            first_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            PRIMARY KEY (first_id, last_id)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS log_rollup (
+            bucket DATETIME NOT NULL,
+            state TEXT NOT NULL,
+            host_token BLOB NOT NULL,
+            service_token BLOB NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, state, host_token, service_token)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS rollup_labels (
+            token BLOB PRIMARY KEY,
+            kind TEXT NOT NULL,
+            label BLOB NOT NULL
+        )
+        """,
+    ]
+
+# Columns added after a table was first created; SQLite has no ADD COLUMN IF NOT EXISTS
+SQLITE_COLUMNS = [
+    ("import_ledger", "file_size", "INTEGER NOT NULL DEFAULT 0"),
+    ("import_ledger", "head_len", "INTEGER NOT NULL DEFAULT 65536"),
+]
+
+def migrate(conn):
+    get_storage().migrate(conn)
+
+if __name__ == "__main__":
+    try:
+        conn = get_db_connection()
+        migrate(conn)
+        conn.close()
+        print("✅ Schema is up to date.")
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        sys.exit(1)
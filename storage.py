@@ -0,0 +1,270 @@
+import sqlite3
+from datetime import datetime
+from decouple import config
+
+DB_BACKEND = config("DB_BACKEND", default="mysql")
+SQLITE_PATH = config("SQLITE_PATH", default="logcrypt.db")
+SQLITE_BUSY_TIMEOUT = config("SQLITE_BUSY_TIMEOUT", default=10.0, cast=float)
+SQLITE_CACHED_STATEMENTS = 256
+TABLE_NAME = config("TABLE_NAME", default="auth_log")
+
+LOG_COLUMNS = ("timestamp", "hostname", "service", "message", "payload", "state", "key_id")
+USER_COLUMNS = "username, password_hash, kdf_salt, kdf_params, key_check"
+
+class Storage:
+    """What logcrypt needs from a database engine.
+
+    Queries that every engine understands are written once, with `%s`
+    placeholders, next to the code that runs them. Only the operations below,
+    and statements whose syntax differs between engines, come from the backend.
+    """
+
+    name = None
+    # True when there is no server process to start or wait for
+    embedded = False
+    # True when the log table can be split into time partitions (see partitions.py)
+    partitioned = False
+    # Distance between ids handed out in a row; only a MySQL setting can change it
+    id_step = 1
+
+    def __init__(self, table=TABLE_NAME):
+        self.table = table
+        columns = ", ".join(LOG_COLUMNS)
+        placeholders = ", ".join(["%s"] * len(LOG_COLUMNS))
+        self.insert_query = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
+
+    def connect(self):
+        raise NotImplementedError
+
+    def is_connection_error(self, error: Exception) -> bool:
+        raise NotImplementedError
+
+    def insert_ignore(self, table, columns) -> str:
+        raise NotImplementedError
+
+    def upsert(self, table, columns, keys, add=()) -> str:
+        """INSERT that updates the non-key columns of an existing row; columns in `add` are summed."""
+        raise NotImplementedError
+
+    def migrate(self, conn):
+        raise NotImplementedError
+
+    def insert_batch(self, cursor, rows) -> list:
+        """Insert log rows; returns the id of each one, in order."""
+        raise NotImplementedError
+
+    def fetch_range(self, cursor, condition="", params=(), limit=100):
+        """Log rows matching `condition`, newest first, as stored."""
+        where = f"WHERE {condition}" if condition else ""
+        cursor.execute(
+            f"SELECT id, {', '.join(LOG_COLUMNS)} FROM {self.table} {where} ORDER BY id DESC LIMIT %s",
+            tuple(params) + (limit,)
+        )
+        return cursor.fetchall()
+
+    def find_user(self, cursor, username=None):
+        """The user's key material, or the first user's when no name is given."""
+        query = f"SELECT {USER_COLUMNS} FROM users"
+        if username:
+            cursor.execute(f"{query} WHERE username = %s", (username,))
+        else:
+            cursor.execute(f"{query} LIMIT 1")
+        return cursor.fetchone()
+
+class MySQLStorage(Storage):
+    name = "mysql"
+    partitioned = True
+
+    def connect(self):
+        import mysql.connector
+        return mysql.connector.connect(
+            host="localhost",
+            user=config("DB_USER", default="grooot"),
+            password=config("DB_PASS", default="grooot"),
+            database=config("DB_NAME", default="grooot")
+        )
+
+    def is_connection_error(self, error):
+        import mysql.connector
+        return isinstance(error, (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError))
+
+    def insert_ignore(self, table, columns):
+        placeholders = ", ".join(["%s"] * len(columns))
+        return f"INSERT IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+
+    def upsert(self, table, columns, keys, add=()):
+        placeholders = ", ".join(["%s"] * len(columns))
+        updates = ", ".join(
+            f"{c} = {c} + VALUES({c})" if c in add else f"{c} = VALUES({c})"
+            for c in columns if c not in keys
+        )
+        return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) ON DUPLICATE KEY UPDATE {updates}"
+
+    def migrate(self, conn):
+        from schema import MIGRATIONS
+        cursor = conn.cursor()
+        for statement in MIGRATIONS:
+            cursor.execute(statement)
+        conn.commit()
+        cursor.close()
+
+    _autoinc = None
+
+    @property
+    def id_step(self):
+        return self._autoinc[0] if self._autoinc else 1
+
+    def insert_batch(self, cursor, rows):
+        if self._autoinc is None:
+            cursor.execute("SELECT @@auto_increment_increment, @@innodb_autoinc_lock_mode")
+            self._autoinc = tuple(int(value) for value in cursor.fetchone())
+        step, lock_mode = self._autoinc
+        if lock_mode == 2:
+            # Interleaved mode (required by Galera) can mix in ids of concurrent inserts, so only
+            # each row's own lastrowid is certain
+            ids = []
+            for row in rows:
+                cursor.execute(self.insert_query, row)
+                ids.append(cursor.lastrowid)
+            return ids
+        # executemany sends a single multi-row INSERT, which takes one block of ids
+        # starting at lastrowid, auto_increment_increment apart
+        cursor.executemany(self.insert_query, rows)
+        return [cursor.lastrowid + i * step for i in range(len(rows))]
+
+def _adapt_datetime(value):
+    # Stored like MySQL DATETIME: naive, and ordered correctly as text
+    return value.replace(tzinfo=None).isoformat(" ")
+
+def _convert_datetime(value):
+    return datetime.fromisoformat(value.decode())
+
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_converter("DATETIME", _convert_datetime)
+
+class SQLiteCursor:
+    """sqlite3 cursor taking the `%s` placeholders used throughout the code."""
+
+    _translated = {}
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    @classmethod
+    def _sql(cls, sql):
+        translated = cls._translated.get(sql)
+        if translated is None:
+            translated = cls._translated[sql] = sql.replace("%s", "?")
+        return translated
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(self._sql(sql), tuple(params or ()))
+        return self
+
+    def executemany(self, sql, rows):
+        self._cursor.executemany(self._sql(sql), rows)
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._cursor.close()
+
+class SQLiteConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return SQLiteCursor(self._conn.cursor())
+
+    def ping(self, reconnect=False):
+        self._conn.execute("SELECT 1")
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+class SQLiteStorage(Storage):
+    """Embedded database file, for hosts that should not run a MariaDB server.
+
+    WAL lets viewers read while log.py writes. Writes take the lock when the
+    transaction starts (IMMEDIATE), so a batch never fails half way on a lock
+    upgrade, and each batch is one transaction of prepared statements.
+    """
+
+    name = "sqlite"
+    embedded = True
+
+    def __init__(self, table=TABLE_NAME, path=SQLITE_PATH):
+        super().__init__(table)
+        self.path = path
+
+    def connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=SQLITE_BUSY_TIMEOUT,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level="IMMEDIATE",
+            check_same_thread=False,
+            cached_statements=SQLITE_CACHED_STATEMENTS,
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        # With WAL, NORMAL only risks the last commits on power loss, never corruption
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return SQLiteConnection(conn)
+
+    def is_connection_error(self, error):
+        # A busy writer outlasting the busy timeout; retrying the batch is safe
+        return isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+
+    def insert_ignore(self, table, columns):
+        placeholders = ", ".join(["%s"] * len(columns))
+        return f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+
+    def upsert(self, table, columns, keys, add=()):
+        placeholders = ", ".join(["%s"] * len(columns))
+        updates = ", ".join(
+            f"{c} = {table}.{c} + excluded.{c}" if c in add else f"{c} = excluded.{c}"
+            for c in columns if c not in keys
+        )
+        return (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) "
+            f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}"
+        )
+
+    def migrate(self, conn):
+        from schema import sqlite_schema, SQLITE_COLUMNS
+        cursor = conn.cursor()
+        for statement in sqlite_schema(self.table):
+            cursor.execute(statement)
+        for table, column, definition in SQLITE_COLUMNS:
+            cursor.execute(f"PRAGMA table_info({table})")
+            if column not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        conn.commit()
+        cursor.close()
+
+    def insert_batch(self, cursor, rows):
+        cursor.executemany(self.insert_query, rows)
+        # The transaction holds the write lock, so AUTOINCREMENT ids of the batch are consecutive
+        cursor.execute("SELECT last_insert_rowid()")
+        last_id = cursor.fetchone()[0]
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+
+BACKENDS = {backend.name: backend for backend in (MySQLStorage, SQLiteStorage)}
+
+_storage = None
+
+def get_storage() -> Storage:
+    global _storage
+    if _storage is None:
+        if DB_BACKEND not in BACKENDS:
+            raise ValueError(f"Unknown DB_BACKEND {DB_BACKEND!r}, expected one of {', '.join(BACKENDS)}")
+        _storage = BACKENDS[DB_BACKEND]()
+    return _storage
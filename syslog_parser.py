@@ -0,0 +1,131 @@
+import re
+from datetime import datetime, timedelta
+
+# 2025-06-20T10:15:30.123456+00:00 host sshd[123]: message
+RFC3339_RE = re.compile(
+    r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6})\d*)?(Z|[+-]\d\d:?\d\d)? "
+    r"(\S+) ([^:\s]+): ?(.*)"
+)
+# Jun 20 10:15:30 host sshd[123]: message
+BSD_RE = re.compile(
+    r"([A-Z][a-z]{2}) ([ \d]\d) (\d\d):(\d\d):(\d\d) (\S+) ([^:\s]+): ?(.*)"
+)
+BSD_TS_RE = re.compile(r"(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) ([ \d]\d) (\d\d):(\d\d):(\d\d)$")
+
+MONTHS = {name: i for i, name in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), start=1
+)}
+
+RFC3339 = "rfc3339"
+BSD = "bsd"
+DETECT_SAMPLE = 20
+
+class SyslogParser:
+    """Parses auth.log lines with a strategy chosen once per file.
+
+    Lines that do not match are counted in `rejected` instead of being reported
+    one by one; `last_rejected` keeps the most recent one for troubleshooting.
+    """
+
+    def __init__(self, fmt=None, now=None):
+        self.format = None
+        self.rejected = 0
+        self.last_rejected = None
+        self._now = now
+        self._ts_key = None
+        self._ts_value = None
+        if fmt:
+            self.set_format(fmt)
+
+    def set_format(self, fmt):
+        # Bind the strategy directly so per-line calls skip format dispatch
+        if fmt == RFC3339:
+            self.parse = self._parse_rfc3339
+        elif fmt == BSD:
+            self.parse = self._parse_bsd
+        else:
+            raise ValueError(f"Unknown syslog format: {fmt}")
+        self.format = fmt
+        self._ts_key = None
+
+    @staticmethod
+    def detect(lines):
+        scores = {RFC3339: 0, BSD: 0}
+        for line in lines:
+            if RFC3339_RE.match(line):
+                scores[RFC3339] += 1
+            elif BSD_RE.match(line):
+                scores[BSD] += 1
+        fmt, score = max(scores.items(), key=lambda item: item[1])
+        return fmt if score else None
+
+    def parse(self, line):
+        # Only reached before a format is known (or through a stale bound method)
+        if self.format is None:
+            fmt = self.detect([line])
+            if fmt is None:
+                return self._reject(line)
+            self.set_format(fmt)
+        return self.parse(line)
+
+    def parse_many(self, lines):
+        if self.format is None:
+            fmt = self.detect(lines[:DETECT_SAMPLE])
+            if fmt:
+                self.set_format(fmt)
+        return [parsed for parsed in map(self.parse, lines) if parsed]
+
+    def _reject(self, line):
+        self.rejected += 1
+        self.last_rejected = line
+        return None
+
+    def _parse_rfc3339(self, line):
+        parts = line.split(" ", 3)
+        if len(parts) < 3:
+            return self._reject(line)
+        stamp, host, tag = parts[0], parts[1], parts[2]
+        if tag[-1:] != ":":
+            return self._reject(line)
+        # Repeated stamps (no sub-second precision, or bursts) skip the conversion
+        if stamp == self._ts_key:
+            ts = self._ts_value
+        else:
+            try:
+                ts = datetime.fromisoformat(stamp)
+            except ValueError:
+                return self._reject(line)
+            self._ts_key, self._ts_value = stamp, ts
+        msg = parts[3].strip() if len(parts) > 3 else ""
+        return ts, host, tag[:-1], msg
+
+    def _parse_bsd(self, line):
+        if len(line) < 16 or line[15] != " ":
+            return self._reject(line)
+        # The 15-character "Mon DD HH:MM:SS" prefix repeats for every line in a second
+        key = line[:15]
+        if key == self._ts_key:
+            ts = self._ts_value
+        else:
+            m = BSD_TS_RE.match(key)
+            if m is None:
+                return self._reject(line)
+            mon, day, hour, minute, second = m.groups()
+            # The year is taken from the clock on every new stamp, so a tailer running across New Year moves on
+            now = self._now or datetime.now()
+            try:
+                ts = datetime(now.year, MONTHS[mon], int(day), int(hour), int(minute), int(second))
+            except ValueError:
+                return self._reject(line)
+            # Classic syslog has no year; a date in the future belongs to last year
+            if ts - now > timedelta(days=1):
+                ts = ts.replace(year=now.year - 1)
+            self._ts_key, self._ts_value = key, ts
+        parts = line[16:].split(" ", 2)
+        if len(parts) < 2:
+            return self._reject(line)
+        host, tag = parts[0], parts[1]
+        if tag[-1:] != ":":
+            return self._reject(line)
+        msg = parts[2].strip() if len(parts) > 2 else ""
+        return ts, host, tag[:-1], msg
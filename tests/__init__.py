@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+
+# Settings are read when modules are imported, so the tests pick an SQLite
+# database and their own runtime directory before any of them is.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="logcrypt-tests-")
+os.environ.update(
+    DB_BACKEND="sqlite",
+    SQLITE_PATH=os.path.join(WORKDIR, "logcrypt.db"),
+    ARCHIVE_DIR=os.path.join(WORKDIR, "archive"),
+    XDG_RUNTIME_DIR=WORKDIR,
+)
+sys.path.insert(0, ROOT)
+# The writer touches its update file in the working directory
+os.chdir(WORKDIR)
+
+from lib import get_db_connection  # noqa: E402
+from schema import migrate  # noqa: E402
+
+USER_KEY = b"k" * 32
+TABLES = ("auth_log", "log_tokens", "token_sweeps", "data_keys")
+
+def reset_database():
+    with get_db_connection() as conn:
+        migrate(conn)
+        cursor = conn.cursor()
+        for table in TABLES:
+            cursor.execute(f"DELETE FROM {table}")
+        conn.commit()
+        cursor.close()
+
+def query(sql, params=()):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        conn.commit()
+        cursor.close()
+        return rows
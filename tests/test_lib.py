@@ -0,0 +1,36 @@
+import unittest
+
+from lib import CIPHERS_BY_NAME, LRUCache, open_record, pack_fields, seal_record, unpack_fields
+
+KEY = b"k" * 32
+
+class RecordTest(unittest.TestCase):
+    def test_pack_round_trip(self):
+        fields = ("web", "", "naïve ✓ message")
+        self.assertEqual(unpack_fields(pack_fields(fields)), fields)
+
+    def test_seal_round_trip(self):
+        for cipher in CIPHERS_BY_NAME:
+            with self.subTest(cipher=cipher):
+                self.assertEqual(open_record(seal_record(("h", "s", "m"), KEY, cipher), KEY), ("h", "s", "m"))
+
+    def test_tampered_record_is_rejected(self):
+        record = bytearray(seal_record(("h", "s", "m"), KEY, "aes-gcm"))
+        record[-1] ^= 1
+        with self.assertRaises(ValueError):
+            open_record(bytes(record), KEY)
+        with self.assertRaises(ValueError):
+            open_record(b"\x7fjunk", KEY)
+
+class LRUCacheTest(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+
+if __name__ == "__main__":
+    unittest.main()
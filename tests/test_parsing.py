@@ -0,0 +1,46 @@
+import unittest
+from datetime import datetime
+
+from classifier import StateClassifier, build_classifier
+from syslog_parser import SyslogParser, BSD, RFC3339
+
+class ClassifierTest(unittest.TestCase):
+    def test_builtin_rules(self):
+        classify = build_classifier(path=None)
+        self.assertEqual(classify("Accepted password for root from 10.0.0.1"), "success")
+        self.assertEqual(classify("FAILED PASSWORD for root"), "failed")
+        self.assertEqual(classify("Failed to connect to host"), "error")
+        self.assertEqual(classify("nothing to see"), "unknown")
+
+    def test_earlier_rule_wins(self):
+        classify = StateClassifier([("abc", "long"), ("ab", "short")])
+        self.assertEqual(classify("xabc"), "long")
+        self.assertEqual(classify("xabd"), "short")
+        self.assertEqual(StateClassifier([("ab", "short"), ("abc", "long")])("xabc"), "short")
+
+    def test_overlapping_matches(self):
+        # "bcd" starts inside the "abc" match but comes first in rule order
+        classify = StateClassifier([("bcd", "first"), ("abc", "second")])
+        self.assertEqual(classify("abcd"), "first")
+
+class SyslogParserTest(unittest.TestCase):
+    def test_rfc3339(self):
+        parser = SyslogParser()
+        parsed = parser.parse_many(["2025-06-20T10:15:30.123456+00:00 web sshd[123]: Accepted password"])
+        self.assertEqual(parser.format, RFC3339)
+        ts, host, service, msg = parsed[0]
+        self.assertEqual((ts.hour, ts.microsecond, host, service, msg), (10, 123456, "web", "sshd[123]", "Accepted password"))
+
+    def test_bsd_year_rollover(self):
+        parser = SyslogParser(BSD, now=datetime(2026, 1, 1, 0, 5))
+        self.assertEqual(parser.parse("Dec 31 23:59:59 web sshd[1]: bye")[0], datetime(2025, 12, 31, 23, 59, 59))
+        self.assertEqual(parser.parse("Jan  1 00:00:01 web sshd[1]: hi")[0], datetime(2026, 1, 1, 0, 0, 1))
+
+    def test_rejected_lines_are_counted(self):
+        parser = SyslogParser(BSD, now=datetime(2026, 1, 1))
+        self.assertEqual(parser.parse_many(["garbage", "Jan  1 00:00:01 web no-colon here"]), [])
+        self.assertEqual(parser.rejected, 2)
+        self.assertEqual(parser.last_rejected, "Jan  1 00:00:01 web no-colon here")
+
+if __name__ == "__main__":
+    unittest.main()
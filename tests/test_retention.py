@@ -0,0 +1,63 @@
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from tests import USER_KEY, reset_database, query
+from lib import get_db_connection, load_index_key
+from log import BatchWriter
+from archive import SWEEP_INSERT, ArchivedIds, archive_rows, id_runs
+from partitions import period_start, sweep_tokens
+
+def write_logs(ages):
+    """One searchable row per age in days; returns their ids, oldest row first."""
+    with get_db_connection() as conn:
+        index_key = load_index_key(conn, USER_KEY)
+    now = datetime.now()
+    writer = BatchWriter(USER_KEY, index_key=index_key)
+    for i, days in enumerate(ages):
+        writer.put((now - timedelta(days=days), "web", "sshd[1]", f"Failed password for user{i} from 10.0.0.1"))
+    writer.close()
+    return [row[0] for row in query("SELECT id FROM auth_log ORDER BY id")]
+
+class RetentionTest(unittest.TestCase):
+    def setUp(self):
+        reset_database()
+        self.directory = tempfile.mkdtemp()
+
+    def archive(self):
+        with get_db_connection() as conn:
+            return archive_rows(conn, USER_KEY, after_days=3, directory=self.directory)
+
+    def test_undecryptable_rows_stay_live(self):
+        ids = write_logs([5] * 10)
+        bad = ids[4]
+        query("UPDATE auth_log SET payload = %s WHERE id = %s", (b"\x03" + b"x" * 40, bad))
+        self.archive()
+        self.assertEqual(query("SELECT id FROM auth_log"), [(bad,)])
+        archived = ArchivedIds(self.directory)
+        self.assertNotIn(bad, archived)
+        self.assertTrue(all(id_ in archived for id_ in ids if id_ != bad))
+
+    def test_sweep_keeps_tokens_of_live_and_archived_rows(self):
+        ids = write_logs([5] * 4 + [0] * 4)
+        self.archive()
+        expired = ids[4:6]
+        query(f"DELETE FROM auth_log WHERE id IN ({expired[0]}, {expired[1]})")
+        query(SWEEP_INSERT, (ids[0], ids[-1]))
+        with get_db_connection() as conn:
+            self.assertGreater(sweep_tokens(conn, directory=self.directory), 0)
+        remaining = {row[0] for row in query("SELECT DISTINCT log_id FROM log_tokens")}
+        self.assertEqual(remaining, set(ids) - set(expired))
+        self.assertEqual(query("SELECT COUNT(*) FROM token_sweeps"), [(0,)])
+
+    def test_id_runs(self):
+        self.assertEqual(id_runs([1, 2, 3, 5, 7, 8]), [[1, 3], [5, 5], [7, 8]])
+        self.assertEqual(id_runs([]), [])
+
+    def test_period_start(self):
+        ts = datetime(2025, 6, 19, 15, 30)  # a Thursday
+        self.assertEqual(period_start(ts, "day"), datetime(2025, 6, 19))
+        self.assertEqual(period_start(ts, "week"), datetime(2025, 6, 16))
+
+if __name__ == "__main__":
+    unittest.main()
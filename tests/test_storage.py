@@ -0,0 +1,76 @@
+import unittest
+from datetime import datetime
+
+from tests import reset_database, query
+from lib import get_db_connection
+from log import insert_rows
+from storage import MySQLStorage
+
+def raw_rows(count, start=0):
+    # Stored form of a row without its key id; the timestamp tells the rows apart
+    return [(datetime(2025, 1, 1, 0, 0, start + i), None, None, None, b"\x03payload", "success") for i in range(count)]
+
+class SQLiteInsertBatchTest(unittest.TestCase):
+    def setUp(self):
+        reset_database()
+
+    def insert(self, rows, tokens):
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            ids = insert_rows(cursor, rows, tokens, None)
+            conn.commit()
+            cursor.close()
+        return ids
+
+    def test_ids_and_tokens_follow_the_rows(self):
+        first = self.insert(raw_rows(3), [[b"a"], [b"b"], [b"c"]])
+        query("DELETE FROM auth_log WHERE id = %s", (first[-1],))
+        # Ids are not reused after a delete, so the next batch starts past the gap
+        ids = self.insert(raw_rows(3, start=10), [[b"d"], [], [b"e", b"f"]])
+        self.assertEqual(ids, [first[-1] + 1, first[-1] + 2, first[-1] + 3])
+        stored = dict(query("SELECT id, timestamp FROM auth_log"))
+        self.assertEqual([stored[id_].second for id_ in ids], [10, 11, 12])
+        tokens = sorted(query("SELECT token, log_id FROM log_tokens WHERE log_id >= %s", (ids[0],)))
+        self.assertEqual(tokens, [(b"d", ids[0]), (b"e", ids[2]), (b"f", ids[2])])
+
+class RecordingCursor:
+    """Hands out auto-increment ids like a MySQL cursor, `gap` apart per statement."""
+
+    def __init__(self, settings, gap=1):
+        self.settings = settings
+        self.gap = gap
+        self.next_id = 100
+        self.lastrowid = None
+        self.statements = []
+
+    def execute(self, sql, params=()):
+        self.statements.append(sql)
+        if sql.startswith("INSERT"):
+            self.lastrowid = self.next_id
+            self.next_id += self.gap
+
+    def executemany(self, sql, rows):
+        self.statements.append(sql)
+        self.lastrowid = self.next_id
+        self.next_id += self.gap * len(rows)
+
+    def fetchone(self):
+        return self.settings
+
+class MySQLInsertBatchTest(unittest.TestCase):
+    def test_ids_step_by_auto_increment_increment(self):
+        cursor = RecordingCursor((2, 1), gap=2)
+        self.assertEqual(MySQLStorage().insert_batch(cursor, raw_rows(3)), [100, 102, 104])
+        self.assertEqual(len(cursor.statements), 2)
+
+    def test_interleaved_lock_mode_reads_each_id(self):
+        # Concurrent inserts take the ids in between
+        cursor = RecordingCursor((1, 2), gap=3)
+        storage = MySQLStorage()
+        self.assertEqual(storage.insert_batch(cursor, raw_rows(3)), [100, 103, 106])
+        # The settings are read once per process
+        self.assertEqual(storage.insert_batch(cursor, raw_rows(1)), [109])
+        self.assertEqual(sum(sql.startswith("SELECT") for sql in cursor.statements), 1)
+
+if __name__ == "__main__":
+    unittest.main()